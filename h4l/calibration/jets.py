@@ -7,11 +7,9 @@ Custom jet energy calibration methods that disable data uncertainties (for searc
 from columnflow.calibration import Calibrator, calibrator
 from columnflow.calibration.cms.jets import jec, jer
 from columnflow.util import maybe_import
-from columnflow.production.util import attach_coffea_behavior
 from columnflow.columnar_util import set_ak_column
 
-# TODO: Define in util if we want to use this
-from h4l.util import lv_xyzt, lv_mass
+from h4l.util import LorentzVectors, lv_xyzt, lv_mass
 
 
 ak = maybe_import("awkward")
@@ -55,12 +53,11 @@ def jet_energy_init(self: Calibrator) -> None:
     uses={
         "Electron.{pt,eta,phi,mass}",
         "Muon.{pt,eta,phi,mass}",
-        "Jet.{pt,eta,phi,mass}",
+        "Jet.{pt,eta,phi,mass,rawFactor}",
         # index of electrons/muons matched to jets
         "Jet.{muonIdx1,muonIdx2,electronIdx1,electronIdx2}",
         # PF energy fractions
         "Jet.{chEmEF,muEF}",
-        attach_coffea_behavior,
     },
     produces={
         "Jet.{pt,eta,phi,mass,rawFactor}",
@@ -72,45 +69,36 @@ def jet_lepton_cleaner(self: Calibrator, events: ak.Array, **kwargs) -> ak.Array
     Calibrator to clean jet four-vectors from contributions from nearby leptons
     """
 
-    # load coffea behaviors for simplified arithmetic with vectors
-    events["Electron"] = ak.with_name(events.Electron, "PtEtaPhiMLorentzVector")
-    events["Muon"] = ak.with_name(events.Muon, "PtEtaPhiMLorentzVector")
-    events["Jet"] = ak.with_name(events.Jet, "PtEtaPhiMLorentzVector")
-
     # revert JEC for jet pt and jet mass,
     # set correction factor to 0
     events = set_ak_column(events, "Jet.pt", events.Jet.pt * (1 - events.Jet.rawFactor))
     events = set_ak_column(events, "Jet.mass", events.Jet.mass * (1 - events.Jet.rawFactor))
     events = set_ak_column(events, "Jet.rawFactor", 0)
 
-    # build jet lorentz vectors
+    # build flat jet and lepton lorentz vectors
+    # (no coffea behaviors needed, all arithmetic below is done on flat numpy buffers)
     jet_lv = lv_xyzt(events.Jet)
+    electron_lv = lv_xyzt(events.Electron)
+    muon_lv = lv_xyzt(events.Muon)
 
-    # create arrays with indices of leptons that are matched to jet,
-    # not if no matched lepton
-    idx_e1 = ak.mask(events.Jet.electronIdx1, events.Jet.electronIdx1 >= 0)
-    idx_e2 = ak.mask(events.Jet.electronIdx2, events.Jet.electronIdx2 >= 0)
-    idx_m1 = ak.mask(events.Jet.muonIdx1, events.Jet.muonIdx1 >= 0)
-    idx_m2 = ak.mask(events.Jet.muonIdx2, events.Jet.muonIdx2 >= 0)
-
-    # list with matched leptons
+    # list with leptons matched to jets (zero vectors where not matched)
+    # and the mask of jets with a matched lepton
     jet_leptons_types = [
-        (events.Electron[idx_e1], "e"),
-        (events.Electron[idx_e2], "e"),
-        (events.Muon[idx_m1], "mu"),
-        (events.Muon[idx_m2], "mu"),
+        (*electron_lv.take(events.Jet.electronIdx1), "e"),
+        (*electron_lv.take(events.Jet.electronIdx2), "e"),
+        (*muon_lv.take(events.Jet.muonIdx1), "mu"),
+        (*muon_lv.take(events.Jet.muonIdx2), "mu"),
     ]
 
     # total energy from clustered leptonic PF candidates
     jet_pf_energies = {
-      "mu": jet_lv.energy * events.Jet.muEF,
-      "e": jet_lv.energy * events.Jet.chEmEF,
+      "mu": jet_lv.energy * ak.to_numpy(ak.flatten(events.Jet.muEF, axis=1)),
+      "e": jet_lv.energy * ak.to_numpy(ak.flatten(events.Jet.chEmEF, axis=1)),
     }
     # subtract lepton contributions from jets
     tolerance = 0.1
-    for jet_lepton, jet_lepton_type in jet_leptons_types:
-        jet_lepton_lv = lv_xyzt(jet_lepton)
-        jet_lv_cleaned = lv_xyzt(jet_lv - jet_lepton_lv)
+    for jet_lepton_lv, has_lepton, jet_lepton_type in jet_leptons_types:
+        jet_lv_cleaned = jet_lv - jet_lepton_lv
         jet_pf_energy = jet_pf_energies[jet_lepton_type]
         jet_pf_energy_cleaned = jet_pf_energy - jet_lepton_lv.energy
         # only perform the cleaning of the current lepton
@@ -121,15 +109,10 @@ def jet_lepton_cleaner(self: Calibrator, events: ak.Array, **kwargs) -> ak.Array
 
         # calculate square of cleaned jet mass
         jet_lv_cleaned_mass_sq = jet_lv_cleaned.energy**2 - jet_lv_cleaned.rho**2
-        # mask values that would lead to imaginary masses,
-        # but substitute absolute value if the mass square is only negative within
+        # reject values that would lead to imaginary masses,
+        # but accept the absolute value if the mass square is only negative within
         # tolerance (high probablility that this was a lepton fake)
-        jet_lv_cleaned_mass = ak.mask(
-            np.sqrt(abs(jet_lv_cleaned_mass_sq)),
-            jet_lv_cleaned_mass_sq >= -tolerance,
-        )
-        # cleaning does not result in a negative/imaginary/undefined mass
-        mass_stays_positive = ~ak.is_none(jet_lv_cleaned_mass, axis=1)
+        mass_stays_positive = jet_lv_cleaned_mass_sq >= -tolerance
 
         # angle before/after cleaning is similar (delta_r < max_angle_diff)
         #
@@ -169,28 +152,31 @@ def jet_lepton_cleaner(self: Calibrator, events: ak.Array, **kwargs) -> ak.Array
         # angle_change_small = jet_lv.delta_phi(jet_lv_cleaned) <= max_angle_diff
 
         # AND of cleaning conditions
-        do_clean = mass_stays_positive & angle_change_small & lep_energy_pf_compatible
-        # `None` if no matched lepton -> no cleaning
-        do_clean = ak.fill_none(do_clean, False)
+        # (no matched lepton -> no cleaning)
+        do_clean = has_lepton & mass_stays_positive & angle_change_small & lep_energy_pf_compatible
         # update jet LV
-        jet_lv = ak.where(
+        jet_lv = LorentzVectors.where(
             do_clean,
             jet_lv_cleaned,
             jet_lv,
         )
         # update jet PF energies
-        jet_pf_energies[jet_lepton_type] = ak.where(
+        jet_pf_energies[jet_lepton_type] = np.where(
             do_clean,
             jet_pf_energy_cleaned,
             jet_pf_energy,
         )
 
     # save updated jet variables
-    jet_lv = lv_mass(jet_lv)
+    with np.errstate(invalid="ignore"):
+        jet_lv = lv_mass(jet_lv)
     for var in ["pt", "eta", "phi", "mass"]:
-        # ensure no missing values
-        value = ak.fill_none(ak.nan_to_none(getattr(jet_lv, var)), 0.0)
-        value = ak.where(np.isfinite(value), value, 0)
-        events = set_ak_column(events, f"Jet.{var}", value)
+        # ensure no missing or non-finite values, and use the absolute mass for mass squares
+        # that are negative within tolerance
+        value = ak.to_numpy(ak.flatten(jet_lv[var], axis=1))
+        value = np.where(np.isfinite(value), value, 0)
+        if var == "mass":
+            value = np.abs(value)
+        events = set_ak_column(events, f"Jet.{var}", ak.unflatten(value, ak.num(jet_lv, axis=1)))
 
     return events
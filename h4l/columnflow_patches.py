@@ -5,6 +5,8 @@ Collection of patches of underlying columnflow tasks.
 """
 
 import os
+import atexit
+import functools
 
 import law
 from columnflow.util import memoize
@@ -34,6 +36,264 @@ def patch_bundle_repo_exclude_files():
     logger.debug("patched exclude_files of cf.BundleRepo")
 
 
+@memoize
+def patch_array_function_profiling():
+    """
+    Wraps calls to all task array functions (calibrators, selectors, producers, categorizers) in an
+    :py:class:`h4l.util.ArrayFunctionProfiler` when the environment variable ``H4L_PROFILE_DIR`` is
+    set, writing reports per task branch to that directory.
+    """
+    profile_dir = os.getenv("H4L_PROFILE_DIR")
+    if not profile_dir:
+        return
+
+    from columnflow.columnar_util import TaskArrayFunction
+    from h4l.util import ArrayFunctionProfiler
+
+    profiler = ArrayFunctionProfiler(os.path.abspath(os.path.expandvars(os.path.expanduser(profile_dir))))
+    call = TaskArrayFunction.__call__
+
+    @functools.wraps(call)
+    def __call__(self, *args, **kwargs):
+        with profiler.record(self, args[0] if args else kwargs.get("events")):
+            return call(self, *args, **kwargs)
+
+    TaskArrayFunction.__call__ = __call__
+    atexit.register(profiler.log_summary)
+
+    logger.debug(f"patched TaskArrayFunction.__call__ to write profiles to {profiler.output_dir}")
+
+
+@memoize
+def patch_parallel_selection():
+    """
+    When ``h4l_selection_workers`` in the ``[analysis]`` section of the law config is larger than
+    one, lets the selector of ``cf.SelectEvents`` process each chunk in that many slices with
+    forked processes (see :py:func:`h4l.parallel.parallel_call_func`).
+    """
+    n_workers = law.config.get_expanded_int("analysis", "h4l_selection_workers", default=1)
+    if n_workers <= 1:
+        return
+
+    from columnflow.tasks.selection import SelectEvents
+    from h4l.parallel import parallel_call_func
+
+    run = SelectEvents.run
+
+    @functools.wraps(run)
+    def run_parallel(self):
+        selector_inst = self.selector_inst
+        selector_inst.call_func = parallel_call_func(
+            selector_inst.call_func,
+            selector_inst.produced_columns,
+            n_workers,
+        )
+        return run(self)
+
+    SelectEvents.run = run_parallel
+
+    logger.debug(f"patched SelectEvents.run to select chunks with {n_workers} processes")
+
+
+# families of tasks that read skims instead of the original NanoAOD files when enabled
+SKIM_TASK_FAMILIES = {"cf.CalibrateEvents", "cf.SelectEvents", "cf.ReduceEvents"}
+
+
+@memoize
+def patch_skim_inputs():
+    """
+    When ``h4l_read_skims`` is enabled in the ``[analysis]`` section of the law config, lets
+    calibration, selection and reduction read the four-lepton skims of
+    :py:class:`h4l.tasks.skim.SkimEvents` instead of the original NanoAOD files, and adds events
+    and MC weights removed by the skim to the selection statistics. Skims must exist beforehand so
+    that all three tasks consistently process the same events.
+    """
+    if not law.config.get_expanded_boolean("analysis", "h4l_read_skims", default=False):
+        return
+
+    from columnflow.tasks.external import GetDatasetLFNs
+    from columnflow.tasks.selection import SelectEvents
+    from h4l.tasks.skim import SkimEvents
+    from h4l.skim import add_skimmed_stats
+
+    iter_nano_files = GetDatasetLFNs.iter_nano_files
+
+    @functools.wraps(iter_nano_files)
+    def iter_skim_files(self, task, *args, **kwargs):
+        if task.task_family not in SKIM_TASK_FAMILIES:
+            yield from iter_nano_files(self, task, *args, **kwargs)
+            return
+
+        if len(task.dataset_inst.processes) != 1:
+            raise Exception(
+                f"cannot read skims for dataset {task.dataset_inst.name} with several processes, as "
+                "removed events cannot be attributed to processes in the selection statistics",
+            )
+        skim_task = SkimEvents.req(task, branch=task.branch, _exclude={"branches"})
+        if not skim_task.complete():
+            raise Exception(f"{skim_task} is required to be complete when h4l_read_skims is enabled")
+
+        outputs = skim_task.output()
+        if task.task_family == SelectEvents.task_family:
+            task._h4l_skim_stats = outputs["stats"].load(formatter="json")
+        task.publish_message(f"reading skim {outputs['events'].path}")
+        yield (task.branch_data[0], outputs["events"])
+
+    run = SelectEvents.run
+
+    @functools.wraps(run)
+    def run_with_skim_stats(self):
+        result = run(self)
+        skim_stats = getattr(self, "_h4l_skim_stats", None)
+        if skim_stats:
+            stats_target = self.output()["stats"]
+            process_id = self.dataset_inst.processes.get_first().id
+            stats = add_skimmed_stats(stats_target.load(formatter="json"), skim_stats, process_id)
+            stats_target.dump(stats, indent=4, formatter="json")
+        return result
+
+    GetDatasetLFNs.iter_nano_files = iter_skim_files
+    SelectEvents.run = run_with_skim_stats
+
+    logger.debug("patched GetDatasetLFNs.iter_nano_files and SelectEvents.run to read skims")
+
+
+@memoize
+def patch_merge_shifted_histograms():
+    """
+    Lets ``cf.MergeShiftedHistograms`` require each ``cf.MergeHistograms`` task only once. Shifts
+    unknown to the histogramming, such as the weight-only shifts filled by the nominal task with
+    :py:func:`h4l.histogramming.weights.weight_matrix_hists`, resolve to the nominal task, whose
+    histograms would otherwise be added once per shift.
+    """
+    from columnflow.tasks.histograms import MergeHistograms, MergeShiftedHistograms
+
+    def unique(reqs: dict) -> dict:
+        seen = set()
+        for key, req in list(reqs.items()):
+            if not isinstance(req, MergeHistograms):
+                continue
+            if req.task_id in seen:
+                del reqs[key]
+            seen.add(req.task_id)
+        return reqs
+
+    requires = MergeShiftedHistograms.requires
+    workflow_requires = MergeShiftedHistograms.workflow_requires
+
+    @functools.wraps(requires)
+    def requires_unique(self):
+        return unique(requires(self))
+
+    @functools.wraps(workflow_requires)
+    def workflow_requires_unique(self):
+        return unique(workflow_requires(self))
+
+    MergeShiftedHistograms.requires = requires_unique
+    MergeShiftedHistograms.workflow_requires = workflow_requires_unique
+
+    logger.debug("patched MergeShiftedHistograms to require each MergeHistograms task once")
+
+
+@memoize
+def patch_produce_columns_variables():
+    """
+    Adds a ``--variables`` parameter to ``cf.ProduceColumns``, which downstream tasks such as
+    ``cf.CreateHistograms`` pass on when requiring it, so that producers can compute the observables
+    of the requested variables (see :py:func:`h4l.observables.requested_observables`). The parameter
+    is reduced to the variables that need observables other than the defaults of the config, and
+    only kept for producers that compute observables. Their columns are stored in a separate
+    directory, while all other requirements share the outputs with the default observables.
+    """
+    from columnflow.tasks.production import ProduceColumns
+    from h4l.observables import extra_observable_variables
+    from h4l.production.invariant_mass import four_lep_invariant_mass
+
+    def produces_observables(producer_inst) -> bool:
+        insts, seen = [producer_inst], set()
+        while insts:
+            inst = insts.pop()
+            if isinstance(inst, four_lep_invariant_mass):
+                return True
+            seen.add(inst)
+            insts.extend(dep for dep in inst.get_dependencies() if dep not in seen)
+        return False
+
+    ProduceColumns.variables = law.CSVParameter(
+        default=(),
+        description="variables whose observables are produced in addition to the defaults of the "
+        "config; empty default",
+        brace_expand=True,
+    )
+
+    resolve_param_values = ProduceColumns.resolve_param_values.__func__
+    store_parts = ProduceColumns.store_parts
+
+    @functools.wraps(resolve_param_values)
+    def resolve_param_values_variables(cls, params):
+        params = resolve_param_values(cls, params)
+        config_inst = params.get("config_inst")
+        producer_inst = params.get("producer_inst")
+        if params.get("variables") and config_inst and producer_inst:
+            params["variables"] = (
+                extra_observable_variables(config_inst, params["variables"])
+                if produces_observables(producer_inst) else
+                ()
+            )
+        return params
+
+    @functools.wraps(store_parts)
+    def store_parts_variables(self):
+        parts = store_parts(self)
+        if self.variables:
+            parts.insert_after("producer", "variables", f"vars__{'__'.join(self.variables)}")
+        return parts
+
+    ProduceColumns.resolve_param_values = classmethod(resolve_param_values_variables)
+    ProduceColumns.store_parts = store_parts_variables
+
+    logger.debug("patched ProduceColumns to produce the observables of requested variables")
+
+
+@memoize
+def patch_correction_registry():
+    """
+    When ``h4l_correction_registry`` is enabled in the ``[analysis]`` section of the law config,
+    routes ``correctionlib.CorrectionSet.from_string``, used by the setup of columnflow's
+    calibrators and producers, through :py:meth:`h4l.corrections.CorrectionRegistry.from_string`
+    of the process-wide registry, so that each correction file is parsed only once per process,
+    and logs the load times and counters of the registry at exit.
+    """
+    if not law.config.get_expanded_boolean("analysis", "h4l_correction_registry", default=False):
+        return
+
+    from columnflow.util import maybe_import
+    correctionlib = maybe_import("correctionlib")
+    if not correctionlib:
+        return
+
+    from h4l.corrections import correction_registry
+
+    from_string = correctionlib.highlevel.CorrectionSet.from_string
+    correction_registry.parse_string = from_string
+
+    @functools.wraps(from_string)
+    def from_string_memoized(data):
+        return correction_registry.from_string(data)
+
+    correctionlib.highlevel.CorrectionSet.from_string = staticmethod(from_string_memoized)
+    atexit.register(correction_registry.log_summary)
+
+    logger.debug("patched correctionlib.CorrectionSet.from_string to use the h4l correction registry")
+
+
 @memoize
 def patch_all():
     patch_bundle_repo_exclude_files()
+    patch_array_function_profiling()
+    patch_correction_registry()
+    patch_merge_shifted_histograms()
+    patch_produce_columns_variables()
+    # before patch_skim_inputs, which wraps the run method of cf.SelectEvents
+    patch_parallel_selection()
+    patch_skim_inputs()
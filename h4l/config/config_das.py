@@ -96,6 +96,17 @@ def add_das_config(
         for trigger in triggers
     }
 
+    # bit positions of all triggers in the packed trigger_bits column,
+    # assigned in the order of the trigger matrix
+    cfg.x.trigger_bits = {
+        trigger: bit
+        for bit, trigger in enumerate(
+            trigger
+            for _, triggers in cfg.x.trigger_matrix
+            for trigger in sorted(triggers)
+        )
+    }
+
     # add processes we are interested in
     process_names = [
         # data
@@ -285,6 +296,11 @@ def add_das_config(
     cfg.x.default_categories = ("cat_incl",)
     cfg.x.default_variables = ("jet1_pt",)
 
+    # variables whose derived four-lepton observables (see h4l.observables) are always produced by
+    # the four_lep_invariant_mass producer, others such as "pt4l" or "iso4l" are produced when
+    # requested through --variables
+    cfg.x.default_observable_variables = ("m4l", "mz1", "mz2", "mzz")
+
     # process groups for conveniently looping over certain processs
     # (used in wrapper_factory and during plotting)
     cfg.x.process_groups = {}
@@ -306,7 +322,7 @@ def add_das_config(
     cfg.x.shift_groups = {}
 
     # selector step groups for conveniently looping over certain steps
-    # (used in cutflow tasks)
+    # (used in cutflow tasks, and for the cutflow_<group> yields in the selection stats)
     # TODO #
     # Task 2.
     # Expand selection to use HZZ4L official one
@@ -316,11 +332,101 @@ def add_das_config(
         "default": ["trigger", "four_leptons", "m_z", "m_z1", "m_zz"],
     }
 
+    # bit positions of all selector steps in the packed step_bits column
+    # (read back by h4l.selection.stats.increment_cutflow_stats for the selector step groups)
+    cfg.x.selector_step_bits = {
+        step: bit
+        for bit, step in enumerate(["json", "trigger", "four_leptons", "m_z", "m_z1", "m_zz", "h_window"])
+    }
+
+    # mass windows and thresholds on the ZZ candidates, evaluated in one pass by the default selector
+    # and stored as bits (in this order) of the mass_window_bits column, each given as the candidate
+    # mass ("mz1", "mz2" or "mzz") with exclusive lower and upper bounds (None for an open bound), or
+    # as several such ranges to be passed by the same candidate, an event passes a window when any
+    # pairing of its leptons does
+    # (read back with h4l.util.mass_window_mask, the m_z, m_z1, m_zz and h_window selector steps use
+    # the entries of the same name, windows for further studies can be added here)
+    cfg.x.mass_windows = {
+        "m_z": (("mz1", 12.0, 120.0), ("mz2", 12.0, 120.0)),
+        "m_z1": ("mz1", 40.0, None),
+        "m_zz": ("mzz", 70.0, None),
+        "h_window": ("mzz", 105.0, 140.0),
+    }
+
     # selector step labels (for cutflow plots)
     cfg.x.selector_step_labels = {
         "four_leptons": r"4$\ell$",
     }
 
+    # electron MVA working points as thresholds on the BDT score per (pt bin, |eta_SC| bin), with
+    # bins defined by their inner edges (pt bins include their upper, |eta_SC| bins their lower edge)
+    # (used in electron_selection, no requirement is applied when None)
+    electron_mva_wps = {
+        # pre-UL WP for Run II (miniAOD branch: Run2_CutBased_BTag16)
+        "preUL": {
+            "pt_edges": [10.0],
+            "abs_eta_sc_edges": [0.8, 1.479],
+            "thresholds": [
+                [0.85216885148, 0.82684550976, 0.86937630022],
+                [0.98248928759, 0.96919224579, 0.79349796445],
+            ],
+        },
+        # UL WP (miniAOD branch Run2_CutBased_UL)
+        "UL": {
+            "pt_edges": [10.0],
+            "abs_eta_sc_edges": [0.8, 1.479],
+            "thresholds": [
+                [0.9128577458, 0.9056792368, 0.9439440575],
+                [0.1559788054, 0.0273863727, -0.5532483665],
+            ],
+        },
+    }
+    cfg.x.electron_mva_wp = None
+    if year in (2017, 2018):
+        cfg.x.electron_mva_wp = DotDict.wrap(electron_mva_wps["preUL" if campaign.x("preUL", False) else "UL"])
+
+    # lepton requirements per era as named cuts on the columns of each collection, written with the
+    # same semantics as on numpy arrays, compiled into a single fused evaluation per collection
+    # (h4l.util.CutTable) and used to declare the columns read by the lepton selectors
+    # (used in electron_selection, in addition to the MVA working point, and muon_selection)
+    lepton_cuts = {
+        "Run2": {
+            "Electron": {
+                "pt": "pt > 7",
+                "eta": "abs(eta) < 2.5",
+                "dxy": "dxy < 0.5",
+                "dz": "dz < 1.0",
+                "sip3d": "abs(sip3d) < 4",
+            },
+            "Muon": {
+                # global or tracker muon
+                "global_or_tracker": "isGlobal | (isTracker & nStations > 0)",
+                # discard standalone muon tracks if reconstructed in muon system only
+                # (WIP: discard muons with muonBestTrackType == 2 even if they are global or tracker
+                # muons, muonBestTrackType not available?)
+                "not_standalone_only": "~isStandalone | (nTrackerLayers > 0)",
+                "pt": "pt > 5",
+                "eta": "abs(eta) < 2.4",
+                "dxy": "dxy < 0.5",
+                "dz": "dz < 1.0",
+                "sip3d": "abs(sip3d) < 4",
+                # PF muon ID if pT < 200 GeV, PF muon ID or high-pT muon ID if pT > 200 GeV
+                "id": "((pt > 200) & highPtId > 0) | isPFcand",
+                "iso": "pfRelIso03_all < 0.35",
+            },
+        },
+    }
+    cfg.x.lepton_cuts = DotDict.wrap(lepton_cuts["Run2"])
+
+    # names of the lepton cuts above that define loose leptons in the four-lepton skim
+    # (h4l.skim.loose_lepton_cuts), which must remain a subset of the lepton selection
+    cfg.x.skim_lepton_cuts = ["pt", "eta"]
+
+    # factor applied to the uncalibrated lepton pt before the loose skim cuts, as a safety margin
+    # for calibrations that increase the pt of leptons (by a few percent at most), eta is not
+    # changed by energy scale calibrations and needs no margin
+    cfg.x.skim_lepton_pt_scale = 1.1
+
     # custom method and sandbox for determining dataset lfns
     cfg.x.get_dataset_lfns = None
     cfg.x.get_dataset_lfns_sandbox = None
@@ -506,20 +612,31 @@ def add_das_config(
 
     # columns to keep after certain steps
     cfg.x.keep_columns = DotDict.wrap({
+        # all columns used by calibrators, selectors and the reduction, since skims replace the
+        # original files as their inputs
+        "h4l.SkimEvents": {
+            "run", "luminosityBlock", "event",
+            "Electron.*", "Muon.*", "Jet.*", "Photon.*", "FsrPhoton.*", "GenJet.*", "GenPart.*",
+            "HLT.*", "Flag.*", "PV.*", "Pileup.*", "L1PreFiringWeight.*",
+            "MET.*", "RawMET.*", "PuppiMET.*", "ChsMET.*", "fixedGridRhoFastjet*", "Rho.*",
+            "genWeight", "LHEWeight.*", "LHEPdfWeight", "LHEScaleWeight", "PSWeight",
+        },
         "cf.ReduceEvents": {
             # general event info
             "run", "luminosityBlock", "event",
             # object info
             "Jet.btagDeepFlavB", "Jet.hadronFlavour",
             "Muon.pfRelIso04_all", "Muon.charge",
-            "Electron.deltaEtaSC", "Electron.charge",
+            "Electron.deltaEtaSC", "Electron.charge", "Electron.pfRelIso03_all",
             "Electron.mvaFall17V2Iso", "Electron.mvaHZZIso",
             "MET.pt", "MET.phi", "MET.significance", "MET.covXX", "MET.covXY", "MET.covYY",
             "PV.npvs",
             # columns added during selection
             "deterministic_seed", "process_id", "mc_weight", "cutflow.*",
             "category_ids", "mc_weight", "pdf_weight*", "murmuf_weight*",
-            "leptons_os", "single_triggered", "cross_triggered",
+            "leptons_os", "single_triggered", "cross_triggered", "trigger_bits", "step_bits",
+            "mass_window_bits",
+            "zz_candidate.*",
             "pu_weight*",
         } | {
             # four momenta information
@@ -528,7 +645,7 @@ def add_das_config(
             for var in ["pt", "eta", "phi", "mass", "e"]
         },
         "cf.MergeSelectionMasks": {
-            "normalization_weight", "process_id", "category_ids", "cutflow.*",
+            "normalization_weight", "process_id", "category_ids", "cutflow.*", "step_bits",
         },
         "cf.UniteColumns": {
             "*",
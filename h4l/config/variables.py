@@ -93,6 +93,7 @@ def add_variables(config: od.Config) -> None:
     config.add_variable(
         name="m4l",
         null_value=EMPTY_FLOAT,
+        aux={"observables": {"m4l"}},
         binning=(100, 50.0, 250.0),
         unit="GeV",
         x_title=r"$m_{4\ell}$",
@@ -137,6 +138,7 @@ def add_variables(config: od.Config) -> None:
         name="m4l_zoomed",
         expression="m4l",
         null_value = EMPTY_FLOAT,
+        aux={"observables": {"m4l"}},
         binning=(50.0, 100.0, 150.0),
         unit="GeV",
         x_title=r"$m_{4\ell}$ (zoomed)",
@@ -147,6 +149,7 @@ def add_variables(config: od.Config) -> None:
         name="mz1",
         expression="mz1",
         null_value=EMPTY_FLOAT,
+        aux={"observables": {"mz1"}},
         binning=(100, 0.0, 200.0),
         unit="GeV",
         x_title=r"$m_{Z_1}$",
@@ -156,6 +159,7 @@ def add_variables(config: od.Config) -> None:
         name="mz2",
         expression="mz2",
         null_value=EMPTY_FLOAT,
+        aux={"observables": {"mz2"}},
         binning=(100, 0.0, 200.0),
         unit="GeV",
         x_title=r"$m_{Z_2}$",
@@ -166,6 +170,7 @@ def add_variables(config: od.Config) -> None:
         name="mzz",
         expression="mzz",
         null_value=EMPTY_FLOAT,
+        aux={"observables": {"mzz"}},
         binning=(100, 50.0, 250.0),
         unit="GeV",
         x_title=r"$m_{ZZ}$",
@@ -174,7 +179,55 @@ def add_variables(config: od.Config) -> None:
         name="mzz_zoomed",
         expression="mzz",
         null_value = EMPTY_FLOAT,
+        aux={"observables": {"mzz"}},
         binning=(50.0, 100.0, 150.0),
         unit="GeV",
         x_title=r"$m_{ZZ}$ (zoomed)",
-    )
\ No newline at end of file
+    )
+
+    #
+    # derived four-lepton observables of the chosen ZZ candidate (see h4l.observables), only
+    # produced when requested through --variables
+    #
+
+    config.add_variable(
+        name="pt4l",
+        expression="pt4l",
+        null_value=EMPTY_FLOAT,
+        aux={"observables": {"pt4l"}},
+        binning=(40, 0.0, 200.0),
+        unit="GeV",
+        x_title=r"$p_{T}^{4\ell}$",
+    )
+    config.add_variable(
+        name="y4l",
+        expression="y4l",
+        null_value=EMPTY_FLOAT,
+        aux={"observables": {"y4l"}},
+        binning=(30, -3.0, 3.0),
+        x_title=r"$y_{4\ell}$",
+    )
+    config.add_variable(
+        name="z1_delta_r",
+        expression="z1_delta_r",
+        null_value=EMPTY_FLOAT,
+        aux={"observables": {"z1_delta_r"}},
+        binning=(40, 0.0, 4.0),
+        x_title=r"$\Delta R(\ell\ell)$ of $Z_1$",
+    )
+    config.add_variable(
+        name="z2_delta_r",
+        expression="z2_delta_r",
+        null_value=EMPTY_FLOAT,
+        aux={"observables": {"z2_delta_r"}},
+        binning=(40, 0.0, 4.0),
+        x_title=r"$\Delta R(\ell\ell)$ of $Z_2$",
+    )
+    config.add_variable(
+        name="iso4l",
+        expression="iso4l",
+        null_value=EMPTY_FLOAT,
+        aux={"observables": {"iso4l"}},
+        binning=(40, 0.0, 1.6),
+        x_title=r"Sum of relative isolations of the four leptons",
+    )
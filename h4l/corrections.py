@@ -0,0 +1,160 @@
+# coding: utf-8
+
+"""
+Process-wide registry of correctionlib evaluators, loading each external correction file only once
+per process (and per worker forked after loading) and handing out shared evaluators keyed by file,
+version and correction set name.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+import hashlib
+from typing import Any, Callable
+
+import law
+import order as od
+
+from columnflow.util import maybe_import
+
+correctionlib = maybe_import("correctionlib")
+
+logger = law.logger.get_logger(__name__)
+
+
+def external_file_version(config_inst: od.Config, name: str) -> str | None:
+    """
+    Returns the version of the external file *name* in ``config_inst.x.external_files``, given as
+    ``(path, version)``, or *None* when it is not versioned.
+    """
+    entry = config_inst.x.external_files.get(name)
+    return entry[1] if isinstance(entry, (tuple, list)) else None
+
+
+class CorrectionRegistry(object):
+    """
+    Registry of correctionlib correction sets and their evaluators. Correction sets are loaded once
+    per local file path and *version*, evaluators once per path, version and name, and both are
+    shared by all callers of the same process:
+
+    .. code-block:: python
+
+        corrector = correction_registry.get(bundle.files.electron_sf, "UL-Electron-ID-SF", "v1")
+
+    Load times as well as hit and miss counters are kept in :py:attr:`stats`.
+
+    :py:meth:`from_string` memoizes correction sets by the content of the string instead, which
+    lets columnflow's calibrators and producers share them once ``CorrectionSet.from_string`` is
+    routed through it (see :py:func:`h4l.columnflow_patches.patch_correction_registry`).
+    """
+
+    def __init__(self):
+        # function parsing correction sets from json strings, set when patching correctionlib
+        self.parse_string: Callable[[str], Any] | None = None
+        # (path, version) or content digest -> correction set
+        self._sets = {}
+        # (path, version, name) -> evaluator
+        self._evaluators = {}
+        # (path, version) or content digest -> load time in seconds
+        self.load_times = {}
+        self.stats = self._empty_stats()
+
+    @staticmethod
+    def _empty_stats() -> dict[str, int | float]:
+        return {
+            "file_hits": 0,
+            "file_misses": 0,
+            "evaluator_hits": 0,
+            "evaluator_misses": 0,
+            "load_time": 0.0,
+        }
+
+    @staticmethod
+    def _local_path(target: str | law.LocalFileTarget) -> str:
+        if isinstance(target, str):
+            return os.path.abspath(os.path.expandvars(os.path.expanduser(target)))
+        return target.abspath
+
+    def _load(self, key: Any, load: Callable[[], Any]) -> Any:
+        if key in self._sets:
+            self.stats["file_hits"] += 1
+            return self._sets[key]
+
+        self.stats["file_misses"] += 1
+        t0 = time.perf_counter()
+        self._sets[key] = load()
+        self.load_times[key] = time.perf_counter() - t0
+        self.stats["load_time"] += self.load_times[key]
+        logger.debug(f"loaded correction set {key} in {self.load_times[key]:.2f}s")
+        return self._sets[key]
+
+    def correction_set(
+        self,
+        target: str | law.LocalFileTarget,
+        version: str | None = None,
+    ) -> correctionlib.highlevel.CorrectionSet:
+        """
+        Returns the correction set in the local file *target* (a path or target, possibly gzipped)
+        with *version*, loading it on first access.
+        """
+        path = self._local_path(target)
+        return self._load((path, version), lambda: correctionlib.CorrectionSet.from_file(path))
+
+    def get(
+        self,
+        target: str | law.LocalFileTarget,
+        name: str,
+        version: str | None = None,
+    ) -> correctionlib.highlevel.Correction:
+        """
+        Returns the shared evaluator of the correction *name* in the correction set of the file
+        *target* with *version* (see :py:meth:`correction_set`).
+        """
+        key = (self._local_path(target), version, name)
+        if key in self._evaluators:
+            self.stats["evaluator_hits"] += 1
+        else:
+            self.stats["evaluator_misses"] += 1
+            self._evaluators[key] = self.correction_set(target, version)[name]
+        return self._evaluators[key]
+
+    def from_string(self, data: str) -> correctionlib.highlevel.CorrectionSet:
+        """
+        Returns the correction set parsed from the json string *data*, memoized by its content.
+        """
+        digest = hashlib.blake2b(data.encode(), digest_size=16).hexdigest()
+        parse = self.parse_string or correctionlib.CorrectionSet.from_string
+        return self._load(digest, lambda: parse(data))
+
+    def clear(self) -> None:
+        """
+        Removes all loaded correction sets and evaluators and resets the statistics.
+        """
+        self._sets.clear()
+        self._evaluators.clear()
+        self.load_times.clear()
+        self.stats = self._empty_stats()
+
+    def summary(self) -> str:
+        """
+        Returns a summary of the load times of all correction sets and of the hit and miss counters.
+        """
+        lines = [f"{'correction set':<100} {'load / s':>10}"]
+        lines.append("-" * len(lines[0]))
+        for key, load_time in self.load_times.items():
+            name = f"{os.path.basename(key[0])} ({key[1]})" if isinstance(key, tuple) else f"string {key}"
+            lines.append(f"{name:<100} {load_time:>10.3f}")
+        lines.append(", ".join(
+            f"{name}: {value:.3f}" if isinstance(value, float) else f"{name}: {value}"
+            for name, value in self.stats.items()
+        ))
+        return "\n".join(lines)
+
+    def log_summary(self) -> None:
+        if self.load_times:
+            logger.info(f"correction registry of process {os.getpid()}\n{self.summary()}")
+
+
+# registry shared by the whole process
+correction_registry = CorrectionRegistry()
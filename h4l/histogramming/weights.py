@@ -0,0 +1,74 @@
+# coding: utf-8
+
+"""
+Histogram producer filling the nominal and all weight-only shifts from a single read of the events.
+"""
+
+from columnflow.histogramming import HistProducer
+from columnflow.histogramming.default import cf_default
+from columnflow.hist_util import fill_hist
+from columnflow.util import maybe_import
+
+from h4l.production.weights import weight_variations
+
+ak = maybe_import("awkward")
+np = maybe_import("numpy")
+hist = maybe_import("hist")
+
+
+# extend columnflow's default hist producer
+@cf_default.hist_producer()
+def weight_matrix_hists(self: HistProducer, events: ak.Array, **kwargs) -> ak.Array:
+    """
+    Returns the ``event_weight_matrix`` column (see :py:func:`h4l.production.weights.weight_matrix`)
+    as weights, with one column per weight variation. In the nominal ``cf.CreateHistograms`` task,
+    each column is filled into the bin of its shift on the ``shift`` axis. Weight-only shifts are
+    not declared as shifts of this producer, so that requirements of ``cf.CreateHistograms`` with
+    these shifts resolve to the nominal task (and are merged only once, see
+    :py:func:`h4l.columnflow_patches.patch_merge_shifted_histograms`). In tasks of other shifts, such
+    as shape shifts, only the column of that shift (the nominal one for shifts that do not change
+    weights) is filled into its bin.
+    """
+    if self.dataset_inst.is_data:
+        return events, ak.Array(np.ones(len(events), dtype=np.float32))
+
+    return events, events.event_weight_matrix
+
+
+@weight_matrix_hists.init
+def weight_matrix_hists_init(self: HistProducer) -> None:
+    # shift names and ids in the order of the columns of the weight matrix
+    self.shift_names = []
+    self.shift_ids = []
+
+    if not getattr(self, "dataset_inst", None) or self.dataset_inst.is_data:
+        return
+
+    self.uses |= {"event_weight_matrix"}
+    self.shift_names = list(weight_variations(self.config_inst, self.dataset_inst))
+    self.shift_ids = [self.config_inst.get_shift(shift_name).id for shift_name in self.shift_names]
+
+
+@weight_matrix_hists.fill_hist
+def weight_matrix_hists_fill_hist(self: HistProducer, h: hist.Hist, data: dict, task, **kwargs) -> None:
+    if self.dataset_inst.is_data:
+        fill_hist(h, data, last_edge_inclusive=task.last_edge_inclusive)
+        return
+
+    weights = ak.to_numpy(data["weight"])
+
+    # in shifted tasks, fill only the weights of that shift into its bin
+    shift_inst = task.global_shift_inst
+    if not shift_inst.is_nominal:
+        i = self.shift_names.index(shift_inst.name) if shift_inst.name in self.shift_names else 0
+        fill_hist(h, {**data, "weight": weights[:, i]}, last_edge_inclusive=task.last_edge_inclusive)
+        return
+
+    # fill each weight variation into the bin of its shift
+    shift_ones = np.ones(len(weights), dtype=np.int32)
+    for i, shift_id in enumerate(self.shift_ids):
+        fill_hist(
+            h,
+            {**data, "shift": shift_ones * shift_id, "weight": weights[:, i]},
+            last_edge_inclusive=task.last_edge_inclusive,
+        )
@@ -0,0 +1,294 @@
+# coding: utf-8
+
+"""
+Registry of derived four-lepton observables, computed lazily from the events of one chunk. Each
+entry declares the columns it reads and the other entries it builds on, so that producers only read
+and compute what the requested variables need, while shared intermediate results such as the four
+leptons of the chosen ZZ candidate are computed once per chunk.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any, Callable, Iterable
+
+import order as od
+
+from columnflow.columnar_util import EMPTY_FLOAT
+from columnflow.util import maybe_import
+
+from h4l.util import LorentzVectors
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+
+
+class ObservableRegistry(object):
+    """
+    Registry of named observables. Functions are registered with the columns they read (*inputs*)
+    and the names of the entries they depend on (*requires*), and receive the events of a chunk and
+    a getter of other entries:
+
+    .. code-block:: python
+
+        @observables.register("pt4l", requires={"zz_p4"})
+        def pt4l(events, get):
+            return get("zz_p4").pt
+
+    Entries registered with ``column=False`` are intermediate results that are not stored as columns.
+    """
+
+    def __init__(self):
+        # name -> (function, inputs, requires, column)
+        self._entries = OrderedDict()
+
+    def register(
+        self,
+        name: str,
+        inputs: Iterable[str] = (),
+        requires: Iterable[str] = (),
+        column: bool = True,
+    ) -> Callable:
+        def decorator(func: Callable) -> Callable:
+            if name in self._entries:
+                raise ValueError(f"observable '{name}' already registered")
+            self._entries[name] = (func, set(inputs), set(requires), column)
+            return func
+        return decorator
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def resolve(self, names: Iterable[str]) -> list[str]:
+        """
+        Returns the observables *names* and all entries they depend on, each dependency ordered
+        before its dependents.
+        """
+        resolved = []
+
+        def visit(name, path):
+            if name not in self._entries:
+                raise ValueError(f"unknown observable '{name}'")
+            if name in path:
+                raise ValueError(f"circular dependency of observable '{name}'")
+            if name in resolved:
+                return
+            for dep in sorted(self._entries[name][2]):
+                visit(dep, path + (name,))
+            resolved.append(name)
+
+        for name in names:
+            visit(name, ())
+        return resolved
+
+    def inputs(self, names: Iterable[str]) -> set[str]:
+        """
+        Returns the columns read to compute the observables *names*.
+        """
+        return set().union(*(self._entries[name][1] for name in self.resolve(names)))
+
+    def columns(self, names: Iterable[str]) -> list[str]:
+        """
+        Returns the names of all entries stored as columns among the observables *names*.
+        """
+        return [name for name in names if self._entries[name][3]]
+
+    def evaluate(self, events: ak.Array, names: Iterable[str]) -> dict[str, Any]:
+        """
+        Computes the observables *names* on *events* and returns them mapped to their names. Every
+        entry, including intermediate ones, is computed at most once.
+        """
+        cache = {}
+
+        def get(name):
+            if name not in cache:
+                cache[name] = self._entries[name][0](events, get)
+            return cache[name]
+
+        return {name: get(name) for name in names}
+
+
+# registry of all h4l observables
+observables = ObservableRegistry()
+
+
+def variable_observables(variable_inst: od.Variable) -> set[str]:
+    """
+    Returns the observables declared by *variable_inst* through its ``observables`` auxiliary entry.
+    """
+    return set(variable_inst.x("observables", ()))
+
+
+def _variable_insts(config_inst: od.Config, variables: Iterable[str]) -> list[od.Variable]:
+    # variables of *config_inst*, with multi-dimensional ones given as "var_a-var_b" split
+    return [
+        config_inst.get_variable(name)
+        for variable in variables
+        for name in ([variable] if config_inst.has_variable(variable) else variable.split("-"))
+    ]
+
+
+def default_observables(config_inst: od.Config) -> set[str]:
+    """
+    Returns the observables that are always produced for *config_inst*, i.e., those needed by its
+    categories, which declare them in the same way as variables, and by the variables in
+    ``cfg.x.default_observable_variables``, or all variables of the config if not set.
+    """
+    variables = config_inst.x("default_observable_variables", None)
+    variable_insts = config_inst.variables if variables is None else _variable_insts(config_inst, variables)
+    return set().union(
+        *map(variable_observables, variable_insts),
+        *(set(category_inst.x("observables", ())) for category_inst, _, _ in config_inst.walk_categories()),
+    )
+
+
+def requested_observables(config_inst: od.Config, variables: Iterable[str] = ()) -> list[str]:
+    """
+    Returns the observables needed by the *variables* requested from a task, e.g. through
+    ``--variables``, in addition to the :py:func:`default_observables` of *config_inst*, ordered as
+    in the registry.
+    """
+    names = default_observables(config_inst).union(
+        *map(variable_observables, _variable_insts(config_inst, variables)),
+    )
+    return [name for name in observables.resolve(sorted(names)) if name in names]
+
+
+def extra_observable_variables(config_inst: od.Config, variables: Iterable[str]) -> tuple[str, ...]:
+    """
+    Returns the sorted names of the *variables* that need observables other than the
+    :py:func:`default_observables` of *config_inst*.
+    """
+    defaults = default_observables(config_inst)
+    return tuple(sorted({
+        variable for variable in variables
+        if set().union(*map(variable_observables, _variable_insts(config_inst, [variable]))) - defaults
+    }))
+
+
+#
+# intermediate results
+#
+
+@observables.register(
+    "candidate_leptons",
+    inputs={"zz_candidate.{channel,lepton_idx}", "{Electron,Muon}.pt"},
+    column=False,
+)
+def candidate_leptons(events: ak.Array, get: Callable) -> dict[str, Any]:
+    # positions of the four leptons of the chosen ZZ candidate, in the (Z1, Z2) order of its lepton
+    # indices, in flat buffers of all muons followed by all electrons and a trailing zero that events
+    # without candidate point to, and a function gathering per-lepton values of shape (events, 4)
+    channel = ak.to_numpy(events.zz_candidate.channel)
+    lepton_idx = ak.to_numpy(events.zz_candidate.lepton_idx).astype(np.int64)
+    has_cand = channel >= 0
+
+    mu_counts = ak.to_numpy(ak.num(events.Muon.pt, axis=1))
+    e_counts = ak.to_numpy(ak.num(events.Electron.pt, axis=1))
+    mu_starts = np.cumsum(mu_counts) - mu_counts
+    e_starts = mu_counts.sum() + np.cumsum(e_counts) - e_counts
+
+    # indices refer to the muons followed by the electrons of each event
+    is_muon = lepton_idx < mu_counts[:, None]
+    flat_idx = np.where(
+        is_muon,
+        mu_starts[:, None] + lepton_idx,
+        e_starts[:, None] + lepton_idx - mu_counts[:, None],
+    )
+    flat_idx = np.where(has_cand[:, None], flat_idx, mu_counts.sum() + e_counts.sum())
+
+    def gather(mu_values: np.ndarray, e_values: np.ndarray) -> np.ndarray:
+        return np.concatenate([mu_values, e_values, [0]])[flat_idx]
+
+    return {"has_cand": has_cand, "channel": channel, "gather": gather}
+
+
+@observables.register(
+    "candidate_p4",
+    inputs={"{Electron,Muon}.{pt,eta,phi,mass}"},
+    requires={"candidate_leptons"},
+    column=False,
+)
+def candidate_p4(events: ak.Array, get: Callable) -> list[LorentzVectors]:
+    # four-vectors of the four leptons of the chosen ZZ candidate, zero for events without candidate
+    gather = get("candidate_leptons")["gather"]
+    muons = LorentzVectors.from_collection(events.Muon)
+    electrons = LorentzVectors.from_collection(events.Electron)
+    comps = list(map(gather, muons.components, electrons.components))
+    return [LorentzVectors(*(c[:, i] for c in comps)) for i in range(4)]
+
+
+@observables.register("zz_p4", requires={"candidate_p4"}, column=False)
+def zz_p4(events: ak.Array, get: Callable) -> LorentzVectors:
+    l1, l2, l3, l4 = get("candidate_p4")
+    return l1 + l2 + l3 + l4
+
+
+@observables.register("z_pairs", requires={"candidate_p4"}, column=False)
+def z_pairs(events: ak.Array, get: Callable) -> tuple[tuple[LorentzVectors, LorentzVectors], ...]:
+    # lepton pairs of Z1 and Z2 in the order stored by the selection
+    l1, l2, l3, l4 = get("candidate_p4")
+    return (l1, l2), (l3, l4)
+
+
+def _candidate_only(get: Callable, values: np.ndarray) -> np.ndarray:
+    return np.where(get("candidate_leptons")["has_cand"], values, EMPTY_FLOAT)
+
+
+#
+# observables stored as columns
+#
+
+@observables.register("m4l", inputs={"{Electron,Muon}.{pt,eta,phi,mass}"})
+def m4l(events: ak.Array, get: Callable) -> np.ndarray:
+    # mass of the sum of the first four electrons and first four muons, in events with at least
+    # four leptons
+    fourlep = (
+        LorentzVectors.from_collection(events.Electron[:, :4]).sum() +
+        LorentzVectors.from_collection(events.Muon[:, :4]).sum()
+    )
+    n_leptons = ak.to_numpy(ak.num(events.Electron, axis=1) + ak.num(events.Muon, axis=1))
+    return np.where(n_leptons >= 4, fourlep.mass, EMPTY_FLOAT)
+
+
+# masses of the chosen candidate, as stored by the selection
+for _name in ["mz1", "mz2", "mzz"]:
+    observables.register(_name, inputs={f"zz_candidate.{_name}"})(
+        lambda events, get, _name=_name: events.zz_candidate[_name],
+    )
+
+
+@observables.register("pt4l", requires={"candidate_leptons", "zz_p4"})
+def pt4l(events: ak.Array, get: Callable) -> np.ndarray:
+    return _candidate_only(get, get("zz_p4").pt)
+
+
+@observables.register("y4l", requires={"candidate_leptons", "zz_p4"})
+def y4l(events: ak.Array, get: Callable) -> np.ndarray:
+    return _candidate_only(get, get("zz_p4").rapidity)
+
+
+@observables.register("z1_delta_r", requires={"candidate_leptons", "z_pairs"})
+def z1_delta_r(events: ak.Array, get: Callable) -> np.ndarray:
+    la, lb = get("z_pairs")[0]
+    return _candidate_only(get, la.delta_r(lb))
+
+
+@observables.register("z2_delta_r", requires={"candidate_leptons", "z_pairs"})
+def z2_delta_r(events: ak.Array, get: Callable) -> np.ndarray:
+    la, lb = get("z_pairs")[1]
+    return _candidate_only(get, la.delta_r(lb))
+
+
+@observables.register(
+    "iso4l",
+    inputs={"Electron.pfRelIso03_all", "Muon.pfRelIso04_all"},
+    requires={"candidate_leptons"},
+)
+def iso4l(events: ak.Array, get: Callable) -> np.ndarray:
+    # sum of the relative isolations of the four leptons
+    iso = get("candidate_leptons")["gather"](
+        ak.to_numpy(ak.flatten(events.Muon.pfRelIso04_all, axis=1)),
+        ak.to_numpy(ak.flatten(events.Electron.pfRelIso03_all, axis=1)),
+    )
+    return _candidate_only(get, iso.sum(axis=1))
@@ -0,0 +1,147 @@
+# coding: utf-8
+
+"""
+Intra-chunk parallel processing of ``cf.SelectEvents``, splitting the events of each chunk read by
+the task into contiguous slices that are selected by a pool of forked worker processes. The run
+method of the task is not replaced, only the call of its top-level selector per chunk (see
+:py:func:`parallel_call_func`), so reading, writing and outputs remain those of the columnflow
+version in use. Workers inherit the task with its selector after the selector setup, so that
+read-only resources (e.g. the lumi mask and trigger tables) are loaded only once and shared
+copy-on-write. Produced columns, selection results and statistics of all slices are merged in
+slice order.
+
+Selectors must be event-local, i.e., their results for an event must not depend on the other
+events of the chunk. An exception is columnflow's ``mc_weight``, which chooses between
+``genWeight`` and ``LHEWeight_originalXWGTUP`` per call, and thus per slice here. This matches the
+choice per chunk as long as ``genWeight`` is either always one or never one in a dataset.
+"""
+
+from __future__ import annotations
+
+import copy
+import multiprocessing
+from collections import defaultdict
+from typing import Callable
+
+from columnflow.columnar_util import Route, has_ak_column, set_ak_column
+from columnflow.util import maybe_import
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+
+
+# state of the call being processed, set before forking workers
+_state: dict = {}
+
+
+def _plain_dict(obj):
+    # convert nested (default)dicts, possibly with unpicklable default factories, to plain dicts
+    if isinstance(obj, dict):
+        return {key: _plain_dict(value) for key, value in obj.items()}
+    return obj
+
+
+def _add_counts(dst: dict, src: dict) -> dict:
+    # adds counts in src recursively to dst, like cf.MergeSelectionStats but keeping the types of
+    # counts as when filling dst directly
+    for key, obj in src.items():
+        if isinstance(obj, dict):
+            _add_counts(dst.setdefault(key, {}), obj)
+        elif key in dst or isinstance(dst, defaultdict):
+            dst[key] += obj
+        else:
+            dst[key] = obj
+    return dst
+
+
+def _concatenate(values: list):
+    # concatenates per-slice values of a selection result, with dicts merged key by key, and values
+    # other than arrays of the slice lengths (e.g. auxiliary objects) taken from the first slice
+    first = values[0]
+    if isinstance(first, dict):
+        merged = copy.copy(first)
+        merged.update({key: _concatenate([value[key] for value in values]) for key in first})
+        return merged
+    if isinstance(first, (np.ndarray, ak.Array)):
+        if isinstance(first, np.ndarray):
+            return np.concatenate(values)
+        return ak.concatenate(values)
+    return first
+
+
+def _select_slice(index: int) -> tuple[dict, object, dict]:
+    """
+    Selects the slice with *index* of the events in :py:data:`_state`, and returns the columns
+    produced by the selector, its selection result and statistics.
+    """
+    start, stop = _state["slices"][index]
+    stats = defaultdict(float)
+    events, results = _state["call_func"](_state["events"][start:stop], stats, **_state["kwargs"])
+    columns = {
+        str(route): route.apply(events)
+        for route in _state["produced_routes"]
+        if has_ak_column(events, route)
+    }
+    return columns, results, _plain_dict(stats)
+
+
+def slice_bounds(n_events: int, n_slices: int) -> list[tuple[int, int]]:
+    """
+    Returns the start and stop indices of *n_slices* contiguous slices of similar size covering
+    *n_events* events, omitting empty slices.
+    """
+    edges = np.linspace(0, n_events, n_slices + 1).astype(int)
+    return [(int(start), int(stop)) for start, stop in zip(edges[:-1], edges[1:]) if stop > start]
+
+
+def parallel_call_func(
+    call_func: Callable,
+    produced_columns: set,
+    n_workers: int,
+) -> Callable:
+    """
+    Returns a replacement of the *call_func* of a top-level selector that splits the events it is
+    called with into *n_workers* slices, each processed by *call_func* in a forked process. The
+    *produced_columns* of the selector are set on the events in the parent process, all array
+    fields of the selection results are concatenated, and statistics are added to those passed to
+    the call.
+    """
+    produced_routes = sorted({Route(column) for column in produced_columns}, key=str)
+
+    def call(events, stats: dict, **kwargs):
+        slices = slice_bounds(len(events), n_workers)
+        if len(slices) <= 1:
+            return call_func(events, stats, **kwargs)
+
+        _state.clear()
+        _state.update({
+            "call_func": call_func,
+            "events": events,
+            "kwargs": kwargs,
+            "slices": slices,
+            "produced_routes": produced_routes,
+        })
+        try:
+            with multiprocessing.get_context("fork").Pool(len(slices)) as pool:
+                # map returns in slice order
+                outputs = pool.map(_select_slice, range(len(slices)))
+        finally:
+            _state.clear()
+
+        # produced columns
+        for route in produced_routes:
+            if all(str(route) in columns for columns, _, _ in outputs):
+                values = ak.concatenate([columns[str(route)] for columns, _, _ in outputs])
+                events = set_ak_column(events, route, values)
+
+        # selection results, merging all attributes (event mask, steps, objects, aux data, etc.)
+        results = copy.copy(outputs[0][1])
+        results.__dict__.update(_concatenate([vars(result) for _, result, _ in outputs]))
+
+        # statistics
+        for _, _, slice_stats in outputs:
+            _add_counts(stats, slice_stats)
+
+        return events, results
+
+    return call
@@ -0,0 +1,145 @@
+# coding: utf-8
+
+"""
+Electron and muon scale factor weights with all systematic variations in a single pass.
+"""
+
+from __future__ import annotations
+
+from columnflow.production import Producer, producer
+from columnflow.util import maybe_import, InsertableDict, DotDict
+from columnflow.columnar_util import flat_np_view
+
+from h4l.util import segment_prod, set_ak_columns
+from h4l.corrections import correction_registry, external_file_version
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+
+
+# correctionlib "ValType" per weight column postfix and lepton flavour
+SF_VARIATIONS = {
+    "Electron": {"": "sf", "_up": "sfup", "_down": "sfdown"},
+    "Muon": {"": "sf", "_up": "systup", "_down": "systdown"},
+}
+
+# name of the weight columns per lepton flavour
+WEIGHT_NAMES = {"Electron": "electron_weight", "Muon": "muon_weight"}
+
+# supported versions of the corrections per lepton flavour, as in columnflow's electron_weights and
+# muon_weights
+SF_CORRECTION_VERSIONS = {"Electron": [2], "Muon": [1]}
+
+
+def get_electron_file_default(self: Producer, external_files: DotDict):
+    return external_files.electron_sf
+
+
+def get_muon_file_default(self: Producer, external_files: DotDict):
+    return external_files.muon_sf
+
+
+@producer(
+    uses={
+        "Electron.pt", "Electron.eta", "Electron.deltaEtaSC",
+        "Muon.pt", "Muon.eta",
+    },
+    produces={
+        f"{weight_name}{postfix}"
+        for flavour, weight_name in WEIGHT_NAMES.items()
+        for postfix in SF_VARIATIONS[flavour]
+    },
+    # only run on mc
+    mc_only=True,
+    # minimum pt of leptons entering the weights, as the scale factor maps start at 15 GeV
+    min_pt=15.0,
+    # functions to determine the correction files
+    get_electron_file=get_electron_file_default,
+    get_muon_file=get_muon_file_default,
+    # functions to determine the correction set names, years and working points
+    get_electron_config=(lambda self: self.config_inst.x.electron_sf_names),
+    get_muon_config=(lambda self: self.config_inst.x.muon_sf_names),
+)
+def lepton_weights(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
+    """
+    Creates the ``electron_weight`` and ``muon_weight`` columns and their ``_up`` and ``_down``
+    variations, with the same values as columnflow's
+    :py:func:`~columnflow.production.cms.electron.electron_weights` and
+    :py:func:`~columnflow.production.cms.muon.muon_weights` evaluated on leptons with
+    ``pt > min_pt``, using the corrections and config entries of these producers.
+
+    Per flavour, the leptons are flattened and masked once, the scale factors of all variations are
+    evaluated on the same flat arrays and stacked, and the per-event products of all variations
+    are computed together with one segmented product over the lepton offsets, where leptons below
+    *min_pt* contribute a factor of one. All weight columns are attached at once.
+    """
+    columns = {}
+    for flavour, weight_name in WEIGHT_NAMES.items():
+        leptons = events[flavour]
+        counts = ak.to_numpy(ak.num(leptons, axis=1))
+        pt = flat_np_view(leptons.pt, axis=1)
+        eta = flat_np_view(leptons.eta, axis=1)
+        if flavour == "Electron":
+            # super cluster eta
+            eta = eta + flat_np_view(leptons.deltaEtaSC, axis=1)
+        sel = pt > self.min_pt
+
+        # scale factors of all variations, one column each
+        variations = SF_VARIATIONS[flavour]
+        sf = np.ones((len(pt), len(variations)), dtype=np.float64)
+        if np.any(sel):
+            corrector, fixed_inputs = self.sf_correctors[flavour]
+            inputs = {**fixed_inputs, "pt": pt[sel], "eta": eta[sel], "abseta": np.abs(eta[sel])}
+            for i, val_type in enumerate(variations.values()):
+                inputs["ValType"] = val_type
+                sf[sel, i] = corrector(*(inputs[inp.name] for inp in corrector.inputs))
+
+        # products over all leptons in one event
+        weights = segment_prod(sf, counts)
+        for i, postfix in enumerate(variations):
+            columns[f"{weight_name}{postfix}"] = (weights[:, i], np.float32)
+
+    return set_ak_columns(events, columns)
+
+
+@lepton_weights.requires
+def lepton_weights_requires(self: Producer, reqs: dict) -> None:
+    if "external_files" in reqs:
+        return
+
+    from columnflow.tasks.external import BundleExternalFiles
+    reqs["external_files"] = BundleExternalFiles.req(self.task)
+
+
+@lepton_weights.setup
+def lepton_weights_setup(
+    self: Producer,
+    reqs: dict,
+    inputs: dict,
+    reader_targets: InsertableDict,
+) -> None:
+    bundle = reqs["external_files"]
+
+    # get the shared correctors, together with their inputs that do not depend on the leptons
+    import correctionlib
+    correctionlib.highlevel.Correction.__call__ = correctionlib.highlevel.Correction.evaluate
+
+    self.sf_correctors = {}
+    for flavour, file_key, get_file, get_config in [
+        ("Electron", "electron_sf", self.get_electron_file, self.get_electron_config),
+        ("Muon", "muon_sf", self.get_muon_file, self.get_muon_config),
+    ]:
+        corrector_name, year, *wp = get_config()
+        corrector = correction_registry.get(
+            get_file(bundle.files),
+            corrector_name,
+            version=external_file_version(self.config_inst, file_key),
+        )
+
+        # check versions
+        assert corrector.version in SF_CORRECTION_VERSIONS[flavour]
+
+        fixed_inputs = {"year": year}
+        if wp:
+            fixed_inputs["WorkingPoint"] = wp[0]
+        self.sf_correctors[flavour] = (corrector, fixed_inputs)
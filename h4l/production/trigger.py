@@ -0,0 +1,60 @@
+# coding: utf-8
+
+"""
+Column production methods related to trigger decisions.
+"""
+
+from __future__ import annotations
+
+from typing import Iterable
+
+from columnflow.production import Producer, producer
+from columnflow.util import maybe_import
+from columnflow.columnar_util import set_ak_column
+
+from h4l.util import bits_dtype
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+
+
+def trigger_mask(trigger_bits: dict[str, int], triggers: Iterable[str]) -> int:
+    """
+    Returns the mask with the bits of all *triggers* set, following the assignment *trigger_bits*.
+    """
+    mask = 0
+    for trigger in triggers:
+        mask |= 1 << trigger_bits[trigger]
+    return mask
+
+
+@producer(
+    produces={"trigger_bits"},
+)
+def trigger_bits(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
+    """
+    Packs the decisions of all triggers of the analysis into a single integer column, with bits
+    assigned by ``cfg.x.trigger_bits``, so that the trigger selection (also on reduced events)
+    becomes a single bitwise test and HLT columns need not be read again.
+    """
+    bits = self.config_inst.x.trigger_bits
+    dtype = bits_dtype(max(bits.values(), default=-1) + 1)
+
+    packed = np.zeros(len(events), dtype=dtype)
+    for trigger, bit in bits.items():
+        packed |= ak.to_numpy(events.HLT[trigger]).astype(dtype) << dtype(bit)
+
+    return set_ak_column(events, "trigger_bits", packed, value_type=dtype)
+
+
+@trigger_bits.init
+def trigger_bits_init(self: Producer) -> None:
+    # return immediately if config object has not been loaded yet
+    if not getattr(self, "config_inst", None):
+        return
+
+    # add HLT trigger bits to uses
+    self.uses |= {
+        f"HLT.{trigger}"
+        for trigger in self.config_inst.x.trigger_bits
+    }
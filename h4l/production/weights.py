@@ -0,0 +1,84 @@
+# coding: utf-8
+
+"""
+Event weights of all weight-only shifts stored as a single dense matrix column.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+
+import order as od
+
+from columnflow.production import Producer, producer
+from columnflow.util import maybe_import
+from columnflow.columnar_util import Route, set_ak_column, has_ak_column
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+
+
+def weight_variations(config_inst: od.Config, dataset_inst: od.Dataset) -> OrderedDict[str, dict[str, str]]:
+    """
+    Returns an ordered mapping of the nominal shift and all shifts declared in the ``event_weights``
+    of *config_inst* and *dataset_inst* to their weight columns, each mapped to the column to be
+    used in that shift according to its ``column_aliases``. The order defines the weight axis of
+    the ``event_weight_matrix`` column produced by :py:func:`weight_matrix`.
+    """
+    weights = list(config_inst.x.event_weights.items()) + list(dataset_inst.x("event_weights", {}).items())
+    columns = [column for column, _ in weights]
+
+    variations = OrderedDict([("nominal", {column: column for column in columns})])
+    for _, shift_insts in weights:
+        for shift_inst in shift_insts:
+            if shift_inst.name in variations:
+                continue
+            aliases = shift_inst.x("column_aliases", {})
+            variations[shift_inst.name] = {column: aliases.get(column, column) for column in columns}
+    return variations
+
+
+@producer(
+    produces={"event_weight_matrix"},
+    # only run on mc
+    mc_only=True,
+)
+def weight_matrix(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
+    """
+    Creates the ``event_weight_matrix`` column with one float32 row per event holding the full
+    product of all event weights, defined by ``cfg.x.event_weights`` and the ``event_weights`` of the
+    dataset, for the nominal shift and every weight-only shift (see :py:func:`weight_variations`),
+    so that histograms of all these shifts can be filled from a single read of the events (see
+    :py:func:`h4l.histogramming.weights.weight_matrix_hists`).
+
+    Weight columns are not read but expected to be present in *events*, so this producer must be
+    called after the producers of these columns. As in ``cf.CreateHistograms``, missing weights of
+    the dataset are skipped.
+    """
+    # evaluate each distinct column only once
+    columns = {}
+    for sources in self.variations.values():
+        for column, source in sources.items():
+            if source in columns:
+                continue
+            if column in self.dataset_columns and not has_ak_column(events, source):
+                columns[source] = None
+                continue
+            columns[source] = ak.to_numpy(Route(source).apply(events)).astype(np.float64)
+
+    matrix = np.ones((len(events), len(self.variations)), dtype=np.float64)
+    for i, sources in enumerate(self.variations.values()):
+        for source in sources.values():
+            if columns[source] is not None:
+                matrix[:, i] *= columns[source]
+
+    return set_ak_column(events, "event_weight_matrix", ak.from_numpy(matrix.astype(np.float32)))
+
+
+@weight_matrix.init
+def weight_matrix_init(self: Producer) -> None:
+    if not getattr(self, "dataset_inst", None) or self.dataset_inst.is_data:
+        return
+
+    self.variations = weight_variations(self.config_inst, self.dataset_inst)
+    self.dataset_columns = set(self.dataset_inst.x("event_weights", {})) - set(self.config_inst.x.event_weights)
@@ -1,23 +1,21 @@
-from operator import and_
-from functools import reduce
 from collections import defaultdict
 from typing import Tuple
 
 from columnflow.util import maybe_import
+from columnflow.columnar_util import EMPTY_FLOAT, set_ak_column
 
-from columnflow.selection.stats import increment_stats
 from columnflow.selection import Selector, SelectionResult, selector
 from columnflow.selection.cms.met_filters import met_filters
-from columnflow.selection.cms.json_filter import json_filter
 from columnflow.selection.cms.jets import jet_veto_map
 
 from columnflow.production.categories import category_ids
-from columnflow.production.util import attach_coffea_behavior
 from columnflow.production.cms.mc_weight import mc_weight
 from columnflow.production.processes import process_ids
 
-from h4l.selection.lepton import electron_selection, muon_selection
+from h4l.selection.lepton import lepton_selection
+from h4l.selection.lumi import lumi_mask
 from h4l.selection.trigger import trigger_selection
+from h4l.selection.stats import increment_cutflow_stats, increment_stats_grouped
 
 # Task 2.
 # Implement official HZZ Selection
@@ -27,7 +25,7 @@ from h4l.selection.trigger import trigger_selection
 # Bonus: Leading lepton must have pT > 20 GeV, subleading pT > 10 GeV
 # Hint: import the following
 # First you need to define build_4sf in util.py
-from h4l.util import build_2e2mu, build_4sf
+from h4l.util import build_zz_candidates_bucketed, mass_window_mask, pack_bits, set_ak_columns
 
 np = maybe_import("numpy")
 ak = maybe_import("awkward")
@@ -37,20 +35,24 @@ ak = maybe_import("awkward")
     uses={
         "event",
         category_ids,
-        attach_coffea_behavior, json_filter, mc_weight,
-        electron_selection, muon_selection,
+        lumi_mask, mc_weight,
+        lepton_selection,
         trigger_selection,
-        increment_stats, process_ids
+        increment_stats_grouped, increment_cutflow_stats, process_ids
     },
     produces={
         category_ids,
-        attach_coffea_behavior, json_filter, mc_weight,
-        electron_selection, muon_selection,
+        lumi_mask, mc_weight,
+        lepton_selection,
         trigger_selection,
-        increment_stats, process_ids,
+        increment_stats_grouped, increment_cutflow_stats, process_ids,
+        "zz_candidate.{channel,lepton_idx,mz1,mz2,mzz}",
+        "step_bits", "mass_window_bits",
     },
     # sandbox=dev_sandbox("bash::$CF_BASE/sandboxes/venv_columnar.sh"),
     exposed=True,
+    # number of events with more than four leptons per sub-batch of the ZZ candidate building
+    zz_candidate_batch_size=10000,
 )
 def default(
     self: Selector,
@@ -58,8 +60,6 @@ def default(
     stats: defaultdict,
     **kwargs,
 ) -> tuple[ak.Array, SelectionResult]:
-    # ensure coffea behaviors are loaded
-    events = self[attach_coffea_behavior](events, **kwargs)
     events = self[category_ids](events, **kwargs)
 
     # add corrected mc weights
@@ -72,20 +72,16 @@ def default(
 
     # filter bad data events according to golden lumi mask
     if self.dataset_inst.is_data:
-        events, json_filter_results = self[json_filter](events, **kwargs)
-        results += json_filter_results
+        events, lumi_mask_results = self[lumi_mask](events, **kwargs)
+        results += lumi_mask_results
 
     # run trigger selection
     events, trigger_results = self[trigger_selection](events, call_force=True, **kwargs)
     results += trigger_results
 
-    # run electron selection
-    events, ele_results = self[electron_selection](events, call_force=True, **kwargs)
-    results += ele_results
-
-    # run muon selection
-    events, muon_results = self[muon_selection](events, call_force=True, **kwargs)
-    results += muon_results
+    # run electron and muon selection (possibly loaded from the cache)
+    events, lepton_results = self[lepton_selection](events, call_force=True, **kwargs)
+    results += lepton_results
 
     # get indices of selected leptons
     ele_idx = results.objects.Electron.Electron
@@ -109,31 +105,52 @@ def default(
     # The ZZ candidate must have mZZ > 70 GeV
     # Bonus: Leading lepton must have pT > 20 GeV, subleading pT > 10 GeV
 
-    electrons_plus = electrons[electrons.charge > 0]
-    electrons_minus = electrons[electrons.charge < 0]
-    muons_plus = muons[muons.charge > 0]
-    muons_minus = muons[muons.charge < 0]
-
-    el2mu2 = build_2e2mu(muons_plus, muons_minus, electrons_plus, electrons_minus)
-    el4 = build_4sf(electrons_plus, electrons_minus)
-    mu4 = build_4sf(muons_plus, muons_minus)
-
-    z1 = ak.concatenate([el2mu2.z1, el4.z1, mu4.z1], axis=1)
-    z2 = ak.concatenate([el2mu2.z2, el4.z2, mu4.z2], axis=1)
-    zz = ak.concatenate([el2mu2.zz, el4.zz, mu4.zz], axis=1)
-
-    results.steps["m_z"] = ak.any((12 < z1.mass) & (z1.mass < 120) & (12 < z2.mass) & (z2.mass < 120), axis=1)
-    results.steps["m_z1"] = ak.any(z1.mass > 40, axis=1)
-    results.steps["m_zz"] = ak.any(zz.mass > 70, axis=1)
-
-    results.steps["h_window"] = ak.any((zz.mass > 105) & (zz.mass < 140), axis=1)
+    # best Z1, Z2 and ZZ candidates per flavour channel (2e2mu, 4e, 4mu), built in a single pass,
+    # split by lepton multiplicity to bound the memory of events with many leptons, while all
+    # configured mass windows and thresholds are evaluated on all pairings in the same pass and
+    # stored as bits so that categories and histograms can pick a window without rerunning the
+    # selection, the m_z, m_z1, m_zz and h_window steps are read back from the windows of the same
+    # name, so that an event passes a step when any of its pairings does
+    mass_windows = self.config_inst.x.mass_windows
+    zz_cands, window_bits = build_zz_candidates_bucketed(
+        electrons,
+        muons,
+        windows=mass_windows,
+        batch_size=self.zz_candidate_batch_size,
+    )
+    events = set_ak_column(events, "mass_window_bits", window_bits)
+    for step in ["m_z", "m_z1", "m_zz", "h_window"]:
+        results.steps[step] = mass_window_mask(window_bits, mass_windows, step)
+
+    # store the chosen candidate (the first one in 2e2mu, 4e, 4mu order, being the pairing of its
+    # channel whose Z1 is closest to the Z mass) so that producers can read it back instead of
+    # rebuilding it, lepton indices are in (Z1, Z2) order and refer to the selected (and thus
+    # reduced) Muon collection followed by the Electron collection
+    chosen = ak.firsts(zz_cands)
+    has_cand = ak.to_numpy(~ak.is_none(chosen))
+    channel = np.full(len(events), -1, dtype=np.int8)
+    channel[has_cand] = ak.to_numpy(chosen.channel[has_cand])
+    lepton_idx = np.full((len(events), 4), -1, dtype=np.int8)
+    lepton_idx[has_cand] = ak.to_numpy(chosen.lepton_idx[has_cand])
+    events = set_ak_columns(events, {
+        "zz_candidate.channel": channel,
+        "zz_candidate.lepton_idx": lepton_idx,
+        **{
+            f"zz_candidate.{name}": (ak.fill_none(z.mass, EMPTY_FLOAT), np.float32)
+            for name, z in [("mz1", chosen.z1), ("mz2", chosen.z2), ("mzz", chosen.zz)]
+        },
+    })
 
     # post selection build process IDs
     events = self[process_ids](events, **kwargs)
 
+    # pack all selection steps into a single column of step bits for cutflow studies,
     # final event selection mask is AND of all selection steps
-    results.event = reduce(and_, results.steps.values())
-    results.event = ak.fill_none(results.event, False)
+    step_bits = self.config_inst.x.selector_step_bits
+    packed_steps = pack_bits(results.steps, step_bits)
+    events = set_ak_column(events, "step_bits", packed_steps)
+    required = packed_steps.dtype.type(sum(1 << step_bits[step] for step in results.steps))
+    results.event = (packed_steps & required) == required
 
     weight_map = {
       "num_events": Ellipsis,
@@ -148,14 +165,13 @@ def default(
           "sum_mc_weight_selected": (events.mc_weight, results.event),
       }
       group_map = {
-          # per process
+          # per process (factorized once and filled with a bincount per weight)
           "process": {
               "values": events.process_id,
-               "mask_fn": (lambda v: events.process_id == v),
           },
       }
 
-    events, results = self[increment_stats](
+    events, results = self[increment_stats_grouped](
         events,
         results,
         stats,
@@ -164,4 +180,15 @@ def default(
         **kwargs,
     )
 
+    # cumulative and n-1 yields of all selector step groups from the packed step bits
+    events, results = self[increment_cutflow_stats](
+        events,
+        results,
+        stats,
+        step_bits=packed_steps,
+        weights=events.mc_weight if self.dataset_inst.is_mc else None,
+        groups=events.process_id if self.dataset_inst.is_mc else None,
+        **kwargs,
+    )
+
     return events, results
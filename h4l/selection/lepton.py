@@ -1,9 +1,18 @@
-
 from __future__ import annotations
 
+import os
+import sys
+import json
+import inspect
+import hashlib
+
+from columnflow.columnar_util import Route
 from columnflow.selection import Selector, SelectionResult, selector
-from columnflow.util import maybe_import, dev_sandbox
-from h4l.util import IF_NANO_V9, IF_NANO_V10
+from columnflow.util import maybe_import, dev_sandbox, memoize
+from h4l.util import (
+    IF_NANO_V9, IF_NANO_V10, CutTable, atomic_open, binned_threshold_mask, cache_dir_from_env, cut_table,
+    masked_sorted_indices,
+)
 
 np = maybe_import("numpy")
 ak = maybe_import("awkward")
@@ -14,8 +23,7 @@ ak = maybe_import("awkward")
         {
             f"Electron.{var}"
             for var in {
-                "pt", "eta", "phi", "deltaEtaSC",
-                "dxy", "dz", "sip3d", "mass", "charge",
+                "pt", "eta", "phi", "deltaEtaSC", "mass", "charge",
             }
         } | {
             IF_NANO_V9("Electron.mvaFall17V2Iso"),
@@ -24,21 +32,21 @@ ak = maybe_import("awkward")
     ),
     exposed=False,
     sandbox=dev_sandbox("bash::$CF_BASE/sandboxes/venv_columnar.sh"),
+    # number of leading selected electrons to keep, all when None
+    top_k=None,
 )
 def electron_selection(
     self: Selector,
     events: ak.Array,
     **kwargs,
 ):
-    min_pt = 7
     pt = events.Electron.pt
     fSCeta = abs(events.Electron.eta + events.Electron.deltaEtaSC)
 
-    # era-dependent selection (filled below)
-    electron_base_mask = ak.ones_like(events.Electron.pt)
-
-    era = self.config_inst.campaign.x.year
-    if era == 2017 or era == 2018:
+    # era-dependent MVA working point, looked up per (pt, |eta_SC|) bin from the table in the config
+    electron_base_mask = True
+    wp = self.config_inst.x("electron_mva_wp", None)
+    if wp is not None:
         if self.config_inst.campaign.x.version < 10:
             # using 2017 WP and training (ElectronMVAEstimatorRun2Fall17IsoV2Values)
             # since this is the only one available in Run2 UL nanoAODs
@@ -46,55 +54,21 @@ def electron_selection(
         else:
             BDT = events.Electron.mvaHZZIso
 
-        # pre-UL WP for Run II (miniAOD branch: Run2_CutBased_BTag16)
-        if self.config_inst.campaign.x("preUL", False):
-            electron_base_mask = (
-                (
-                    (pt <= 10.) & (
-                        (fSCeta < 0.8 & BDT > 0.85216885148) |
-                        (fSCeta >= 0.8 & fSCeta < 1.479 & BDT > 0.82684550976) |
-                        (fSCeta >= 1.479 & BDT > 0.86937630022)
-                    )
-                ) |
-                (
-                    (pt > 10.) & (
-                        (fSCeta < 0.8 & BDT > 0.98248928759) |
-                        (fSCeta >= 0.8 & fSCeta < 1.479 & BDT > 0.96919224579) |
-                        (fSCeta >= 1.479 & BDT > 0.79349796445))
-                )
-            )
-
-        else:  # UL WP (miniAOD branch Run2_CutBased_UL)
-            electron_base_mask = (
-                (
-                    (pt <= 10.) & (
-                        ((fSCeta < 0.8) & (BDT > 0.9128577458)) |
-                        ((fSCeta >= 0.8) & (fSCeta < 1.479) & (BDT > 0.9056792368)) |
-                        ((fSCeta >= 1.479) & (BDT > 0.9439440575))
-                    )
-                ) |
-                (
-                    (pt > 10.) & (
-                        ((fSCeta < 0.8) & (BDT > 0.1559788054)) |
-                        ((fSCeta >= 0.8) & (fSCeta < 1.479) & (BDT > 0.0273863727)) |
-                        ((fSCeta >= 1.479) & (BDT > -0.5532483665))
-                    )
-                )
-            )
+        electron_base_mask = ak.unflatten(
+            binned_threshold_mask(
+                ak.to_numpy(ak.flatten(pt, axis=1)),
+                ak.to_numpy(ak.flatten(fSCeta, axis=1)),
+                ak.to_numpy(ak.flatten(BDT, axis=1)),
+                wp,
+            ),
+            ak.num(pt, axis=1),
+        )
 
-    # mask for selecting electrons
-    electron_mask = (
-        (pt > min_pt) &
-        (abs(events.Electron.eta) < 2.5) &
-        (events.Electron.dxy < 0.5) &
-        (events.Electron.dz < 1.0) &
-        (abs(events.Electron.sip3d) < 4) &
-        electron_base_mask
-    )
+    # mask for selecting electrons, with cuts from the config evaluated in a single pass
+    electron_mask = cut_table(self.config_inst.x.lepton_cuts.Electron)(events.Electron) & electron_base_mask
 
-    # select and sort electrons
-    sorted_idx = ak.argsort(events.Electron.pt, axis=1, ascending=False)
-    selected_electron_idx = sorted_idx[electron_mask[sorted_idx]]
+    # select electrons and sort only the selected ones by pt
+    selected_electron_idx = masked_sorted_indices(electron_mask, pt, top_k=self.top_k)
 
     return events, SelectionResult(
         objects={
@@ -106,48 +80,24 @@ def electron_selection(
 
 
 @selector(
-    uses=({
-        f"Muon.{var}" for var in [
-            # four momenta information
-            "pt", "eta", "phi", "mass", "charge",
-            # quality criteria
-            "isGlobal", "isStandalone", "isTracker", "nStations", "nTrackerLayers",
-            # impact parameters
-            "dxy", "dz", "sip3d",
-            # IDs
-            "tightId", "mvaId", "highPtId", "isPFcand",
-            # isolation
-            "pfRelIso03_all",
-        ]
-    }),
+    uses={
+        # four momenta information, further columns are added from the cuts in the config
+        f"Muon.{var}" for var in ["pt", "eta", "phi", "mass", "charge"]
+    },
     exposed=False,
+    # number of leading selected muons to keep, all when None
+    top_k=None,
 )
 def muon_selection(
     self: Selector,
     events: ak.Array,
     **kwargs,
 ) -> tuple[ak.Array, SelectionResult]:
-    min_pt = 5
-    max_eta = 2.4
-    selected_muon_mask = (
-        # Global or Tracker Muon
-        (events.Muon.isGlobal | (events.Muon.isTracker & events.Muon.nStations > 0)) &
-        # Discard Standalone Muon tracks if reconstructed in muon system only
-        (~events.Muon.isStandalone | (events.Muon.nTrackerLayers > 0)) &
-        # WIP: Discard muons with muonBestTrackType==2 even if they are global or tracker muons # noqa
-        # --> muonBestTrackType not available?
-        (events.Muon.pt > min_pt) &
-        (abs(events.Muon.eta) < max_eta) &
-        (events.Muon.dxy < 0.5) & (events.Muon.dz < 1.0) &
-        (abs(events.Muon.sip3d) < 4) &
-        # PF muon ID if pT < 200 GeV, PF muon ID or High-pT muon ID if pT > 200 GeV
-        (((events.Muon.pt > 200) & events.Muon.highPtId > 0) | (events.Muon.isPFcand)) &
-        (events.Muon.pfRelIso03_all < 0.35)
-    )
-    sorted_idx = ak.argsort(events.Muon.pt, axis=1, ascending=False)
+    # mask for selecting muons, with cuts from the config evaluated in a single pass
+    selected_muon_mask = cut_table(self.config_inst.x.lepton_cuts.Muon)(events.Muon)
 
-    # filter unselected muon indices
-    muon_idx = sorted_idx[selected_muon_mask[sorted_idx]]
+    # select muons and sort only the selected ones by pt
+    muon_idx = masked_sorted_indices(selected_muon_mask, events.Muon.pt, top_k=self.top_k)
 
     return events, SelectionResult(
         objects={
@@ -156,3 +106,134 @@ def muon_selection(
             },
         },
     )
+
+
+@electron_selection.init
+def electron_selection_init(self: Selector) -> None:
+    # return immediately if config object has not been loaded yet
+    if not getattr(self, "config_inst", None):
+        return
+
+    # read only columns referenced by the cuts
+    self.uses |= {f"Electron.{column}" for column in cut_table(self.config_inst.x.lepton_cuts.Electron).columns}
+
+
+@muon_selection.init
+def muon_selection_init(self: Selector) -> None:
+    # return immediately if config object has not been loaded yet
+    if not getattr(self, "config_inst", None):
+        return
+
+    # read only columns referenced by the cuts
+    self.uses |= {f"Muon.{column}" for column in cut_table(self.config_inst.x.lepton_cuts.Muon).columns}
+
+
+@memoize
+def _lepton_code_hash() -> str:
+    # the selection depends on the code in this module, the working point lookup and the sorting
+    sources = "".join(
+        inspect.getsource(obj)
+        for obj in [sys.modules[__name__], binned_threshold_mask, masked_sorted_indices, CutTable]
+    )
+    return hashlib.blake2b(sources.encode(), digest_size=8).hexdigest()
+
+
+@selector(
+    uses={
+        electron_selection, muon_selection,
+        "run", "luminosityBlock", "event",
+    },
+    exposed=False,
+    # directory of the opt-in cache of selected lepton indices, disabled when empty, taken from the
+    # environment variable H4L_LEPTON_CACHE_DIR at initialization when None
+    lepton_cache_dir=None,
+)
+def lepton_selection(
+    self: Selector,
+    events: ak.Array,
+    **kwargs,
+) -> tuple[ak.Array, SelectionResult]:
+    """
+    Runs the electron and muon selections and, when *lepton_cache_dir* is set, caches the selected
+    lepton indices on disk. They only depend on lepton columns, so that selections with other
+    shifts (e.g. jec_up/jec_down) and selector variants load them instead of recomputing them.
+    Entries are keyed by the dataset, the content of all columns read by the lepton selections,
+    the code of this module and the lepton config. As the cache lives outside of the task outputs
+    and their versioning, it is disabled by default and should be cleared when other inputs change.
+    """
+    cache_path = None
+    if self.lepton_cache_dir and self.cache_key:
+        dataset = getattr(self, "dataset_inst", None)
+        cache_path = lepton_cache_path(
+            os.path.join(self.lepton_cache_dir, dataset.name if dataset else "unknown", self.cache_key),
+            events,
+            self.used_columns,
+        )
+    if cache_path and os.path.exists(cache_path):
+        cached = np.load(cache_path)
+        return events, SelectionResult(
+            objects={
+                "Electron": {"Electron": ak.unflatten(cached["electron_idx"], cached["electron_num"])},
+                "Muon": {"Muon": ak.unflatten(cached["muon_idx"], cached["muon_num"])},
+            },
+        )
+
+    events, results = self[electron_selection](events, call_force=True, **kwargs)
+    events, muon_results = self[muon_selection](events, call_force=True, **kwargs)
+    results += muon_results
+
+    if cache_path:
+        electron_idx = results.objects.Electron.Electron
+        muon_idx = results.objects.Muon.Muon
+        with atomic_open(cache_path) as f:
+            np.savez(
+                f,
+                electron_idx=ak.to_numpy(ak.flatten(electron_idx, axis=1)),
+                electron_num=ak.to_numpy(ak.num(electron_idx, axis=1)),
+                muon_idx=ak.to_numpy(ak.flatten(muon_idx, axis=1)),
+                muon_num=ak.to_numpy(ak.num(muon_idx, axis=1)),
+            )
+
+    return events, results
+
+
+@lepton_selection.init
+def lepton_selection_init(self: Selector) -> None:
+    self.cache_key = None
+    if self.lepton_cache_dir is None:
+        self.lepton_cache_dir = cache_dir_from_env("H4L_LEPTON_CACHE_DIR")
+
+    # return immediately if config object has not been loaded yet
+    if not getattr(self, "config_inst", None):
+        return
+
+    # key of the code and the config entering the lepton selection
+    config = {
+        "campaign": self.config_inst.campaign.name,
+        "version": self.config_inst.campaign.x.version,
+        "electron_mva_wp": self.config_inst.x("electron_mva_wp", None),
+        "lepton_cuts": self.config_inst.x.lepton_cuts,
+        "top_k": {dep.cls_name: dep.top_k for dep in self.uses if hasattr(dep, "top_k")},
+    }
+    config_hash = hashlib.blake2b(
+        json.dumps(config, sort_keys=True, default=str).encode(),
+        digest_size=8,
+    ).hexdigest()
+    self.cache_key = f"{_lepton_code_hash()}_{config_hash}"
+
+
+def lepton_cache_path(cache_dir: str, events: ak.Array, columns: set[str | Route]) -> str:
+    """
+    Returns the path of the cached lepton indices of the chunk *events* in *cache_dir*, identified
+    by the content of all *columns*, so that calibrations and shifts changing any of them (e.g.
+    lepton pts, isolations or IDs) lead to different entries.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for route in sorted(map(Route, columns), key=str):
+        column = route.apply(events)
+        values = ak.to_numpy(ak.flatten(column, axis=None))
+        digest.update(f"{route}:{values.dtype.str}:{len(values)}".encode())
+        digest.update(np.ascontiguousarray(values).data)
+        if column.ndim > 1:
+            digest.update(np.ascontiguousarray(ak.to_numpy(ak.num(column, axis=1))).data)
+    return os.path.join(cache_dir, f"{digest.hexdigest()}.npz")
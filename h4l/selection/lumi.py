@@ -0,0 +1,132 @@
+# coding: utf-8
+
+"""
+Selector applying the golden JSON lumi mask in data through an interval index.
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import hashlib
+
+from columnflow.selection import Selector, SelectionResult, selector
+from columnflow.util import maybe_import, InsertableDict, DotDict
+
+from h4l.util import atomic_open, cache_dir_from_env
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+
+
+def compile_lumi_mask(golden: dict[str, list[list[int]]]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Compiles the *golden* JSON, mapping runs to inclusive ranges of luminosity blocks, into sorted
+    arrays of the first and last certified keys ``run << 32 | luminosityBlock`` of all merged
+    ranges, to be used with :py:func:`lumi_mask_lookup`.
+    """
+    ranges = np.array(
+        [(int(run), first, last) for run, ls_ranges in golden.items() for first, last in ls_ranges],
+        dtype=np.uint64,
+    ).reshape(-1, 3)
+    starts = (ranges[:, 0] << np.uint64(32)) | ranges[:, 1]
+    stops = (ranges[:, 0] << np.uint64(32)) | ranges[:, 2]
+    order = np.argsort(starts, kind="stable")
+    starts, stops = starts[order], stops[order]
+
+    # merge overlapping and adjacent ranges so that the last start before a key decides
+    if len(starts):
+        max_stops = np.maximum.accumulate(stops)
+        new = np.ones(len(starts), dtype=bool)
+        new[1:] = starts[1:] > max_stops[:-1] + np.uint64(1)
+        last = np.append(np.flatnonzero(new)[1:] - 1, len(starts) - 1)
+        starts, stops = starts[new], max_stops[last]
+    return starts, stops
+
+
+def lumi_mask_lookup(starts: np.ndarray, stops: np.ndarray, run: np.ndarray, lumi: np.ndarray) -> np.ndarray:
+    """
+    Returns whether the luminosity blocks *lumi* of *run* are contained in the ranges compiled by
+    :py:func:`compile_lumi_mask`, with a single vectorized search.
+    """
+    keys = (np.asarray(run).astype(np.uint64) << np.uint64(32)) | np.asarray(lumi).astype(np.uint64)
+    idx = np.searchsorted(starts, keys, side="right") - 1
+    return (idx >= 0) & (keys <= stops[np.maximum(idx, 0)]) if len(starts) else np.zeros(len(keys), dtype=bool)
+
+
+def get_lumi_file_default(self: Selector, external_files: DotDict):
+    return external_files.lumi.golden
+
+
+@selector(
+    uses={"run", "luminosityBlock"},
+    # function to determine the golden lumi file
+    get_lumi_file=get_lumi_file_default,
+    # directory of the opt-in cache of compiled lumi masks, disabled when empty, taken from the
+    # environment variable H4L_LUMI_CACHE_DIR at setup when None
+    lumi_cache_dir=None,
+)
+def lumi_mask(
+    self: Selector,
+    events: ak.Array,
+    **kwargs,
+) -> tuple[ak.Array, SelectionResult]:
+    """
+    Selects events in certified luminosity blocks of the golden JSON, with the same decisions as
+    columnflow's :py:func:`~columnflow.selection.cms.json_filter.json_filter`. The JSON is compiled
+    once into sorted interval arrays (see :py:func:`compile_lumi_mask`), which are optionally cached
+    on disk keyed by the content of the JSON file, and each chunk is looked up with one vectorized
+    search.
+    """
+    mask = lumi_mask_lookup(
+        self.lumi_starts,
+        self.lumi_stops,
+        ak.to_numpy(events.run),
+        ak.to_numpy(events.luminosityBlock),
+    )
+
+    return events, SelectionResult(
+        steps={
+            "json": mask,
+        },
+    )
+
+
+@lumi_mask.requires
+def lumi_mask_requires(self: Selector, reqs: dict) -> None:
+    if "external_files" in reqs:
+        return
+
+    from columnflow.tasks.external import BundleExternalFiles
+    reqs["external_files"] = BundleExternalFiles.req(self.task)
+
+
+@lumi_mask.setup
+def lumi_mask_setup(
+    self: Selector,
+    reqs: dict,
+    inputs: dict,
+    reader_targets: InsertableDict,
+) -> None:
+    bundle = reqs["external_files"]
+    lumi_file = self.get_lumi_file(bundle.files)
+    content = lumi_file.load(formatter="text")
+
+    if self.lumi_cache_dir is None:
+        self.lumi_cache_dir = cache_dir_from_env("H4L_LUMI_CACHE_DIR")
+
+    # load the compiled mask from the cache if possible
+    cache_path = None
+    if self.lumi_cache_dir:
+        digest = hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+        cache_path = os.path.join(self.lumi_cache_dir, f"{digest}.npz")
+        if os.path.exists(cache_path):
+            cached = np.load(cache_path)
+            self.lumi_starts, self.lumi_stops = cached["starts"], cached["stops"]
+            return
+
+    self.lumi_starts, self.lumi_stops = compile_lumi_mask(json.loads(content))
+
+    if cache_path:
+        with atomic_open(cache_path) as f:
+            np.savez(f, starts=self.lumi_starts, stops=self.lumi_stops)
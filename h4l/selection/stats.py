@@ -0,0 +1,191 @@
+# coding: utf-8
+
+"""
+Selector helpers for book keeping of selection and event weight statistics.
+"""
+
+from __future__ import annotations
+
+from functools import reduce
+from collections import defaultdict
+from operator import getitem
+from typing import Callable, Sequence
+
+from columnflow.selection import Selector, SelectionResult, selector
+from columnflow.util import maybe_import
+
+from h4l.util import Cutflow
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+
+
+def _nested_defaultdict(dtype: type, depth: int) -> Callable:
+    if depth == 1:
+        return lambda: defaultdict(dtype)
+    inner = _nested_defaultdict(dtype, depth - 1)
+    return lambda: defaultdict(inner)
+
+
+@selector(
+    call_force=True,
+)
+def increment_stats_grouped(
+    self: Selector,
+    events: ak.Array,
+    results: SelectionResult,
+    stats: dict,
+    weight_map: dict[str, ak.Array | tuple[ak.Array, ak.Array]] | None = None,
+    group_map: dict[str, dict[str, ak.Array | Callable]] | None = None,
+    group_combinations: Sequence[tuple[str]] | None = None,
+    **kwargs,
+) -> tuple[ak.Array, SelectionResult]:
+    """
+    Drop-in replacement of columnflow's :py:class:`~columnflow.selection.stats.increment_stats`
+    with the same *weight_map*, *group_map* and *group_combinations* arguments, and the same
+    resulting fields in *stats*. Instead of evaluating a ``mask_fn`` per group value and weight
+    entry, which scales with the number of values times the number of events and weights, the
+    per-event ``values`` of each group are factorized once, and every entry is filled per group
+    combination with a single (weighted) ``np.bincount``. ``mask_fn`` entries are ignored.
+    """
+    weight_map = weight_map or {}
+    group_map = group_map or {}
+
+    # factorize group values once into unique values and per-event indices
+    factorized = {
+        group_name: np.unique(ak.to_numpy(ak.flatten(group_data["values"], axis=None)), return_inverse=True)
+        for group_name, group_data in group_map.items()
+    }
+
+    # treat groups as combinations of a single group
+    group_combinations = list(group_combinations or [])
+    for group_name, group_data in list(group_map.items())[::-1]:
+        if group_data.get("combinations_only", False) or (group_name,) in group_combinations:
+            continue
+        group_combinations.insert(0, (group_name,))
+
+    # flat bin index per event and group combination
+    combination_bins = {}
+    for group_names in group_combinations:
+        shape = tuple(len(factorized[g][0]) for g in group_names)
+        idx = np.ravel_multi_index([factorized[g][1].ravel() for g in group_names], shape) if shape else None
+        combination_bins[group_names] = (shape, idx)
+
+    for weight_name, obj in weight_map.items():
+        # check whether the weight is either a "num" or "sum" field
+        if weight_name.startswith("num"):
+            is_num = True
+        elif weight_name.startswith("sum"):
+            is_num = False
+        else:
+            raise Exception(
+                f"weight '{weight_name}' starting with unknown operation; should either start with "
+                "'num' or 'sum'",
+            )
+
+        # interpret obj as a mask, weights, or weights and a mask
+        weights = None
+        weight_mask = Ellipsis
+        if isinstance(obj, (tuple, list)):
+            if is_num:
+                raise Exception(
+                    f"weight map entry '{weight_name}' should refer to a mask, "
+                    f"but found a sequence: {obj}",
+                )
+            if len(obj) == 1:
+                weights = obj[0]
+            elif len(obj) == 2:
+                weights, weight_mask = obj
+            else:
+                raise Exception(f"cannot interpret as weights and optional mask: '{obj}'")
+        elif is_num:
+            weight_mask = obj
+        else:
+            weights = obj
+
+        if weight_mask is Ellipsis:
+            weight_mask = np.ones(len(events), dtype=bool)
+        weight_mask = ak.to_numpy(ak.fill_none(weight_mask, False)).astype(bool)
+        if weights is not None:
+            weights = ak.to_numpy(weights).astype(np.float64)[weight_mask]
+
+        # totals
+        if is_num:
+            stats[weight_name] += int(np.count_nonzero(weight_mask))
+        else:
+            stats[weight_name] += float(np.sum(weights))
+
+        # per group combination, a single bincount over masked events
+        for group_names, (shape, idx) in combination_bins.items():
+            group_key = f"{weight_name}_per_" + "_and_".join(group_names)
+            if group_key not in stats:
+                stats[group_key] = _nested_defaultdict(int if is_num else float, len(group_names))()
+            if idx is None:
+                continue
+
+            counts = np.bincount(idx[weight_mask], weights=weights, minlength=int(np.prod(shape)))
+            for flat_idx, bin_idx in enumerate(np.ndindex(*shape)):
+                str_values = [str(factorized[g][0][i]) for g, i in zip(group_names, bin_idx)]
+                innermost_dict = reduce(getitem, [stats[group_key]] + str_values[:-1])
+                if is_num:
+                    innermost_dict[str_values[-1]] += int(counts[flat_idx])
+                else:
+                    innermost_dict[str_values[-1]] += float(counts[flat_idx])
+
+    return events, results
+
+
+def _add_nested(dst: dict, src: dict) -> None:
+    for key, value in src.items():
+        if isinstance(value, dict):
+            _add_nested(dst.setdefault(key, {}), value)
+        else:
+            dst[key] = dst.get(key, 0) + value
+
+
+@selector(
+    call_force=True,
+)
+def increment_cutflow_stats(
+    self: Selector,
+    events: ak.Array,
+    results: SelectionResult,
+    stats: dict,
+    step_bits: np.ndarray | None = None,
+    weights: ak.Array | None = None,
+    groups: ak.Array | None = None,
+    **kwargs,
+) -> tuple[ak.Array, SelectionResult]:
+    """
+    Adds the cumulative and N-1 yields of each entry of ``cfg.x.selector_step_groups`` to *stats*,
+    computed with :py:class:`~h4l.util.Cutflow` in a single pass over the packed *step_bits* (bit
+    assignment ``cfg.x.selector_step_bits``). Per step group ``<name>``, ``stats["cutflow_<name>"]``
+    contains ``num_events`` and, when *weights* are given, ``sum_mc_weight`` yields, as well as
+    both per value of *groups* (``num_events_per_process`` and ``sum_mc_weight_per_process``), each
+    a dict with ``cumulative`` and ``n_minus_1`` yields per step. All entries are nested dicts of
+    numbers, so that they are summed when merging selection stats.
+    """
+    bits = self.config_inst.x.selector_step_bits
+    weights = None if weights is None else ak.to_numpy(weights).astype(np.float64)
+    groups = None if groups is None else ak.to_numpy(groups)
+
+    for group_name, steps in self.config_inst.x.selector_step_groups.items():
+        cutflow = Cutflow(steps, bits)
+        cutflow.fill(step_bits, weights=weights, groups=groups)
+
+        def num(table):
+            return {key: {step: int(value) for step, value in yields.items()} for key, yields in table.items()}
+
+        entry = {"num_events": num(cutflow.table())}
+        if weights is not None:
+            entry["sum_mc_weight"] = cutflow.table(weighted=True)
+        if groups is not None:
+            entry["num_events_per_process"] = {str(g): num(cutflow.table(g)) for g in cutflow.yields}
+            if weights is not None:
+                entry["sum_mc_weight_per_process"] = {
+                    str(g): cutflow.table(g, weighted=True)
+                    for g in cutflow.yields
+                }
+        _add_nested(stats.setdefault(f"cutflow_{group_name}", {}), entry)
+
+    return events, results
@@ -1,30 +1,36 @@
-
 from __future__ import annotations
 
 from columnflow.selection import Selector, SelectionResult, selector
 from columnflow.util import maybe_import
 
+from h4l.production.trigger import trigger_bits, trigger_mask
+
 np = maybe_import("numpy")
 ak = maybe_import("awkward")
 
 
-@selector
+@selector(
+    # whether to read the packed trigger bits from the input instead of building them from HLT columns
+    # (e.g. when selecting on reduced events that contain the trigger_bits column)
+    read_trigger_bits=False,
+)
 def trigger_selection(
     self: Selector,
     events: ak.Array,
     **kwargs,
 ) -> tuple[ak.Array, SelectionResult]:
 
-    # start with an all-false mask
-    sel_trigger = ak.Array(np.zeros(len(events), dtype=bool))
-
-    # pick events that passed one of the required triggers
-    for trigger in self.dataset_inst.x("require_triggers", []):
-        sel_trigger = sel_trigger | events.HLT[trigger]
+    # pack the trigger decisions into a single integer column
+    if not self.read_trigger_bits:
+        events = self[trigger_bits](events, **kwargs)
+    bits = ak.to_numpy(events.trigger_bits)
 
+    # pick events that passed one of the required triggers,
     # but reject events that also passed one of the triggers to veto
-    for trigger in self.dataset_inst.x("veto_triggers", []):
-        sel_trigger = sel_trigger & ~events.HLT[trigger]
+    dtype = bits.dtype.type
+    require_mask = dtype(trigger_mask(self.config_inst.x.trigger_bits, self.dataset_inst.x("require_triggers", [])))
+    veto_mask = dtype(trigger_mask(self.config_inst.x.trigger_bits, self.dataset_inst.x("veto_triggers", [])))
+    sel_trigger = ((bits & require_mask) != 0) & ((bits & veto_mask) == 0)
 
     return events, SelectionResult(
         steps={
@@ -39,8 +45,8 @@ def trigger_selection_init(self: Selector) -> None:
     if not getattr(self, "config_inst", None):
         return
 
-    # add HLT trigger bits to uses
-    self.uses |= {
-        f"HLT.{trigger}"
-        for trigger in self.config_inst.x.all_triggers
-    }
+    if self.read_trigger_bits:
+        self.uses |= {"trigger_bits"}
+    else:
+        self.uses |= {trigger_bits}
+        self.produces |= {trigger_bits}
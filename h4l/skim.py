@@ -0,0 +1,314 @@
+# coding: utf-8
+
+"""
+Four-lepton skims of NanoAOD files, keeping only events with at least four loose leptons and at
+least one opposite-sign same-flavour pair among them, as a loose superset of the default selection.
+Skims are written as NanoAOD-like ``Events`` trees so that they can replace the original files as
+inputs of calibration, selection and reduction (see :py:class:`h4l.tasks.skim.SkimEvents`).
+
+Trees are read in two phases. The first one reads only the lepton multiplicities and, for events
+with enough leptons, the columns of the loose lepton cuts. The second one reads the kept branches
+only in clusters (groups of baskets) that contain at least one surviving event.
+"""
+
+from __future__ import annotations
+
+import fnmatch
+from typing import Iterable, Sequence
+
+import law
+import order as od
+
+from columnflow.columnar_util import Route
+from columnflow.util import maybe_import
+
+from h4l.util import cut_table
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+uproot = maybe_import("uproot")
+
+
+def loose_lepton_cuts(config_inst: od.Config) -> dict[str, dict[str, str]]:
+    """
+    Returns the loose lepton cuts of the skim per collection, i.e., the cuts of
+    ``cfg.x.lepton_cuts`` whose names are listed in ``cfg.x.skim_lepton_cuts``. Being a subset of
+    the cuts of the lepton selection, they never remove leptons passing the selection, as long as
+    calibrations change the lepton pt by less than ``cfg.x.skim_lepton_pt_scale`` (see
+    :py:func:`loose_lepton_masks`) and leave other cut columns unchanged.
+    """
+    names = set(config_inst.x.skim_lepton_cuts)
+    return {
+        collection: {name: expr for name, expr in cuts.items() if name in names}
+        for collection, cuts in config_inst.x.lepton_cuts.items()
+    }
+
+
+def lepton_branches(lepton_cuts: dict[str, dict[str, str]]) -> list[str]:
+    """
+    Returns the NanoAOD branches read to apply the loose *lepton_cuts* and to find opposite-sign
+    pairs of loose leptons.
+    """
+    return sorted(
+        f"{collection}_{column}"
+        for collection, cuts in lepton_cuts.items()
+        for column in set(cut_table(cuts).columns) | {"charge"}
+    )
+
+
+def loose_lepton_masks(
+    leptons: ak.Array,
+    lepton_cuts: dict[str, dict[str, str]],
+    pt_scale: float = 1.0,
+) -> dict[str, ak.Array]:
+    """
+    Returns per-object masks of the leptons passing the loose *lepton_cuts* per collection, given
+    the lepton branches (see :py:func:`lepton_branches`) of NanoAOD events, such as ``Electron_pt``.
+    As skims are created before any calibration, the cuts are evaluated on ``pt`` multiplied by
+    *pt_scale* so that leptons whose calibrated pt is larger by up to this factor are kept.
+    """
+    masks = {}
+    for collection, cuts in lepton_cuts.items():
+        table = cut_table(cuts)
+        columns = set(table.columns) | {"charge"}
+        values = {column: leptons[f"{collection}_{column}"] for column in columns}
+        if "pt" in values and pt_scale != 1.0:
+            values["pt"] = values["pt"] * pt_scale
+        masks[collection] = table(ak.zip(values))
+    return masks
+
+
+def entry_ranges(entry_offsets: Sequence[int], mask: np.ndarray) -> list[tuple[int, int]]:
+    """
+    Returns the contiguous entry ranges covering all clusters, given by their *entry_offsets*, that
+    contain at least one entry selected by the boolean *mask*. Adjacent clusters are merged so that
+    each range can be read with a single call.
+    """
+    offsets = np.asarray(entry_offsets)
+    selected = np.logical_or.reduceat(mask, offsets[:-1]) if len(mask) else np.zeros(0, dtype=bool)
+    ranges = []
+    for i in np.flatnonzero(selected):
+        if ranges and ranges[-1][1] == offsets[i]:
+            ranges[-1] = (ranges[-1][0], int(offsets[i + 1]))
+        else:
+            ranges.append((int(offsets[i]), int(offsets[i + 1])))
+    return ranges
+
+
+def read_clusters(tree: uproot.TTree, branches: Sequence[str], mask: np.ndarray) -> ak.Array:
+    """
+    Reads *branches* of all entries of *tree* selected by the boolean *mask*, skipping clusters
+    without any selected entry.
+    """
+    branches = list(branches)
+    chunks = [
+        tree.arrays(branches, entry_start=start, entry_stop=stop)[mask[start:stop]]
+        for start, stop in entry_ranges(tree.common_entry_offsets(filter_name=branches), mask)
+    ]
+    if not chunks:
+        return tree.arrays(branches, entry_start=0, entry_stop=0)
+    return ak.concatenate(chunks) if len(chunks) > 1 else chunks[0]
+
+
+def loose_four_lepton_mask(
+    tree: uproot.TTree,
+    lepton_cuts: dict[str, dict[str, str]],
+    pt_scale: float = 1.0,
+) -> np.ndarray:
+    """
+    Returns the mask of events in *tree* with at least four leptons passing the loose *lepton_cuts*
+    (see :py:func:`loose_lepton_cuts`) with *pt_scale* (see :py:func:`loose_lepton_masks`). The
+    lepton branches are only read for events with at least four leptons of any quality.
+    """
+    counts = tree.arrays([f"n{collection}" for collection in lepton_cuts], library="np")
+    mask = sum(counts.values()) >= 4
+
+    # loose lepton requirements, only for events that could pass at all
+    leptons = read_clusters(tree, lepton_branches(lepton_cuts), mask)
+    n_loose = sum(ak.sum(m, axis=1) for m in loose_lepton_masks(leptons, lepton_cuts, pt_scale).values())
+    mask[mask] = ak.to_numpy(n_loose >= 4)
+
+    return mask
+
+
+def skim_branches(tree: uproot.TTree, patterns: Iterable[str]) -> list[str]:
+    """
+    Returns the names of all branches of *tree* matching the column *patterns* (e.g. ``"Electron.*"``
+    or ``"PV.npvs"``), including the counter branches of matched collections, in tree order.
+    """
+    nano_patterns = [
+        Route(pattern).nano_column
+        for pattern in law.util.flatten(map(law.util.brace_expand, patterns))
+    ]
+    keys = tree.keys()
+    matched = {name for name in keys if any(fnmatch.fnmatchcase(name, p) for p in nano_patterns)}
+    counters = {f"n{name.split('_', 1)[0]}" for name in matched} | {f"n{name}" for name in matched}
+    return [name for name in keys if name in matched or name in counters]
+
+
+def has_os_sf_pair(
+    leptons: ak.Array,
+    lepton_cuts: dict[str, dict[str, str]],
+    pt_scale: float = 1.0,
+) -> ak.Array:
+    """
+    Returns a per-event mask of *leptons* (with NanoAOD branch names such as ``Electron_pt``)
+    that have at least one opposite-sign pair of loose electrons or loose muons, with *pt_scale*
+    (see :py:func:`loose_lepton_masks`).
+    """
+    mask = False
+    for collection, is_loose in loose_lepton_masks(leptons, lepton_cuts, pt_scale).items():
+        charge = leptons[f"{collection}_charge"][is_loose]
+        mask = mask | (ak.any(charge > 0, axis=1) & ak.any(charge < 0, axis=1))
+    return mask
+
+
+def mc_weight_sum(gen_weight: np.ndarray, lhe_weight: np.ndarray | None, chunk_size: int) -> float:
+    """
+    Returns the sum of MC weights as computed by columnflow's ``mc_weight`` producer on consecutive
+    chunks of *chunk_size* entries, i.e., the sum of *lhe_weight* (``LHEWeight_originalXWGTUP``, if
+    not *None*) in chunks where *gen_weight* is always one and of *gen_weight* otherwise. Weights
+    are summed as the float32 values stored by the producer.
+    """
+    total = 0.0
+    for start in range(0, len(gen_weight), chunk_size):
+        weights = gen_weight[start:start + chunk_size]
+        if lhe_weight is not None and np.all(weights == 1.0):
+            weights = lhe_weight[start:start + chunk_size]
+        total += float(np.sum(weights.astype(np.float32).astype(np.float64)))
+    return total
+
+
+def _nano_branches(events: ak.Array, counters: Sequence[str]) -> dict[str, ak.Array]:
+    # group collection branches into records so that uproot writes them with their counter branch
+    branches = {}
+    collections = {}
+    for name in events.fields:
+        if name in counters:
+            continue
+        prefix = name.split("_", 1)[0]
+        if "_" in name and f"n{prefix}" in counters and events[name].ndim > 1:
+            collections.setdefault(prefix, {})[name[len(prefix) + 1:]] = events[name]
+        else:
+            branches[name] = events[name]
+    branches.update({name: ak.zip(fields) for name, fields in collections.items()})
+    return branches
+
+
+def _branch_types(branches: dict[str, ak.Array]) -> dict:
+    return {
+        name: values.type.content if values.ndim > 1 else values.type.content.primitive
+        for name, values in branches.items()
+    }
+
+
+def skim_tree(
+    tree: uproot.TTree,
+    path: str,
+    patterns: Iterable[str],
+    is_mc: bool,
+    lepton_cuts: dict[str, dict[str, str]],
+    pt_scale: float = 1.0,
+    chunk_size: int = 100000,
+    mc_weight_chunk_size: int = 100000,
+) -> dict[str, float]:
+    """
+    Writes all events of the NanoAOD *tree* with at least four leptons passing the loose
+    *lepton_cuts* with *pt_scale* (see :py:func:`loose_four_lepton_mask`) and an opposite-sign
+    same-flavour pair (see :py:func:`has_os_sf_pair`) to an ``Events`` tree in the ROOT file at
+    *path*, keeping the branches matching the column *patterns*. Clusters without any candidate
+    event are not read, the others are read in steps of about *chunk_size* entries.
+
+    Returns the number of events and, for MC, the sum of MC weights before (``num_events``,
+    ``sum_mc_weight``) and after the skim (``num_events_skimmed``, ``sum_mc_weight_skimmed``), which
+    are needed to correct selection statistics. As columnflow's ``mc_weight`` chooses between
+    ``genWeight`` and ``LHEWeight_originalXWGTUP`` per chunk it reads, both sums are computed per
+    chunk of *mc_weight_chunk_size* entries (see :py:func:`mc_weight_sum`) of the original and the
+    skimmed tree, respectively, which should be the chunk size of the tasks reading the skims.
+    """
+    branches = skim_branches(tree, patterns)
+    loose_branches = lepton_branches(lepton_cuts)
+    prefixes = {name.split("_", 1)[0] for name in branches}
+    counters = [name for name in branches if name.startswith("n") and name[1:] in prefixes]
+
+    stats = {"num_events": int(tree.num_entries), "num_events_skimmed": 0}
+    weights = None
+    if is_mc:
+        weights = {"genWeight": tree["genWeight"].array(library="np")}
+        if "LHEWeight_originalXWGTUP" in tree:
+            weights["LHEWeight_originalXWGTUP"] = tree["LHEWeight_originalXWGTUP"].array(library="np")
+        stats["sum_mc_weight"] = mc_weight_sum(
+            weights["genWeight"],
+            weights.get("LHEWeight_originalXWGTUP"),
+            mc_weight_chunk_size,
+        )
+        skimmed_weights = {name: [] for name in weights}
+
+    # loose four-lepton candidates, reading only lepton multiplicities and the loose cut columns
+    mask = loose_four_lepton_mask(tree, lepton_cuts, pt_scale)
+    offsets = tree.common_entry_offsets(filter_name=branches + loose_branches)
+
+    # group selected clusters into steps of about chunk_size entries
+    steps = []
+    for start, stop in entry_ranges(offsets, mask):
+        edges = [start]
+        for boundary in offsets:
+            if start < boundary < stop and boundary - edges[-1] >= chunk_size:
+                edges.append(int(boundary))
+        edges.append(stop)
+        steps.extend(zip(edges[:-1], edges[1:]))
+
+    with uproot.recreate(path) as f:
+        out_tree = None
+        for start, stop in steps:
+            events = tree.arrays(sorted(set(branches) | set(loose_branches)), entry_start=start, entry_stop=stop)
+            chunk_mask = mask[start:stop].copy()
+            chunk_mask[chunk_mask] = ak.to_numpy(has_os_sf_pair(events[chunk_mask], lepton_cuts, pt_scale))
+            events = events[chunk_mask][branches]
+
+            stats["num_events_skimmed"] += len(events)
+            if weights is not None:
+                for name, values in weights.items():
+                    skimmed_weights[name].append(values[start:stop][chunk_mask])
+
+            nano = _nano_branches(events, counters)
+            if out_tree is None:
+                out_tree = f.mktree("Events", _branch_types(nano))
+            if len(events):
+                out_tree.extend(nano)
+
+        # empty tree with the same branches when no event passes
+        if out_tree is None:
+            f.mktree("Events", _branch_types(_nano_branches(tree.arrays(branches, entry_stop=0), counters)))
+
+    # chunks of the skimmed tree contain the events in the same order, LHE weights are only read
+    # from it when kept
+    if weights is not None:
+        skimmed_weights = {
+            name: np.concatenate(values) if values else weights[name][:0]
+            for name, values in skimmed_weights.items()
+        }
+        stats["sum_mc_weight_skimmed"] = mc_weight_sum(
+            skimmed_weights["genWeight"],
+            skimmed_weights.get("LHEWeight_originalXWGTUP") if "LHEWeight_originalXWGTUP" in branches else None,
+            mc_weight_chunk_size,
+        )
+
+    return stats
+
+
+def add_skimmed_stats(stats: dict, skim_stats: dict, process_id: int | None = None) -> dict:
+    """
+    Adds the number of events and sum of MC weights removed by a skim, given by its *skim_stats*
+    (see :py:func:`skim_tree`), to the selection *stats* obtained on the skim, including their
+    ``*_per_process`` entries for *process_id* if given. *stats* is updated in-place and returned.
+    """
+    for name in ["num_events", "sum_mc_weight"]:
+        if name not in skim_stats:
+            continue
+        removed = skim_stats[name] - skim_stats[f"{name}_skimmed"]
+        stats[name] = stats.get(name, 0) + removed
+        per_process = stats.get(f"{name}_per_process")
+        if process_id is not None and per_process is not None:
+            per_process[str(process_id)] = per_process.get(str(process_id), 0) + removed
+    return stats
@@ -3,3 +3,4 @@
 
 # provisioning imports
 import h4l.tasks.base
+import h4l.tasks.skim
@@ -0,0 +1,91 @@
+# coding: utf-8
+
+"""
+Tasks creating four-lepton skims of NanoAOD files.
+"""
+
+import law
+
+from columnflow.tasks.framework.base import Requirements, DatasetTask
+from columnflow.tasks.framework.remote import RemoteWorkflow
+from columnflow.tasks.external import GetDatasetLFNs
+from columnflow.util import ensure_proxy, dev_sandbox
+
+from h4l.tasks.base import H4LTask
+
+
+class SkimEvents(
+    H4LTask,
+    DatasetTask,
+    law.LocalWorkflow,
+    RemoteWorkflow,
+):
+    """
+    Writes events with at least four loose leptons and an opposite-sign same-flavour pair (see
+    :py:func:`h4l.skim.skim_tree`) per NanoAOD file to a local ROOT file, keeping the columns listed
+    in ``cfg.x.keep_columns["h4l.SkimEvents"]``. Loose leptons pass the cuts of
+    ``cfg.x.lepton_cuts`` named in ``cfg.x.skim_lepton_cuts``. When ``h4l_read_skims`` is enabled in the
+    ``[analysis]`` section of the law config, calibration, selection and reduction read these skims
+    instead of the original files (see :py:func:`h4l.columnflow_patches.patch_skim_inputs`). As the
+    skim runs before any calibration, loose pt cuts are applied to the pt scaled by
+    ``cfg.x.skim_lepton_pt_scale``.
+    """
+
+    sandbox = dev_sandbox(law.config.get("analysis", "default_columnar_sandbox"))
+
+    # upstream requirements
+    reqs = Requirements(
+        RemoteWorkflow.reqs,
+        GetDatasetLFNs=GetDatasetLFNs,
+    )
+
+    # number of entries read at once
+    chunk_size = 100000
+
+    def workflow_requires(self):
+        reqs = super().workflow_requires()
+        reqs["lfns"] = self.reqs.GetDatasetLFNs.req(self)
+        return reqs
+
+    def requires(self):
+        return {"lfns": self.reqs.GetDatasetLFNs.req(self)}
+
+    def output(self):
+        return {
+            "events": self.target(f"skim_{self.branch}.root"),
+            "stats": self.target(f"stats_{self.branch}.json"),
+        }
+
+    @law.decorator.log
+    @ensure_proxy
+    @law.decorator.localize(input=False, output=True)
+    @law.decorator.safe_output
+    def run(self):
+        from h4l.skim import skim_tree, loose_lepton_cuts
+
+        lfn_task = self.requires()["lfns"]
+        outputs = self.output()
+
+        # let the lfn_task prepare the nano file (basically determine a good pfn)
+        [(lfn_index, input_file)] = lfn_task.iter_nano_files(self)
+
+        with self.publish_step("load and open ..."):
+            nano_file = input_file.load(formatter="uproot")
+
+        with self.publish_step("skimming ..."):
+            stats = skim_tree(
+                nano_file["Events"],
+                outputs["events"].path,
+                self.config_inst.x.keep_columns.get(self.task_family, ["*"]),
+                is_mc=self.dataset_inst.is_mc,
+                lepton_cuts=loose_lepton_cuts(self.config_inst),
+                pt_scale=self.config_inst.x("skim_lepton_pt_scale", 1.0),
+                chunk_size=self.chunk_size,
+                # chunk size of the tasks reading the skims, used to sum mc weights like mc_weight
+                mc_weight_chunk_size=law.config.get_expanded_int("analysis", "chunked_io_chunk_size", 100000),
+            )
+
+        outputs["stats"].dump(stats, indent=4, formatter="json")
+
+        self.publish_message(f"all events  : {stats['num_events']}")
+        self.publish_message(f"skim events : {stats['num_events_skimmed']}")
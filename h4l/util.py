@@ -8,25 +8,221 @@ from __future__ import annotations
 
 __all__ = ["IF_NANO_V9", "IF_NANO_V10"]
 
+import os
 import re
+import ast
+import json
 import itertools
 import time
-from typing import Any, Hashable, Iterable, Callable
+from contextlib import contextmanager
+from typing import Any, Hashable, Iterable, Callable, Sequence
 from functools import wraps, reduce, partial
 import tracemalloc
 
 import law
 
 from columnflow.types import Any
-from columnflow.columnar_util import ArrayFunction, deferred_column, get_ak_routes
+from columnflow.columnar_util import ArrayFunction, Route, deferred_column, get_ak_routes
 from columnflow.util import maybe_import
 
 np = maybe_import("numpy")
 ak = maybe_import("awkward")
 coffea = maybe_import("coffea")
+nb = maybe_import("numba")
 
 _logger = law.logger.get_logger(__name__)
 
+# nominal Z boson mass in GeV, used to rank Z candidates
+Z_MASS = 91.1876
+
+# flavour channels of ZZ candidates, in the order in which they are concatenated by the selection
+ZZ_CHANNEL_2E2MU, ZZ_CHANNEL_4E, ZZ_CHANNEL_4MU = range(3)
+
+
+def _jit(func: Callable) -> Callable:
+    """
+    Compiles *func* with numba in nopython mode when available and returns it unchanged otherwise
+    (e.g. outside of the columnar sandbox), which is slow but yields identical results.
+    """
+    return nb.njit(cache=True)(func) if nb else func
+
+
+class LorentzVectors(object):
+    """
+    Lightweight struct-of-arrays container of four-vectors stored as flat NumPy buffers of the
+    cartesian components *x*, *y*, *z* and *t*, plus optional per-event *counts* for jagged
+    collections. It covers the arithmetic needed on hot paths without attaching coffea behaviors
+    and without allocating awkward records.
+
+    Conversions from (pt, eta, phi, mass) follow the formulas of the coffea behaviors, so that
+    components are identical to those obtained through ``events.Electron.x``, etc.
+
+    .. code-block:: python
+
+        leading_electrons = LorentzVectors.from_collection(events.Electron[:, :2])
+        dielectron_mass = leading_electrons.sum().mass
+    """
+
+    __slots__ = ("x", "y", "z", "t", "counts")
+
+    def __init__(
+        self,
+        x: np.ndarray,
+        y: np.ndarray,
+        z: np.ndarray,
+        t: np.ndarray,
+        counts: np.ndarray | None = None,
+    ):
+        super().__init__()
+
+        self.x = x
+        self.y = y
+        self.z = z
+        self.t = t
+        self.counts = counts
+
+    @classmethod
+    def from_ptetaphim(
+        cls,
+        pt: np.ndarray,
+        eta: np.ndarray,
+        phi: np.ndarray,
+        mass: np.ndarray,
+        counts: np.ndarray | None = None,
+    ) -> LorentzVectors:
+        x = pt * np.cos(phi)
+        y = pt * np.sin(phi)
+        z = pt * np.sinh(eta)
+        expmeta = np.exp(-eta)
+        invsintheta = 0.5 * (1 + expmeta**2) / expmeta
+        t = np.sqrt(np.maximum(np.copysign(mass**2, mass) + pt**2 * invsintheta**2, 0))
+        return cls(x, y, z, t, counts)
+
+    @classmethod
+    def from_collection(cls, coll: ak.Array) -> LorentzVectors:
+        """
+        Creates four-vectors from the ``pt``, ``eta``, ``phi`` and ``mass`` fields of a (jagged)
+        collection *coll*, e.g. ``events.Jet``.
+        """
+        counts = None
+        if coll.ndim > 1:
+            counts = ak.to_numpy(ak.num(coll, axis=1))
+            coll = ak.flatten(coll, axis=1)
+        return cls.from_ptetaphim(*(ak.to_numpy(coll[f]) for f in ("pt", "eta", "phi", "mass")), counts=counts)
+
+    @classmethod
+    def where(cls, mask: np.ndarray, a: LorentzVectors, b: LorentzVectors) -> LorentzVectors:
+        return cls(*(np.where(mask, u, v) for u, v in zip(a.components, b.components)), a.counts)
+
+    @property
+    def components(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        return self.x, self.y, self.z, self.t
+
+    @property
+    def offsets(self) -> np.ndarray:
+        return np.concatenate([[0], np.cumsum(self.counts)])
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def __add__(self, other: LorentzVectors) -> LorentzVectors:
+        return self.__class__(*(u + v for u, v in zip(self.components, other.components)), self.counts)
+
+    def __sub__(self, other: LorentzVectors) -> LorentzVectors:
+        return self.__class__(*(u - v for u, v in zip(self.components, other.components)), self.counts)
+
+    @property
+    def energy(self) -> np.ndarray:
+        return self.t
+
+    @property
+    def pt(self) -> np.ndarray:
+        return np.sqrt(self.x**2 + self.y**2)
+
+    @property
+    def rho(self) -> np.ndarray:
+        # magnitude of the three-momentum
+        return np.sqrt(self.x**2 + self.y**2 + self.z**2)
+
+    @property
+    def eta(self) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            eta = np.arcsinh(self.z / self.pt)
+        # vectors along the beam axis
+        return np.where(np.isnan(eta), np.copysign(np.inf, self.z) * (self.z != 0), eta)
+
+    @property
+    def rapidity(self) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return 0.5 * np.log((self.t + self.z) / (self.t - self.z))
+
+    @property
+    def phi(self) -> np.ndarray:
+        return np.arctan2(self.y, self.x)
+
+    @property
+    def mass(self) -> np.ndarray:
+        return _lv_mass(self.x, self.y, self.z, self.t)
+
+    def delta_r(self, other: LorentzVectors) -> np.ndarray:
+        delta_phi = (self.phi - other.phi + np.pi) % (2 * np.pi) - np.pi
+        return np.sqrt((self.eta - other.eta)**2 + delta_phi**2)
+
+    def sum(self) -> LorentzVectors:
+        """
+        Sums vectors per event, returning one (possibly zero) vector per event.
+        """
+        starts = self.offsets[:-1]
+        empty = self.counts == 0
+
+        def segment_sum(values):
+            # pad to allow starts of trailing empty events, then reset their sums
+            sums = np.add.reduceat(np.append(values, values.dtype.type(0)), starts) if len(starts) else values[:0]
+            sums[empty] = 0
+            return sums
+
+        return self.__class__(*map(segment_sum, self.components))
+
+    def take(self, local_idx: ak.Array) -> tuple[LorentzVectors, np.ndarray]:
+        """
+        Gathers vectors with per-event *local_idx* of another collection, e.g. ``Jet.electronIdx1``,
+        and returns them aligned with that collection together with a mask that is *False* where
+        the index is negative (i.e. nothing matched). Unmatched entries are zero vectors.
+        """
+        counts = ak.to_numpy(ak.num(local_idx, axis=1))
+        local_idx = ak.to_numpy(ak.flatten(local_idx, axis=1))
+        event_idx = np.repeat(np.arange(len(counts)), counts)
+        valid = (local_idx >= 0) & (local_idx < self.counts[event_idx])
+        flat_idx = np.where(valid, self.offsets[event_idx] + local_idx, 0)
+
+        def gather(values):
+            return np.where(valid, values[flat_idx], 0) if len(values) else np.zeros(len(flat_idx), values.dtype)
+
+        return self.__class__(*map(gather, self.components), counts), valid
+
+    def unflatten(self, values: np.ndarray) -> ak.Array:
+        """
+        Wraps flat *values* computed on these vectors into a (jagged) awkward array.
+        """
+        return ak.Array(values) if self.counts is None else ak.unflatten(values, self.counts)
+
+
+def lv_xyzt(coll: ak.Array | LorentzVectors) -> LorentzVectors:
+    """
+    Returns cartesian :py:class:`LorentzVectors` of a collection *coll* with ``pt``, ``eta``, ``phi``
+    and ``mass`` fields, or *coll* itself when it already is one.
+    """
+    return coll if isinstance(coll, LorentzVectors) else LorentzVectors.from_collection(coll)
+
+
+def lv_mass(lv: LorentzVectors) -> ak.Array:
+    """
+    Converts :py:class:`LorentzVectors` *lv* into a (jagged) awkward array with ``pt``, ``eta``,
+    ``phi`` and ``mass`` fields.
+    """
+    return lv.unflatten(ak.zip({"pt": lv.pt, "eta": lv.eta, "phi": lv.phi, "mass": lv.mass}))
+
+
 def build_2e2mu(muons_plus, muons_minus, electrons_plus, electrons_minus):
     mu1, mu2, e1, e2 = ak.unzip(
         ak.cartesian([muons_plus, muons_minus, electrons_plus, electrons_minus])
@@ -78,12 +274,970 @@ def build_4sf(leptons_plus, leptons_minus):
   return ak.zip({"z1": z1, "z2": z2, "zz": zz}, depth_limit=1)
 
 
-def masked_sorted_indices(mask: ak.Array, sort_var: ak.Array, ascending: bool = False) -> ak.Array:
-  """
-  Helper function to obtain the correct indices of an object mask
-  """
-  indices = ak.argsort(sort_var, axis=-1, ascending=ascending)
-  return indices[mask[indices]]
+def _lv_mass(x, y, z, t):
+    # mirrors the cartesian mass computation of coffea's LorentzVector behavior
+    m2 = t * t - (x * x + y * y + z * z)
+    return np.copysign(np.sqrt(np.abs(m2)), m2)
+
+
+_lv_mass = _jit(_lv_mass)
+
+
+def _window_bits(m1, m2, mzz, bounds):
+    # bits of the mass windows with bounds of shape (n_windows, 3, 2) on (mz1, mz2, mzz), nan for
+    # open bounds, that are passed by a candidate with the masses m1, m2 and mzz
+    bits = np.uint64(0)
+    for w in range(bounds.shape[0]):
+        passed = True
+        for k in range(3):
+            m = m1 if k == 0 else (m2 if k == 1 else mzz)
+            lower, upper = bounds[w, k, 0], bounds[w, k, 1]
+            if (not np.isnan(lower) and not m > lower) or (not np.isnan(upper) and not m < upper):
+                passed = False
+                break
+        if passed:
+            bits |= np.uint64(1) << np.uint64(w)
+    return bits
+
+
+_window_bits = _jit(_window_bits)
+
+
+def _zz_candidates_2e2mu(
+    mu_x, mu_y, mu_z, mu_t, mu_charge, mu_start, mu_stop,
+    e_x, e_y, e_z, e_t, e_charge, e_start, e_stop,
+    mz, bounds, out_comp, out_idx,
+):
+    # walks all (mu+, mu-, e+, e-) combinations of one event in the order of build_2e2mu and stores
+    # the candidate whose Z1 is closest to mz in out_comp (z1, z2, zz x (x, y, z, t)) and out_idx,
+    # returns whether a candidate was found and the OR of the window bits of all combinations
+    found = False
+    best = mz
+    bits = np.uint64(0)
+    for i1 in range(mu_start, mu_stop):
+        if mu_charge[i1] <= 0:
+            continue
+        for i2 in range(mu_start, mu_stop):
+            if mu_charge[i2] >= 0:
+                continue
+            zmu_x = mu_x[i1] + mu_x[i2]
+            zmu_y = mu_y[i1] + mu_y[i2]
+            zmu_z = mu_z[i1] + mu_z[i2]
+            zmu_t = mu_t[i1] + mu_t[i2]
+            mmu = _lv_mass(zmu_x, zmu_y, zmu_z, zmu_t)
+            dmu = np.abs(mmu - mz)
+            for i3 in range(e_start, e_stop):
+                if e_charge[i3] <= 0:
+                    continue
+                for i4 in range(e_start, e_stop):
+                    if e_charge[i4] >= 0:
+                        continue
+                    ze_x = e_x[i3] + e_x[i4]
+                    ze_y = e_y[i3] + e_y[i4]
+                    ze_z = e_z[i3] + e_z[i4]
+                    ze_t = e_t[i3] + e_t[i4]
+                    me = _lv_mass(ze_x, ze_y, ze_z, ze_t)
+                    de = np.abs(me - mz)
+                    # same (strict) ordering as build_2e2mu
+                    if dmu < de:
+                        d1, m1, m2 = dmu, mmu, me
+                        z1_x, z1_y, z1_z, z1_t = zmu_x, zmu_y, zmu_z, zmu_t
+                        z2_x, z2_y, z2_z, z2_t = ze_x, ze_y, ze_z, ze_t
+                    else:
+                        d1, m1, m2 = de, me, mmu
+                        z1_x, z1_y, z1_z, z1_t = ze_x, ze_y, ze_z, ze_t
+                        z2_x, z2_y, z2_z, z2_t = zmu_x, zmu_y, zmu_z, zmu_t
+                    # mass windows are evaluated on all combinations, not only the best one
+                    if bounds.shape[0]:
+                        mzz = _lv_mass(z1_x + z2_x, z1_y + z2_y, z1_z + z2_z, z1_t + z2_t)
+                        bits |= _window_bits(m1, m2, mzz, bounds)
+                    if found and not d1 < best:
+                        continue
+                    found = True
+                    best = d1
+                    out_comp[0, 0], out_comp[0, 1], out_comp[0, 2], out_comp[0, 3] = z1_x, z1_y, z1_z, z1_t
+                    out_comp[1, 0], out_comp[1, 1], out_comp[1, 2], out_comp[1, 3] = z2_x, z2_y, z2_z, z2_t
+                    out_comp[2, 0] = z1_x + z2_x
+                    out_comp[2, 1] = z1_y + z2_y
+                    out_comp[2, 2] = z1_z + z2_z
+                    out_comp[2, 3] = z1_t + z2_t
+                    # indices in (Z1, Z2) order, with electrons following the muons of the event
+                    n_mu = mu_stop - mu_start
+                    if dmu < de:
+                        out_idx[0], out_idx[1] = i1 - mu_start, i2 - mu_start
+                        out_idx[2], out_idx[3] = n_mu + i3 - e_start, n_mu + i4 - e_start
+                    else:
+                        out_idx[0], out_idx[1] = n_mu + i3 - e_start, n_mu + i4 - e_start
+                        out_idx[2], out_idx[3] = i1 - mu_start, i2 - mu_start
+    return found, bits
+
+
+_zz_candidates_2e2mu = _jit(_zz_candidates_2e2mu)
+
+
+def _zz_candidates_4sf(x, y, z, t, charge, start, stop, mz, bounds, out_comp, out_idx):
+    # walks all pairs of (l+, l+) and (l-, l-) combinations of one event in the order of build_4sf
+    # and stores the candidate whose Z1 is closest to mz in out_comp and out_idx, returns whether a
+    # candidate was found and the OR of the window bits of all combinations
+    found = False
+    best = mz
+    bits = np.uint64(0)
+    pairs = np.empty((4, 2), dtype=np.int64)
+    comps = np.empty((4, 4), dtype=x.dtype)
+    masses = np.empty(4, dtype=x.dtype)
+    dists = np.empty(4, dtype=x.dtype)
+    for p1 in range(start, stop):
+        if charge[p1] <= 0:
+            continue
+        for p2 in range(p1 + 1, stop):
+            if charge[p2] <= 0:
+                continue
+            for m1 in range(start, stop):
+                if charge[m1] >= 0:
+                    continue
+                for m2 in range(m1 + 1, stop):
+                    if charge[m2] >= 0:
+                        continue
+                    # the four opposite-sign pairs z11, z12, z21, z22 of build_4sf
+                    pairs[0, 0], pairs[0, 1] = p1, m1
+                    pairs[1, 0], pairs[1, 1] = p1, m2
+                    pairs[2, 0], pairs[2, 1] = p2, m1
+                    pairs[3, 0], pairs[3, 1] = p2, m2
+                    for k in range(4):
+                        a, b = pairs[k, 0], pairs[k, 1]
+                        comps[k, 0] = x[a] + x[b]
+                        comps[k, 1] = y[a] + y[b]
+                        comps[k, 2] = z[a] + z[b]
+                        comps[k, 3] = t[a] + t[b]
+                        masses[k] = _lv_mass(comps[k, 0], comps[k, 1], comps[k, 2], comps[k, 3])
+                        dists[k] = np.abs(masses[k] - mz)
+                    # same (strict) ordering of the cascaded comparisons in build_4sf,
+                    # with z2 always being the complementary pair of z1
+                    k1 = 0 if dists[0] < dists[1] else 1
+                    if not dists[k1] < dists[2]:
+                        k1 = 2
+                    if not dists[k1] < dists[3]:
+                        k1 = 3
+                    k2 = 3 - k1
+                    # mass windows are evaluated on all combinations, not only the best one
+                    if bounds.shape[0]:
+                        mzz = _lv_mass(
+                            comps[k1, 0] + comps[k2, 0],
+                            comps[k1, 1] + comps[k2, 1],
+                            comps[k1, 2] + comps[k2, 2],
+                            comps[k1, 3] + comps[k2, 3],
+                        )
+                        bits |= _window_bits(masses[k1], masses[k2], mzz, bounds)
+                    if found and not dists[k1] < best:
+                        continue
+                    found = True
+                    best = dists[k1]
+                    for c in range(4):
+                        out_comp[0, c] = comps[k1, c]
+                        out_comp[1, c] = comps[k2, c]
+                        out_comp[2, c] = comps[k1, c] + comps[k2, c]
+                    out_idx[0] = pairs[k1, 0] - start
+                    out_idx[1] = pairs[k1, 1] - start
+                    out_idx[2] = pairs[k2, 0] - start
+                    out_idx[3] = pairs[k2, 1] - start
+    return found, bits
+
+
+_zz_candidates_4sf = _jit(_zz_candidates_4sf)
+
+
+def _zz_candidates_kernel(
+    mu_x, mu_y, mu_z, mu_t, mu_charge, mu_starts, mu_stops,
+    e_x, e_y, e_z, e_t, e_charge, e_starts, e_stops,
+    mz, bounds,
+):
+    # single pass over all events, filling at most one candidate per channel and event and the OR of
+    # the window bits of all combinations per event, events are defined by the start and stop
+    # positions of their leptons in the flat buffers
+    n_events = len(mu_starts)
+    counts = np.zeros(n_events, dtype=np.int64)
+    event_bits = np.zeros(n_events, dtype=np.uint64)
+    channels = np.empty(3 * n_events, dtype=np.int8)
+    comps = np.empty((3 * n_events, 3, 4), dtype=mu_x.dtype)
+    idx = np.empty((3 * n_events, 4), dtype=np.int64)
+    n = 0
+    for i in range(n_events):
+        n_before = n
+        mu_start, mu_stop = mu_starts[i], mu_stops[i]
+        e_start, e_stop = e_starts[i], e_stops[i]
+        found, bits = _zz_candidates_2e2mu(
+            mu_x, mu_y, mu_z, mu_t, mu_charge, mu_start, mu_stop,
+            e_x, e_y, e_z, e_t, e_charge, e_start, e_stop,
+            mz, bounds, comps[n], idx[n],
+        )
+        event_bits[i] |= bits
+        if found:
+            channels[n] = 0
+            n += 1
+        found, bits = _zz_candidates_4sf(
+            e_x, e_y, e_z, e_t, e_charge, e_start, e_stop, mz, bounds, comps[n], idx[n],
+        )
+        event_bits[i] |= bits
+        if found:
+            idx[n] += mu_stop - mu_start
+            channels[n] = 1
+            n += 1
+        found, bits = _zz_candidates_4sf(
+            mu_x, mu_y, mu_z, mu_t, mu_charge, mu_start, mu_stop, mz, bounds, comps[n], idx[n],
+        )
+        event_bits[i] |= bits
+        if found:
+            channels[n] = 2
+            n += 1
+        counts[i] = n - n_before
+    return counts, channels[:n], comps[:n], idx[:n], event_bits
+
+
+_zz_candidates_kernel = _jit(_zz_candidates_kernel)
+
+
+def build_zz_candidates(
+    electrons: ak.Array,
+    muons: ak.Array,
+    windows: dict[str, tuple] | None = None,
+) -> ak.Array | tuple[ak.Array, np.ndarray]:
+    """
+    Fused replacement of :py:func:`build_2e2mu` and :py:func:`build_4sf` that walks the flat
+    *electrons* and *muons* content once per event and returns, per event, the best ZZ candidate
+    of each flavour channel, i.e., the one whose Z1 mass is closest to :py:data:`Z_MASS`.
+
+    Both collections must provide ``pt``, ``eta``, ``phi``, ``mass`` and ``charge`` fields, no
+    behaviors are required. Candidates are returned as a jagged array with
+    up to three entries per event, ordered as 2e2mu, 4e and 4mu, each with the fields
+
+        - ``channel``: one of :py:data:`ZZ_CHANNEL_2E2MU`, :py:data:`ZZ_CHANNEL_4E` or
+          :py:data:`ZZ_CHANNEL_4MU`,
+        - ``z1``, ``z2``, ``zz``: records with ``x``, ``y``, ``z``, ``t`` and ``mass``,
+        - ``lepton_idx``: the four lepton indices, ordered as (Z1 l+, Z1 l-, Z2 l+, Z2 l-), that
+          refer to the leptons of the event with its electrons following its muons.
+
+    The arithmetic follows the builders exactly, so the values of each candidate are bit-identical
+    to the corresponding entry of the builders' outputs.
+
+    Events with more than four leptons of a flavour have several pairings per channel, of which
+    only the best one is returned. When mass *windows* are given (see :py:func:`mass_window_bits`),
+    they are evaluated on all pairings in the same pass, as on the full builders' outputs, and the
+    per-event window bits are returned as well.
+    """
+    mu, e = _LeptonBuffers.pair(muons, electrons)
+    cands, bits = _zz_candidates_from_buffers(
+        mu, e, np.arange(len(mu.counts)), _mass_window_bounds(windows or {}, mu.comps[0].dtype),
+    )
+    return cands if windows is None else (cands, bits.astype(bits_dtype(len(windows))))
+
+
+def build_zz_candidates_bucketed(
+    electrons: ak.Array,
+    muons: ak.Array,
+    windows: dict[str, tuple] | None = None,
+    batch_size: int = 10000,
+) -> ak.Array | tuple[ak.Array, np.ndarray]:
+    """
+    Same as :py:func:`build_zz_candidates`, but splits events by lepton multiplicity to bound the
+    peak memory. Events with up to four leptons have at most one pairing per channel and take a
+    vectorized fast path without any combinatorics, while the rare events with more leptons are
+    processed in sub-batches of *batch_size* events. Results are stitched back in event order.
+    """
+    mu, e = _LeptonBuffers.pair(muons, electrons)
+    bounds = _mass_window_bounds(windows or {}, mu.comps[0].dtype)
+    n_leptons = mu.counts + e.counts
+    fast_idx = np.flatnonzero(n_leptons <= 4)
+    slow_idx = np.flatnonzero(n_leptons > 4)
+
+    # the fast path returns all pairings, so its window bits follow from the candidates alone
+    fast_cands = _zz_candidates_fast(mu, e, fast_idx)
+    parts = [(fast_cands, _candidate_window_bits(fast_cands, bounds))]
+    order = [fast_idx]
+    for start in range(0, len(slow_idx), batch_size):
+        batch_idx = slow_idx[start:start + batch_size]
+        parts.append(_zz_candidates_from_buffers(mu, e, batch_idx, bounds))
+        order.append(batch_idx)
+
+    # stitch back in the original event order
+    cands = ak.concatenate([c for c, _ in parts], axis=0) if len(parts) > 1 else parts[0][0]
+    bits = np.concatenate([b for _, b in parts])
+    order = np.argsort(np.concatenate(order), kind="stable")
+    cands = cands[order]
+    return cands if windows is None else (cands, bits[order].astype(bits_dtype(len(windows))))
+
+
+class _LeptonBuffers(object):
+    # flat cartesian components, charges and per-event positions of a lepton collection
+
+    def __init__(self, coll: ak.Array):
+        lv = LorentzVectors.from_collection(coll)
+        self.comps = list(lv.components)
+        self.charge = ak.to_numpy(ak.flatten(coll.charge, axis=1))
+        self.counts = lv.counts
+        self.stops = np.cumsum(self.counts)
+        self.starts = self.stops - self.counts
+
+    @classmethod
+    def pair(cls, muons: ak.Array, electrons: ak.Array) -> tuple[_LeptonBuffers, _LeptonBuffers]:
+        # buffers of both collections with a common floating point type
+        mu, e = cls(muons), cls(electrons)
+        dtype = np.result_type(*mu.comps, *e.comps)
+        mu.comps = [c.astype(dtype, copy=False) for c in mu.comps]
+        e.comps = [c.astype(dtype, copy=False) for c in e.comps]
+        return mu, e
+
+    def select(self, event_idx: np.ndarray, n: int) -> tuple[list[np.ndarray], np.ndarray]:
+        # components of shape (4, n_events, n) and charges of shape (n_events, n) for events with
+        # exactly n leptons
+        flat_idx = (self.starts[event_idx][:, None] + np.arange(n)).ravel()
+        comps = np.stack([c[flat_idx].reshape(-1, n) for c in self.comps])
+        return comps, self.charge[flat_idx].reshape(-1, n)
+
+    def n_charged(self, sign: int) -> np.ndarray:
+        # number of leptons per event whose charge has the given sign
+        event_idx = np.repeat(np.arange(len(self.counts)), self.counts)
+        return np.bincount(event_idx[self.charge * sign > 0], minlength=len(self.counts))
+
+
+def _zz_candidates_from_buffers(
+    mu: _LeptonBuffers,
+    e: _LeptonBuffers,
+    event_idx: np.ndarray,
+    bounds: np.ndarray,
+) -> tuple[ak.Array, np.ndarray]:
+    # runs the kernel on the events at event_idx, returning the candidates and the window bits of
+    # all pairings per event
+    counts, channels, comps, idx, bits = _zz_candidates_kernel(
+        *mu.comps, mu.charge, mu.starts[event_idx], mu.stops[event_idx],
+        *e.comps, e.charge, e.starts[event_idx], e.stops[event_idx],
+        mu.comps[0].dtype.type(Z_MASS), bounds,
+    )
+    return _pack_zz_candidates(counts, channels, comps, idx), bits
+
+
+def _zz_candidates_fast(mu: _LeptonBuffers, e: _LeptonBuffers, event_idx: np.ndarray) -> ak.Array:
+    # closed form of build_zz_candidates for events with at most four leptons, where each channel
+    # has at most one lepton quadruplet, using the exact same arithmetic as the kernel
+    mz = mu.comps[0].dtype.type(Z_MASS)
+
+    n_e_plus, n_e_minus = e.n_charged(1)[event_idx], e.n_charged(-1)[event_idx]
+    n_mu_plus, n_mu_minus = mu.n_charged(1)[event_idx], mu.n_charged(-1)[event_idx]
+    n_e, n_mu = e.counts[event_idx], mu.counts[event_idx]
+
+    def quadruplet(buf, mask, n):
+        # components of the leptons of the selected events with the positively charged ones first,
+        # keeping their original order, and their local indices
+        comps, charge = buf.select(event_idx[mask], n)
+        local_idx = np.argsort(charge < 0, axis=1, kind="stable")
+        return np.take_along_axis(comps, local_idx[None], axis=2), local_idx
+
+    def pair(comps, a, b):
+        z = comps[:, :, a] + comps[:, :, b]
+        return z, np.abs(_lv_mass(*z) - mz)
+
+    rows = []
+
+    # 2e2mu: exactly one (mu+, mu-, e+, e-) combination
+    mask = (n_mu == 2) & (n_e == 2) & (n_mu_plus == 1) & (n_mu_minus == 1) & (n_e_plus == 1) & (n_e_minus == 1)
+    mu_q, mu_idx = quadruplet(mu, mask, 2)
+    e_q, e_idx = quadruplet(e, mask, 2)
+    (z_mu, d_mu), (z_e, d_e) = pair(mu_q, 0, 1), pair(e_q, 0, 1)
+    is_mu_closer = d_mu < d_e
+    z1 = np.where(is_mu_closer, z_mu, z_e)
+    z2 = np.where(is_mu_closer, z_e, z_mu)
+    idx = np.where(
+        is_mu_closer[:, None],
+        np.concatenate([mu_idx, e_idx + 2], axis=1),
+        np.concatenate([e_idx + 2, mu_idx], axis=1),
+    )
+    rows.append((np.flatnonzero(mask), ZZ_CHANNEL_2E2MU, z1, z2, idx))
+
+    # 4e and 4mu: one (l+, l+, l-, l-) quadruplet with the cascaded pairing of build_4sf, where
+    # electron indices need no offset as these events have no muons
+    pairs = np.array([(0, 2), (0, 3), (1, 2), (1, 3)])
+    for channel, buf, n, n_plus, n_minus in [
+        (ZZ_CHANNEL_4E, e, n_e, n_e_plus, n_e_minus),
+        (ZZ_CHANNEL_4MU, mu, n_mu, n_mu_plus, n_mu_minus),
+    ]:
+        mask = (n == 4) & (n_plus == 2) & (n_minus == 2)
+        q, local_idx = quadruplet(buf, mask, 4)
+        zs, ds = zip(*(pair(q, a, b) for a, b in pairs))
+        zs, ds = np.stack(zs), np.stack(ds)
+        cols = np.arange(ds.shape[1])
+        k1 = np.where(ds[0] < ds[1], 0, 1)
+        k1 = np.where(ds[k1, cols] < ds[2], k1, 2)
+        k1 = np.where(ds[k1, cols] < ds[3], k1, 3)
+        k2 = 3 - k1
+        rows.append((
+            np.flatnonzero(mask),
+            channel,
+            zs[k1, :, cols].T,
+            zs[k2, :, cols].T,
+            np.take_along_axis(local_idx, np.concatenate([pairs[k1], pairs[k2]], axis=1), axis=1),
+        ))
+
+    # sort candidates by event and channel
+    cand_event_idx = np.concatenate([r[0] for r in rows])
+    channels = np.concatenate([np.full(len(r[0]), r[1], dtype=np.int8) for r in rows])
+    z1 = np.concatenate([r[2] for r in rows], axis=1)
+    z2 = np.concatenate([r[3] for r in rows], axis=1)
+    idx = np.concatenate([r[4] for r in rows], axis=0).astype(np.int64)
+    order = np.lexsort((channels, cand_event_idx))
+    comps = np.stack([z1, z2, z1 + z2]).transpose(2, 0, 1)[order]
+
+    counts = np.bincount(cand_event_idx, minlength=len(event_idx))
+    return _pack_zz_candidates(counts, channels[order], comps, idx[order])
+
+
+def _pack_zz_candidates(
+    counts: np.ndarray,
+    channels: np.ndarray,
+    comps: np.ndarray,
+    idx: np.ndarray,
+) -> ak.Array:
+    # builds the jagged candidate array from flat channels, components of shape (n, 3, 4) and
+    # lepton indices of shape (n, 4)
+    def lv(i):
+        x, y, z, t = (comps[:, i, c] for c in range(4))
+        return ak.zip({"x": x, "y": y, "z": z, "t": t, "mass": _lv_mass(x, y, z, t)})
+
+    cands = ak.zip(
+        {
+            "channel": channels,
+            "z1": lv(0),
+            "z2": lv(1),
+            "zz": lv(2),
+            "lepton_idx": idx,
+        },
+        depth_limit=1,
+    )
+
+    return ak.unflatten(cands, counts)
+
+
+class _ColumnSubscripter(ast.NodeTransformer):
+
+    def __init__(self, columns: Sequence[str]):
+        super().__init__()
+        self.columns = columns
+
+    def visit_Name(self, node: ast.Name) -> ast.AST:
+        if node.id not in self.columns:
+            return node
+        return ast.Subscript(value=node, slice=ast.Name(id="i", ctx=ast.Load()), ctx=node.ctx)
+
+
+# syntax allowed in cut expressions, i.e., everything that has the same semantics on numpy arrays
+# and on the scalars in the compiled loop, so no boolean operators (and, or, not), conditional
+# expressions or chained comparisons
+_cut_nodes = (
+    ast.Expression, ast.Name, ast.Load, ast.Constant, ast.Call, ast.BinOp, ast.UnaryOp, ast.Compare,
+    ast.BitAnd, ast.BitOr, ast.BitXor, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod,
+    ast.Pow, ast.Invert, ast.USub, ast.UAdd, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq,
+)
+
+
+def _check_cut(name: str, expr: str, tree: ast.AST, functions: dict) -> None:
+    for node in ast.walk(tree):
+        msg = None
+        if not isinstance(node, _cut_nodes):
+            msg = f"unsupported syntax '{type(node).__name__}'"
+        elif isinstance(node, ast.Constant) and not isinstance(node.value, (bool, int, float)):
+            msg = f"unsupported constant {node.value!r}"
+        elif isinstance(node, ast.Compare) and len(node.ops) > 1:
+            msg = "unsupported chained comparison"
+        elif isinstance(node, ast.Call) and (
+            not isinstance(node.func, ast.Name) or node.func.id not in functions or node.keywords
+        ):
+            msg = f"unsupported call '{ast.unparse(node)}', only {', '.join(functions)} can be called"
+        if msg:
+            raise ValueError(f"{msg} in cut '{name}': {expr}")
+
+
+class CutTable(object):
+    """
+    Named *cuts* on the objects of a collection, each given as an expression of the collection's
+    columns (e.g. ``"abs(sip3d) < 4"``) with the same semantics as on numpy arrays, compiled once
+    into a single numba loop over the flat column buffers that evaluates all cuts per object
+    without per-cut temporary arrays, stopping at the first failed cut. Without numba, the combined
+    expression is evaluated on the flat numpy arrays instead, which yields identical results.
+
+    Expressions consist of columns, numbers, arithmetic, comparisons, the bitwise operators ``&``,
+    ``|``, ``^`` and ``~`` and calls to :py:attr:`functions`, other syntax raises a *ValueError*.
+    Referenced columns are available as :py:attr:`columns`, e.g. to declare the columns used by a
+    selector. Tables are usually obtained through :py:func:`cut_table`, which caches compilations.
+    """
+
+    # functions that can be used in cut expressions
+    functions = {"abs": abs}
+
+    def __init__(self, cuts: dict[str, str]):
+        self.cuts = dict(cuts)
+
+        # parse expressions and collect the referenced columns
+        trees = {name: ast.parse(expr, mode="eval").body for name, expr in self.cuts.items()}
+        for name, tree in trees.items():
+            _check_cut(name, self.cuts[name], tree, self.functions)
+        self.columns = sorted({
+            node.id
+            for tree in trees.values()
+            for node in ast.walk(tree)
+            if isinstance(node, ast.Name) and node.id not in self.functions
+        })
+
+        # combined expression on full arrays
+        self._expression = " & ".join(f"({expr})" for expr in self.cuts.values()) or "True"
+
+        # kernel evaluating all cuts per object
+        self._kernel = None
+        if nb and self.cuts:
+            subscripter = _ColumnSubscripter(self.columns)
+            checks = " and ".join(
+                f"bool({ast.unparse(subscripter.visit(tree))})"
+                for tree in trees.values()
+            )
+            source = (
+                f"def kernel(out, {', '.join(self.columns)}):\n"
+                f"    for i in range(len(out)):\n"
+                f"        out[i] = {checks}\n"
+            )
+            namespace = {}
+            exec(compile(source, "<cut table>", "exec"), dict(self.functions), namespace)
+            self._kernel = nb.njit(namespace["kernel"])
+
+    def __call__(self, collection: ak.Array) -> ak.Array:
+        """
+        Returns the per-object mask of all cuts applied to the jagged *collection*.
+        """
+        missing = [column for column in self.columns if column not in collection.fields]
+        if missing:
+            raise ValueError(f"columns {', '.join(missing)} required by cuts {', '.join(self.cuts)} are missing")
+        counts = ak.num(collection, axis=1)
+        flat = [ak.to_numpy(ak.flatten(collection[column], axis=1)) for column in self.columns]
+        if self._kernel is not None:
+            mask = np.empty(len(flat[0]), dtype=bool)
+            self._kernel(mask, *flat)
+        elif flat:
+            mask = np.asarray(eval(self._expression, dict(self.functions), dict(zip(self.columns, flat))), dtype=bool)
+        else:
+            mask = np.ones(int(ak.sum(counts)), dtype=bool)
+        return ak.unflatten(mask, counts)
+
+
+_cut_tables: dict[tuple, CutTable] = {}
+
+
+def cut_table(cuts: dict[str, str]) -> CutTable:
+    """
+    Returns the :py:class:`CutTable` of *cuts*, compiling it only once per process.
+    """
+    key = tuple(cuts.items())
+    if key not in _cut_tables:
+        _cut_tables[key] = CutTable(cuts)
+    return _cut_tables[key]
+
+
+def binned_threshold_mask(
+    pt: np.ndarray,
+    abs_eta: np.ndarray,
+    score: np.ndarray,
+    wp: dict,
+) -> np.ndarray:
+    """
+    Returns a mask of objects whose *score* exceeds the threshold of their (*pt*, *abs_eta*) bin in
+    the working point *wp*. It consists of the inner bin edges ``pt_edges`` (each pt bin includes
+    its upper edge) and ``abs_eta_sc_edges`` (each eta bin includes its lower edge), and a
+    ``thresholds`` table of shape (number of pt bins, number of eta bins). The lookup is a single
+    digitize and gather on flat arrays. Edges and thresholds are compared in the floating point
+    type of the respective input, as when comparing the inputs to python floats.
+    """
+    pt, abs_eta, score = map(np.asarray, (pt, abs_eta, score))
+    thresholds = np.asarray(wp["thresholds"], dtype=score.dtype)
+    pt_bin = np.digitize(pt, np.asarray(wp["pt_edges"], dtype=pt.dtype), right=True)
+    eta_bin = np.digitize(abs_eta, np.asarray(wp["abs_eta_sc_edges"], dtype=abs_eta.dtype))
+    return score > thresholds[pt_bin, eta_bin]
+
+
+def bits_dtype(n_bits: int) -> type:
+    """
+    Returns the smallest of uint8, uint16, uint32 and uint64 that holds *n_bits* bits.
+    """
+    dtype = next((t for t in [np.uint8, np.uint16, np.uint32, np.uint64] if n_bits <= 8 * np.dtype(t).itemsize), None)
+    if dtype is None:
+        raise ValueError(f"cannot pack {n_bits} bits into a single integer")
+    return dtype
+
+
+def pack_bits(masks: dict[str, Any], bits: dict[str, int]) -> np.ndarray:
+    """
+    Packs boolean per-event *masks* into a single unsigned integer array, with bit positions given
+    by *bits*, using the smallest of uint8, uint16, uint32 and uint64 that holds all bits. Missing
+    values in masks are treated as failing.
+    """
+    unknown = set(masks) - set(bits)
+    if unknown:
+        raise ValueError(f"no bits assigned to {', '.join(sorted(unknown))}")
+    dtype = bits_dtype(max(bits.values(), default=-1) + 1)
+
+    packed = None
+    for name, mask in masks.items():
+        mask = ak.to_numpy(ak.fill_none(mask, False)).astype(dtype)
+        packed = (mask << dtype(bits[name])) if packed is None else packed | (mask << dtype(bits[name]))
+    return packed
+
+
+def _mass_window_bounds(windows: dict[str, tuple], dtype: type) -> np.ndarray:
+    # lower and upper bounds of the mass windows on (mz1, mz2, mzz) with shape (n_windows, 3, 2)
+    # in the floating point type of the candidate masses, nan for open bounds
+    masses = ["mz1", "mz2", "mzz"]
+    bounds = np.full((len(windows), 3, 2), np.nan, dtype=dtype)
+    for w, (name, ranges) in enumerate(windows.items()):
+        for mass, lower, upper in ([ranges] if isinstance(ranges[0], str) else ranges):
+            if mass not in masses:
+                raise ValueError(f"unknown candidate mass '{mass}' of mass window '{name}'")
+            k = masses.index(mass)
+            bounds[w, k] = [np.nan if lower is None else lower, np.nan if upper is None else upper]
+    return bounds
+
+
+def _candidate_window_bits(zz_cands: ak.Array, bounds: np.ndarray) -> np.ndarray:
+    # OR of the bits of the windows with bounds as returned by _mass_window_bounds passed by the
+    # ZZ candidates of each event, as uint64
+    counts = ak.to_numpy(ak.num(zz_cands, axis=1))
+    masses = [ak.to_numpy(ak.flatten(zz_cands[z].mass, axis=1)) for z in ["z1", "z2", "zz"]]
+
+    # window bits per candidate
+    cand_bits = np.zeros(int(counts.sum()), dtype=np.uint64)
+    for w in range(len(bounds)):
+        passed = np.ones(len(cand_bits), dtype=bool)
+        for k, (lower, upper) in enumerate(bounds[w]):
+            if not np.isnan(lower):
+                passed &= masses[k] > lower
+            if not np.isnan(upper):
+                passed &= masses[k] < upper
+        cand_bits |= passed.astype(np.uint64) << np.uint64(w)
+
+    # OR over the candidates of each event
+    event_bits = np.zeros(len(counts), dtype=np.uint64)
+    has_cands = counts > 0
+    if np.any(has_cands):
+        starts = np.cumsum(counts) - counts
+        event_bits[has_cands] = np.bitwise_or.reduceat(cand_bits, starts[has_cands])
+    return event_bits
+
+
+def mass_window_bits(zz_cands: ak.Array, windows: dict[str, tuple]) -> np.ndarray:
+    """
+    Evaluates all mass *windows* on the ZZ candidates *zz_cands* in one pass and returns per event
+    an unsigned integer whose bit *i* is set when at least one candidate lies within the *i*-th
+    window. Windows are given by name as ``(mass, lower, upper)`` with the candidate mass ``"mz1"``,
+    ``"mz2"`` or ``"mzz"`` and exclusive bounds, where ``None`` denotes an open bound, or as a
+    sequence of such ranges that must all be passed by the same candidate.
+
+    As :py:func:`build_zz_candidates` only returns the best pairing per channel, windows over all
+    pairings are obtained by passing them to the builder instead.
+    """
+    dtype = bits_dtype(len(windows))
+    bounds = _mass_window_bounds(windows, ak.to_numpy(ak.flatten(zz_cands.zz.mass, axis=1)).dtype)
+    return _candidate_window_bits(zz_cands, bounds).astype(dtype)
+
+
+def mass_window_mask(packed: ak.Array | np.ndarray, windows: dict[str, tuple], name: str) -> np.ndarray:
+    """
+    Returns the per-event mask of the mass window *name* from the *packed* bits returned by
+    :py:func:`mass_window_bits` for the same *windows*, e.g. in categorizers or histogram
+    producers reading the ``mass_window_bits`` column.
+    """
+    packed = ak.to_numpy(packed)
+    return (packed & packed.dtype.type(1 << list(windows).index(name))) != 0
+
+
+def segment_prod(values: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    Multiplies flat *values* along their first axis over consecutive segments of lengths *counts*,
+    e.g. per-object scale factors of all events, with one row of shape ``values.shape[1:]`` per
+    segment. Products over empty segments are one.
+    """
+    counts = np.asarray(counts)
+    prods = np.ones((len(counts),) + values.shape[1:], dtype=values.dtype)
+    filled = counts > 0
+    if np.any(filled):
+        starts = np.cumsum(counts) - counts
+        prods[filled] = np.multiply.reduceat(values, starts[filled], axis=0)
+    return prods
+
+
+def _with_fields(array: ak.Array | None, tree: dict[str, Any], length: int) -> ak.Array:
+    # rebuilds the record *array* once with the fields in the nested *tree* of values added or
+    # replaced, recursing into (possibly jagged) sub-records, or creates it when *array* is None
+    new_fields = {}
+    for name, value in tree.items():
+        if isinstance(value, dict):
+            sub_array = array[name] if array is not None and name in array.fields else None
+            value = _with_fields(sub_array, value, length)
+        elif len(value) != length:
+            raise ValueError(f"length {len(value)} of column '{name}' does not match length {length}")
+        new_fields[name] = value
+
+    if array is None:
+        return ak.zip(new_fields, depth_limit=1)
+
+    # fast path for plain records, e.g. events, by swapping contents of the layout
+    layout = array.layout
+    if isinstance(layout, ak.contents.RecordArray) and not layout.is_tuple:
+        contents = dict(zip(layout.fields, layout.contents))
+        contents.update((name, ak.to_layout(value)) for name, value in new_fields.items())
+        layout = ak.contents.RecordArray(
+            list(contents.values()),
+            list(contents.keys()),
+            length=layout.length,
+            parameters=layout.parameters,
+        )
+        return ak.Array(layout, behavior=array.behavior)
+
+    # generic case, e.g. jagged collections
+    fields = {name: array[name] for name in array.fields}
+    fields.update(new_fields)
+    return ak.zip(
+        fields,
+        depth_limit=array.ndim,
+        with_name=ak.parameters(array).get("__record__"),
+        behavior=array.behavior,
+    )
+
+
+def set_ak_columns(events: ak.Array, columns: dict[str, Any]) -> ak.Array:
+    """
+    Returns *events* with all *columns* added or replaced, mapping routes (e.g. ``"m4l"`` or
+    ``"zz_candidate.mzz"``) to values, or to tuples of values and a type to cast them to, as in
+    columnflow's :py:func:`~columnflow.columnar_util.set_ak_column`:
+
+    .. code-block:: python
+
+        events = set_ak_columns(events, {
+            "mz1": (mz1, np.float32),
+            "zz_candidate.channel": channel,
+        })
+
+    Each call of :py:func:`~columnflow.columnar_util.set_ak_column` removes the column and rebuilds
+    the record of *events* with all its fields, whereas here the record and each affected
+    sub-record are rebuilt only once. Missing sub-records of nested routes are created.
+    """
+    tree = {}
+    for route, value in columns.items():
+        if isinstance(value, tuple):
+            value, value_type = value
+            value = ak.values_astype(value, value_type)
+        *parents, name = Route(route).fields
+        node = tree
+        for parent in parents:
+            node = node.setdefault(parent, {})
+            if not isinstance(node, dict):
+                raise ValueError(f"cannot set column '{route}' below column '{parent}' set at the same time")
+        if isinstance(node.get(name), dict):
+            raise ValueError(f"cannot set column '{route}' above columns set at the same time")
+        node[name] = value
+    return _with_fields(events, tree, len(events)) if tree else events
+
+
+class Cutflow(object):
+    """
+    Accumulates cumulative and N-1 yields of an ordered sequence of *steps*, weighted and unweighted
+    and per group (e.g. process), from per-event step bits packed with :py:func:`pack_bits` using
+    the bit assignment *bits*. Each call to :py:meth:`fill` is a single pass over the events: step
+    bits are reordered into step order, and the number of consecutively passed steps and the single
+    failed step (if any) are looked up in tables with 2^n entries, followed by one bincount each.
+
+    Several instances (e.g. one per entry of ``cfg.x.selector_step_groups``) can be filled from the
+    same packed column, see :py:func:`h4l.selection.stats.increment_cutflow_stats`.
+    """
+
+    def __init__(self, steps: Sequence[str], bits: dict[str, int]):
+        if len(steps) > 16:
+            raise ValueError(f"cutflows support up to 16 steps, got {len(steps)}")
+        self.steps = list(steps)
+        self.bits = [bits[step] for step in self.steps]
+        n = len(self.steps)
+
+        # number of trailing ones, i.e., consecutively passed steps
+        values = np.arange(2**n)
+        self._n_passed = np.zeros(2**n, dtype=np.int64)
+        for i in range(n):
+            self._n_passed += np.all([(values >> j) & 1 for j in range(i + 1)], axis=0)
+
+        # index of the only failed step, n when all steps passed, and -1 when more than one failed
+        failed = ~values & (2**n - 1)
+        self._single_failure = np.full(2**n, -1, dtype=np.int64)
+        self._single_failure[2**n - 1] = n
+        for i in range(n):
+            self._single_failure[failed == (1 << i)] = i
+
+        # group -> arrays of cumulative yields (all events and after each step) and n-1 yields
+        self.yields = {}
+
+    def _order(self, packed: np.ndarray) -> np.ndarray:
+        ordered = np.zeros(len(packed), dtype=np.int64)
+        packed = packed.astype(np.int64)
+        for i, bit in enumerate(self.bits):
+            ordered |= ((packed >> bit) & 1) << i
+        return ordered
+
+    def fill(self, packed: np.ndarray, weights: np.ndarray | None = None, groups: np.ndarray | None = None) -> None:
+        """
+        Adds the yields of events with *packed* step bits, optional *weights* and *groups*.
+        """
+        packed = np.asarray(packed)
+        n = len(self.steps)
+        ordered = self._order(packed)
+        n_passed = self._n_passed[ordered]
+        single_failure = self._single_failure[ordered]
+
+        # combine group and bin indices to fill all groups with a single bincount
+        if groups is None:
+            group_values, group_idx = np.array([None], dtype=object), np.zeros(len(packed), dtype=np.int64)
+        else:
+            group_values, group_idx = np.unique(np.asarray(groups), return_inverse=True)
+        n_groups = len(group_values)
+
+        def count(idx, width, w):
+            return np.bincount(idx, weights=w, minlength=n_groups * width).reshape(n_groups, width)
+
+        # events with all steps passed contribute to all n-1 yields, stored in the extra last bin
+        valid = single_failure >= 0
+        nm1_idx = group_idx[valid] * (n + 1) + single_failure[valid]
+        cum_idx = group_idx * (n + 1) + n_passed
+
+        for weighted, w in [(False, None), (True, weights)]:
+            if weighted and w is None:
+                continue
+            passed = count(cum_idx, n + 1, w)
+            # cumulative yields are the number of events passing at least i steps
+            cumulative = np.cumsum(passed[:, ::-1], axis=1)[:, ::-1]
+            nm1 = count(nm1_idx, n + 1, None if w is None else np.asarray(w)[valid])
+            n_minus_1 = nm1[:, :n] + nm1[:, n:]
+            key = "weighted" if weighted else "unweighted"
+            for group, cum, nm in zip(group_values, cumulative, n_minus_1):
+                entry = self.yields.setdefault(group, {})
+                if key in entry:
+                    entry[key]["cumulative"] += cum
+                    entry[key]["n_minus_1"] += nm
+                else:
+                    entry[key] = {"cumulative": cum.astype(np.float64), "n_minus_1": nm.astype(np.float64)}
+
+    def table(self, group: Any = None, weighted: bool = False) -> dict[str, dict[str, float]]:
+        """
+        Returns the cumulative and N-1 yields per step for a *group*, summed over all groups if
+        *None*. The cumulative yield of the first entry, ``"all"``, contains all events.
+        """
+        key = "weighted" if weighted else "unweighted"
+        entries = [e[key] for g, e in self.yields.items() if key in e and (group is None or g == group)]
+        cumulative = sum(e["cumulative"] for e in entries)
+        n_minus_1 = sum(e["n_minus_1"] for e in entries)
+        if not entries:
+            cumulative, n_minus_1 = np.zeros(len(self.steps) + 1), np.zeros(len(self.steps))
+        return {
+            "cumulative": dict(zip(["all"] + self.steps, cumulative.tolist())),
+            "n_minus_1": dict(zip(self.steps, n_minus_1.tolist())),
+        }
+
+
+def _masked_sorted_kernel(counts, mask, values, ascending, top_k, out_idx, out_counts):
+    # per event, inserts the local indices of objects passing mask into a buffer of at most top_k
+    # entries kept sorted by values (stable, i.e., ties keep their original order), returns the
+    # total number of stored indices
+    n_out = 0
+    offset = 0
+    for i in range(len(counts)):
+        start = n_out
+        n = 0
+        for j in range(counts[i]):
+            if not mask[offset + j]:
+                continue
+            v = values[offset + j]
+            # skip objects that do not enter a full buffer
+            if n == top_k:
+                last = values[offset + out_idx[start + n - 1]]
+                if not (v < last if ascending else v > last):
+                    continue
+                n -= 1
+            # shift worse objects back and insert
+            k = start + n
+            while k > start:
+                prev = values[offset + out_idx[k - 1]]
+                if not (v < prev if ascending else v > prev):
+                    break
+                out_idx[k] = out_idx[k - 1]
+                k -= 1
+            out_idx[k] = j
+            n += 1
+        out_counts[i] = n
+        n_out += n
+        offset += counts[i]
+    return n_out
+
+
+_masked_sorted_kernel = _jit(_masked_sorted_kernel)
+
+
+def masked_sorted_indices(
+    mask: ak.Array,
+    sort_var: ak.Array,
+    ascending: bool = False,
+    top_k: int | None = None,
+) -> ak.Array:
+    """
+    Returns per event the indices of objects passing *mask*, sorted by *sort_var* (in descending
+    order unless *ascending*) and, if *top_k* is given, limited to the leading *top_k* objects.
+    Objects are masked first and only survivors are inserted into a per-event buffer of at most
+    *top_k* entries, instead of sorting all objects and masking afterwards. Ties keep their
+    original order, as with a stable ``ak.argsort``.
+    """
+    if top_k is not None and top_k < 1:
+        raise ValueError(f"top_k must be positive, got {top_k}")
+
+    counts = ak.to_numpy(ak.num(sort_var, axis=1))
+    flat_mask = ak.to_numpy(ak.flatten(ak.fill_none(mask, False), axis=1)).astype(bool)
+    values = ak.to_numpy(ak.flatten(sort_var, axis=1))
+
+    out_idx = np.empty(int(flat_mask.sum()), dtype=np.int64)
+    out_counts = np.empty(len(counts), dtype=np.int64)
+    n_out = _masked_sorted_kernel(
+        counts,
+        flat_mask,
+        values,
+        ascending,
+        len(values) if top_k is None else top_k,
+        out_idx,
+        out_counts,
+    )
+
+    return ak.unflatten(out_idx[:n_out], out_counts)
+
+
+def cache_dir_from_env(env_var: str) -> str:
+    """
+    Returns the cache directory given by the environment variable *env_var*, or an empty string,
+    disabling the cache, when it is not set.
+    """
+    cache_dir = os.getenv(env_var)
+    return os.path.abspath(os.path.expandvars(os.path.expanduser(cache_dir))) if cache_dir else ""
+
+
+@contextmanager
+def atomic_open(path: str, mode: str = "wb"):
+    """
+    Context manager opening a temporary file next to *path* with *mode*, which replaces *path* on
+    success, so that concurrent processes never read partially written files.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
 def call_once_on_config(func=None, *, include_hash=False):
@@ -119,3 +1273,137 @@ def IF_NANO_V9(self, func: ArrayFunction) -> Any | set[Any]:
 @deferred_column
 def IF_NANO_V10(self, func: ArrayFunction) -> Any | set[Any]:
     return self.get() if func.config_inst.campaign.x.version >= 10 else None
+
+
+class ArrayFunctionProfiler(object):
+    """
+    Records the wall time, CPU time, peak traced memory and number of processed events of calls to
+    task array functions (calibrators, selectors, producers and categorizers). Nested calls, e.g.
+    made through ``self[electron_selection]`` inside ``default``, are recorded under their call path
+    (``default/electron_selection``), and their measures are included in those of their callers.
+
+    Records are grouped per task branch and written as json files to *output_dir* after each
+    outermost call, next to a text file containing the summary table. Hooked into all task array
+    functions by :py:func:`h4l.columnflow_patches.patch_array_function_profiling`.
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        # report path -> (meta data, call path -> stats)
+        self.reports = {}
+        # stack of [call path, start wall time, start cpu time, start memory, peak memory so far]
+        self._stack = []
+        # report of the current outermost call
+        self._report_path = None
+
+    @contextmanager
+    def record(self, func: ArrayFunction, events: Any = None):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        # store the peak of the caller before resetting it for this call
+        current, peak = tracemalloc.get_traced_memory()
+        if self._stack:
+            self._stack[-1][4] = max(self._stack[-1][4], peak)
+        else:
+            self._report_path = self._open_report(func)
+        tracemalloc.reset_peak()
+
+        path = "/".join([entry[0] for entry in self._stack[-1:]] + [func.cls_name])
+        self._stack.append([path, time.perf_counter(), time.process_time(), current, current])
+        try:
+            yield
+        finally:
+            path, wall_start, cpu_start, mem_start, peak = self._stack.pop()
+            wall_time = time.perf_counter() - wall_start
+            cpu_time = time.process_time() - cpu_start
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            # propagate the peak to the caller
+            if self._stack:
+                self._stack[-1][4] = max(self._stack[-1][4], peak)
+
+            stats = self.reports[self._report_path][1].setdefault(path, {
+                "calls": 0, "events": 0, "wall_time": 0.0, "cpu_time": 0.0, "peak_bytes": 0,
+            })
+            stats["calls"] += 1
+            stats["events"] += len(events) if isinstance(events, ak.Array) else 0
+            stats["wall_time"] += wall_time
+            stats["cpu_time"] += cpu_time
+            stats["peak_bytes"] = max(stats["peak_bytes"], peak - mem_start)
+
+            if not self._stack:
+                self.write(self._report_path)
+
+    def _open_report(self, func: ArrayFunction) -> str:
+        # reports are identified by the task (and its branch) that created the outermost function
+        task = getattr(func, "task", None)
+        meta = {
+            "task": getattr(task, "task_family", None),
+            "dataset": getattr(task, "dataset", None),
+            "shift": getattr(task, "shift", None),
+            "branch": getattr(task, "branch", None),
+            "pid": os.getpid(),
+        }
+        if task is None:
+            report_path = os.path.join(self.output_dir, f"pid_{meta['pid']}.json")
+        else:
+            parts = [meta["task"], str(meta["dataset"])]
+            if meta["shift"] not in (None, "nominal"):
+                parts.append(meta["shift"])
+            parts.append(f"branch_{meta['branch']}.json")
+            report_path = os.path.join(self.output_dir, *parts)
+        self.reports.setdefault(report_path, (meta, {}))
+        return report_path
+
+    def write(self, report_path: str) -> None:
+        """
+        Writes the json report and the summary table of the report at *report_path*.
+        """
+        meta, stats = self.reports[report_path]
+        os.makedirs(os.path.dirname(report_path), exist_ok=True)
+        with open(report_path, "w") as f:
+            json.dump({**meta, "functions": stats}, f, indent=4)
+        with open(f"{os.path.splitext(report_path)[0]}.txt", "w") as f:
+            f.write(profile_table(stats) + "\n")
+
+    def log_summary(self) -> None:
+        for report_path, (meta, stats) in self.reports.items():
+            _logger.info(f"array function profile written to {report_path}\n{profile_table(stats)}")
+
+
+def profile_table(stats: dict[str, dict]) -> str:
+    """
+    Returns a table summarizing the profiling *stats* of array function calls, mapped to their call
+    paths, with the share of the wall time relative to the outermost calls.
+    """
+    total = sum(s["wall_time"] for path, s in stats.items() if "/" not in path) or 1.0
+    header = f"{'function':<60} {'calls':>7} {'events':>12} {'wall / s':>10} {'cpu / s':>10} " \
+        f"{'share':>7} {'events / s':>12} {'peak / MB':>10}"
+    lines = [header, "-" * len(header)]
+    for path, s in sorted(stats.items()):
+        depth = path.count("/")
+        name = "  " * depth + path.rsplit("/", 1)[-1]
+        rate = s["events"] / s["wall_time"] if s["wall_time"] else 0.0
+        lines.append(
+            f"{name:<60} {s['calls']:>7} {s['events']:>12} {s['wall_time']:>10.3f} {s['cpu_time']:>10.3f} "
+            f"{s['wall_time'] / total:>7.1%} {rate:>12.0f} {s['peak_bytes'] / 1024**2:>10.1f}",
+        )
+    return "\n".join(lines)
+
+
+def merge_profiles(report_paths: Iterable[str]) -> dict[str, dict[str, dict]]:
+    """
+    Merges the json reports at *report_paths*, written by :py:class:`ArrayFunctionProfiler`, per
+    dataset and returns a dictionary mapping dataset names to the merged stats, to be passed to
+    :py:func:`profile_table`.
+    """
+    merged = {}
+    for report_path in report_paths:
+        with open(report_path) as f:
+            report = json.load(f)
+        dataset_stats = merged.setdefault(str(report["dataset"]), {})
+        for path, s in report["functions"].items():
+            m = dataset_stats.setdefault(path, dict.fromkeys(s, 0))
+            for key, value in s.items():
+                m[key] = max(m[key], value) if key == "peak_bytes" else m[key] + value
+    return merged
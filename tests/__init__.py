@@ -15,4 +15,13 @@ sys.path.append(base)
 import h4l  # noqa
 
 # import all tests
-# ...
+from .test_util import *
+from .test_stats import *
+from .test_lumi import *
+from .test_lepton import *
+from .test_skim import *
+from .test_parallel import *
+from .test_lepton_weights import *
+from .test_corrections import *
+from .test_histogramming import *
+from .test_observables import *
@@ -0,0 +1,6 @@
+# coding: utf-8
+# flake8: noqa
+
+"""
+Benchmarks of h4l hot paths, not collected as tests.
+"""
@@ -0,0 +1,110 @@
+# coding: utf-8
+
+"""
+Benchmark of attaching several new columns at once with :py:func:`h4l.util.set_ak_columns` against
+sequential calls of columnflow's ``set_ak_column``, on NanoAOD-like records widened by additional
+flat fields (such as the many HLT paths of NanoAOD), with the columns written by the
+``four_lep_invariant_mass`` and ``lepton_weights`` producers plus nested and jagged ones. Run with
+
+.. code-block:: bash
+
+    python -m tests.benchmarks.column_setter --events 200000 --extra-fields 0 500 1500
+"""
+
+from __future__ import annotations
+
+import time
+import argparse
+
+import numpy as np
+import awkward as ak
+
+import tests  # noqa
+from tests.synthetic import generate_events
+from columnflow.columnar_util import set_ak_column
+from h4l.util import set_ak_columns
+
+
+def widen(events: ak.Array, n_fields: int) -> ak.Array:
+    """
+    Returns *events* with *n_fields* additional boolean fields.
+    """
+    rng = np.random.default_rng(2)
+    fields = {name: events[name] for name in events.fields}
+    fields.update({f"HLT_Path{i}": rng.random(len(events)) < 0.1 for i in range(n_fields)})
+    return ak.zip(fields, depth_limit=1)
+
+
+def new_columns(events: ak.Array) -> dict[str, tuple[ak.Array, type]]:
+    """
+    Returns the columns to attach, mapped to their values and types.
+    """
+    rng = np.random.default_rng(3)
+    n = len(events)
+    columns = {
+        name: (rng.uniform(50, 250, n), np.float32)
+        for name in ["m4l", "mz1", "mz2", "mzz", "pt4l", "y4l", "iso4l"]
+    }
+    columns.update({
+        f"{weight_name}{postfix}": (rng.uniform(0.9, 1.1, n), np.float32)
+        for weight_name in ["electron_weight", "muon_weight"]
+        for postfix in ["", "_up", "_down"]
+    })
+    # nested and jagged columns
+    columns["zz_candidate.channel"] = (rng.integers(-1, 3, n), np.int8)
+    columns["zz_candidate.mzz"] = (rng.uniform(50, 250, n), np.float32)
+    columns["Electron.sf"] = (events.Electron.pt * 0 + 1.01, np.float32)
+    return columns
+
+
+def set_sequentially(events: ak.Array, columns: dict[str, tuple[ak.Array, type]]) -> ak.Array:
+    """
+    Previous way of attaching columns, one ``set_ak_column`` call each.
+    """
+    for route, (value, value_type) in columns.items():
+        events = set_ak_column(events, route, value, value_type=value_type)
+    return events
+
+
+METHODS = {
+    "set_ak_column": set_sequentially,
+    "set_ak_columns": set_ak_columns,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--events", type=int, default=200000, help="number of events")
+    parser.add_argument("--extra-fields", type=int, nargs="+", default=[0, 500, 1500],
+        help="numbers of additional flat fields of the records")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timed calls, the fastest is kept")
+    args = parser.parse_args()
+
+    base_events = generate_events(args.events)
+
+    print(f"{'fields':>7} {'columns':>8} {'method':>15} {'time / ms':>10}")
+    for n_fields in args.extra_fields:
+        events = widen(base_events, n_fields)
+        columns = new_columns(events)
+
+        results = {}
+        for name, func in METHODS.items():
+            best = float("inf")
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                results[name] = func(events, columns)
+                best = min(best, time.perf_counter() - t0)
+            print(f"{len(events.fields):>7} {len(columns):>8} {name:>15} {best * 1000:>10.1f}")
+
+        # compare the new columns
+        for route in columns:
+            fields = tuple(route.split("."))
+            expected, actual = results["set_ak_column"][fields], results["set_ak_columns"][fields]
+            if str(expected.type) != str(actual.type) or not ak.all(ak.ravel(expected == actual)):
+                raise RuntimeError(f"column '{route}' differs between set_ak_column and set_ak_columns")
+        if set(results["set_ak_column"].fields) != set(results["set_ak_columns"].fields):
+            raise RuntimeError("fields differ between set_ak_column and set_ak_columns")
+
+
+if __name__ == "__main__":
+    main()
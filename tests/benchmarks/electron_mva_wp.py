@@ -0,0 +1,99 @@
+# coding: utf-8
+
+"""
+Microbenchmark of the table-driven electron MVA working point lookup in
+:py:func:`h4l.util.binned_threshold_mask` against the nested boolean expressions it replaces in
+:py:func:`h4l.selection.lepton.electron_selection`. Run with
+
+.. code-block:: bash
+
+    python -m tests.benchmarks.electron_mva_wp --events 1000000
+"""
+
+from __future__ import annotations
+
+import time
+import argparse
+
+import awkward as ak
+
+import tests  # noqa
+from tests.synthetic import generate_events
+from h4l.util import binned_threshold_mask
+
+
+# UL working point (miniAOD branch Run2_CutBased_UL), as in the analysis config
+UL_WP = {
+    "pt_edges": [10.0],
+    "abs_eta_sc_edges": [0.8, 1.479],
+    "thresholds": [
+        [0.9128577458, 0.9056792368, 0.9439440575],
+        [0.1559788054, 0.0273863727, -0.5532483665],
+    ],
+}
+
+
+def expression(pt: ak.Array, fSCeta: ak.Array, BDT: ak.Array) -> ak.Array:
+    """
+    Previous evaluation of the UL working point.
+    """
+    return (
+        (
+            (pt <= 10.) & (
+                ((fSCeta < 0.8) & (BDT > 0.9128577458)) |
+                ((fSCeta >= 0.8) & (fSCeta < 1.479) & (BDT > 0.9056792368)) |
+                ((fSCeta >= 1.479) & (BDT > 0.9439440575))
+            )
+        ) |
+        (
+            (pt > 10.) & (
+                ((fSCeta < 0.8) & (BDT > 0.1559788054)) |
+                ((fSCeta >= 0.8) & (fSCeta < 1.479) & (BDT > 0.0273863727)) |
+                ((fSCeta >= 1.479) & (BDT > -0.5532483665))
+            )
+        )
+    )
+
+
+def table(pt: ak.Array, fSCeta: ak.Array, BDT: ak.Array) -> ak.Array:
+    """
+    Table-driven evaluation of the UL working point, including flattening and unflattening.
+    """
+    return ak.unflatten(
+        binned_threshold_mask(
+            ak.to_numpy(ak.flatten(pt, axis=1)),
+            ak.to_numpy(ak.flatten(fSCeta, axis=1)),
+            ak.to_numpy(ak.flatten(BDT, axis=1)),
+            UL_WP,
+        ),
+        ak.num(pt, axis=1),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--events", type=int, default=1000000, help="number of events")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timed calls, the fastest is kept")
+    args = parser.parse_args()
+
+    electrons = generate_events(args.events, extra_leptons_mean=2.0).Electron
+    inputs = (electrons.pt, abs(electrons.eta + electrons.deltaEtaSC), electrons.mvaFall17V2Iso)
+    n_electrons = len(ak.flatten(electrons.pt))
+
+    results = {}
+    print(f"{'method':>12} {'time / ms':>10} {'electrons / s':>14}")
+    for name, func in [("expression", expression), ("table", table)]:
+        best = float("inf")
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            results[name] = func(*inputs)
+            best = min(best, time.perf_counter() - t0)
+        print(f"{name:>12} {best * 1000:>10.1f} {n_electrons / best:>14.0f}")
+
+    if not ak.all(results["expression"] == results["table"]):
+        raise RuntimeError("table lookup differs from the expression")
+    print(f"identical masks for {n_electrons} electrons")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+# coding: utf-8
+
+"""
+Throughput and memory benchmarks of the selection, production and calibration hot paths on
+synthetic events (see :py:mod:`tests.synthetic`), compared against a stored baseline. Run with
+
+.. code-block:: bash
+
+    python -m tests.benchmarks.hot_paths --chunk-sizes 10000 100000 --output results.json
+
+The command exits with a non-zero code when the throughput of any benchmark drops, or its peak RSS
+increases, by more than ``--threshold`` relative to the baseline. A new baseline is stored with
+``--update-baseline``.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import platform
+from typing import Callable
+
+import numpy as np
+import awkward as ak
+from coffea.nanoevents.methods import candidate
+
+import tests  # noqa
+from tests.synthetic import generate_events
+
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_BASELINE = os.path.join(this_dir, "hot_paths_baseline.json")
+
+# lepton multiplicity mixes, passed as settings to the synthetic event generator
+MIXES = {
+    # mostly four-lepton signal events
+    "signal": {"h_fraction": 0.9, "zz_fraction": 0.1, "z_fraction": 0.0, "extra_leptons_mean": 0.2},
+    # default composition of signal, ZZ, Z and lepton-free events
+    "inclusive": {},
+    # many additional soft leptons stressing the combinatorics
+    "busy": {"extra_leptons_mean": 3.0},
+}
+
+
+#
+# benchmark definitions, each returning a function that prepares the inputs from events outside of
+# the measurement and a function that processes the prepared inputs
+#
+
+def _array_function(cls: type, config_inst, dataset_inst) -> Callable:
+    inst = cls(inst_dict={
+        "analysis_inst": config_inst.analysis,
+        "config_inst": config_inst,
+        "dataset_inst": dataset_inst,
+    })
+    return lambda events: inst(events)
+
+
+def _charged_leptons(events: ak.Array) -> tuple[ak.Array, ...]:
+    def candidates(coll):
+        coll = ak.zip(
+            {f: coll[f] for f in ["pt", "eta", "phi", "mass", "charge"]},
+            with_name="PtEtaPhiMCandidate",
+            behavior=candidate.behavior,
+        )
+        return coll[coll.charge > 0], coll[coll.charge < 0]
+    return (*candidates(events.Muon), *candidates(events.Electron))
+
+
+def bench_electron_selection(config_inst, dataset_inst):
+    from h4l.selection.lepton import electron_selection
+    return (lambda events: events), _array_function(electron_selection, config_inst, dataset_inst)
+
+
+def bench_muon_selection(config_inst, dataset_inst):
+    from h4l.selection.lepton import muon_selection
+    return (lambda events: events), _array_function(muon_selection, config_inst, dataset_inst)
+
+
+def bench_trigger_selection(config_inst, dataset_inst):
+    from h4l.selection.trigger import trigger_selection
+    return (lambda events: events), _array_function(trigger_selection, config_inst, dataset_inst)
+
+
+def bench_build_2e2mu(config_inst, dataset_inst):
+    from h4l.util import build_2e2mu
+    return _charged_leptons, (lambda leptons: build_2e2mu(*leptons))
+
+
+def bench_build_4sf(config_inst, dataset_inst):
+    from h4l.util import build_4sf
+
+    def run(leptons):
+        mu_plus, mu_minus, e_plus, e_minus = leptons
+        return build_4sf(mu_plus, mu_minus), build_4sf(e_plus, e_minus)
+
+    return _charged_leptons, run
+
+
+def bench_four_lep_invariant_mass(config_inst, dataset_inst):
+    from columnflow.columnar_util import EMPTY_FLOAT, set_ak_column
+    from h4l.production.invariant_mass import four_lep_invariant_mass
+    from h4l.util import build_zz_candidates
+
+    def prepare(events):
+        # add the chosen candidate that is otherwise stored by the default selector
+        chosen = ak.firsts(build_zz_candidates(events.Electron, events.Muon))
+        for name in ["z1", "z2", "zz"]:
+            events = set_ak_column(
+                events,
+                f"zz_candidate.m{name}",
+                ak.fill_none(chosen[name].mass, EMPTY_FLOAT),
+                value_type=np.float32,
+            )
+        return events
+
+    return prepare, _array_function(four_lep_invariant_mass, config_inst, dataset_inst)
+
+
+def bench_jet_lepton_cleaner(config_inst, dataset_inst):
+    from h4l.calibration.jets import jet_lepton_cleaner
+    return (lambda events: events), _array_function(jet_lepton_cleaner, config_inst, dataset_inst)
+
+
+BENCHMARKS = {
+    "electron_selection": bench_electron_selection,
+    "muon_selection": bench_muon_selection,
+    "trigger_selection": bench_trigger_selection,
+    "build_2e2mu": bench_build_2e2mu,
+    "build_4sf": bench_build_4sf,
+    "four_lep_invariant_mass": bench_four_lep_invariant_mass,
+    "jet_lepton_cleaner": bench_jet_lepton_cleaner,
+}
+
+
+#
+# measurement
+#
+
+def _reset_peak_rss() -> bool:
+    # writing "5" to clear_refs resets the peak resident set size (linux only)
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss() -> int:
+    """
+    Returns the peak resident set size of the process in bytes.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is given in kilobytes on linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def measure(func: Callable, inputs, repeat: int = 3) -> tuple[float, int]:
+    """
+    Calls *func* with *inputs* *repeat* times and returns the fastest wall time in seconds and the
+    peak RSS in bytes. When the peak cannot be reset, the process-wide peak is returned instead.
+    """
+    best = float("inf")
+    _reset_peak_rss()
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(inputs)
+        best = min(best, time.perf_counter() - t0)
+    return best, _peak_rss()
+
+
+def run(
+    benchmarks: list[str],
+    chunk_sizes: list[int],
+    mixes: list[str],
+    config_inst,
+    dataset_inst,
+    repeat: int = 3,
+    seed: int = 0,
+) -> list[dict]:
+    """
+    Runs all combinations of *benchmarks*, *chunk_sizes* and *mixes* and returns a list of results.
+    """
+    funcs = {name: BENCHMARKS[name](config_inst, dataset_inst) for name in benchmarks}
+    results = []
+    for mix in mixes:
+        for chunk_size in chunk_sizes:
+            events = generate_events(chunk_size, seed=seed, **MIXES[mix])
+            n_leptons = ak.to_numpy(ak.num(events.Electron) + ak.num(events.Muon))
+            for name, (prepare, func) in funcs.items():
+                inputs = prepare(events)
+                # untimed call to trigger lazy initialization and jit compilation
+                func(inputs)
+                duration, peak_rss = measure(func, inputs, repeat=repeat)
+                result = {
+                    "benchmark": name,
+                    "mix": mix,
+                    "chunk_size": chunk_size,
+                    "mean_leptons": float(n_leptons.mean()),
+                    "seconds": duration,
+                    "events_per_second": chunk_size / duration,
+                    "peak_rss_mb": peak_rss / 1024**2,
+                }
+                print(
+                    f"{name:>24} {mix:>10} {chunk_size:>10} {result['events_per_second']:>14.0f} "
+                    f"{result['peak_rss_mb']:>12.1f}",
+                )
+                results.append(result)
+                del inputs
+    return results
+
+
+def _key(result: dict) -> tuple:
+    return result["benchmark"], result["mix"], result["chunk_size"]
+
+
+def compare(results: list[dict], baseline: list[dict], threshold: float) -> list[str]:
+    """
+    Compares *results* to *baseline* results and returns a description of each regression, i.e.,
+    throughput decreases and peak RSS increases above a relative *threshold*.
+    """
+    reference = {_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        ref = reference.get(_key(result))
+        if ref is None:
+            continue
+        label = "{} ({} mix, {} events)".format(*_key(result))
+        throughput = result["events_per_second"] / ref["events_per_second"] - 1
+        if throughput < -threshold:
+            regressions.append(
+                f"{label}: throughput {result['events_per_second']:.0f} events/s is {-throughput:.0%} below "
+                f"baseline {ref['events_per_second']:.0f} events/s",
+            )
+        rss = result["peak_rss_mb"] / ref["peak_rss_mb"] - 1
+        if rss > threshold:
+            regressions.append(
+                f"{label}: peak RSS {result['peak_rss_mb']:.1f} MB is {rss:.0%} above baseline "
+                f"{ref['peak_rss_mb']:.1f} MB",
+            )
+    return regressions
+
+
+def load_config(config_name: str, dataset_name: str):
+    """
+    Returns the config and dataset objects used to set up array functions.
+    """
+    from h4l.config.analysis_h4l import analysis_h4l
+    config_inst = analysis_h4l.get_config(config_name)
+    return config_inst, config_inst.get_dataset(dataset_name)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS),
+        help="benchmarks to run")
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[10000, 100000], help="events per chunk")
+    parser.add_argument("--mixes", nargs="+", choices=list(MIXES), default=list(MIXES),
+        help="lepton multiplicity mixes")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed calls, the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the event generation")
+    parser.add_argument("--config", default="run2_2017_nano_v9", help="name of the analysis config")
+    parser.add_argument("--dataset", default="h_ggf_4l_powheg", help="name of the dataset")
+    parser.add_argument("--output", help="json file to save results to")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="json file with baseline results")
+    parser.add_argument("--threshold", type=float, default=0.2,
+        help="relative regression in throughput or peak RSS that leads to a failure")
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as the new baseline")
+    args = parser.parse_args()
+
+    config_inst, dataset_inst = load_config(args.config, args.dataset)
+
+    print(f"{'benchmark':>24} {'mix':>10} {'events':>10} {'events / s':>14} {'peak RSS / MB':>12}")
+    results = run(
+        args.benchmarks,
+        args.chunk_sizes,
+        args.mixes,
+        config_inst,
+        dataset_inst,
+        repeat=args.repeat,
+        seed=args.seed,
+    )
+    output = {"machine": platform.node(), "python": platform.python_version(), "results": results}
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=4)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(output, f, indent=4)
+        print(f"stored baseline in {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline found at {args.baseline}, skipping comparison")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline["results"], args.threshold)
+    for regression in regressions:
+        print(f"regression: {regression}", file=sys.stderr)
+    if regressions:
+        return 1
+    print(f"no regressions above {args.threshold:.0%} compared to {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
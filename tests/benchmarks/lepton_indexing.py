@@ -0,0 +1,82 @@
+# coding: utf-8
+
+"""
+Microbenchmark of the select-then-sort lepton indexing in :py:func:`h4l.util.masked_sorted_indices`,
+with and without top-k truncation, against sorting all leptons and masking afterwards, on events
+with high lepton multiplicities. Run with
+
+.. code-block:: bash
+
+    python -m tests.benchmarks.lepton_indexing --events 500000 --extra-leptons 2 6 12
+"""
+
+from __future__ import annotations
+
+import time
+import argparse
+
+import awkward as ak
+
+import tests  # noqa
+from tests.synthetic import generate_events
+from h4l.util import masked_sorted_indices
+
+
+def sort_then_mask(mask: ak.Array, sort_var: ak.Array) -> ak.Array:
+    """
+    Previous indexing, sorting all objects and masking afterwards.
+    """
+    sorted_idx = ak.argsort(sort_var, axis=1, ascending=False)
+    return sorted_idx[mask[sorted_idx]]
+
+
+def electron_mask(electrons: ak.Array) -> ak.Array:
+    # kinematic and impact parameter requirements of the electron selection
+    return (
+        (electrons.pt > 7) &
+        (abs(electrons.eta) < 2.5) &
+        (electrons.dxy < 0.5) &
+        (electrons.dz < 1.0) &
+        (abs(electrons.sip3d) < 4)
+    )
+
+
+METHODS = {
+    "sort_then_mask": sort_then_mask,
+    "select_then_sort": masked_sorted_indices,
+    "top_4": lambda mask, sort_var: masked_sorted_indices(mask, sort_var, top_k=4),
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--events", type=int, default=500000, help="number of events")
+    parser.add_argument("--extra-leptons", type=float, nargs="+", default=[2.0, 6.0, 12.0],
+        help="mean numbers of additional non-prompt leptons per event")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timed calls, the fastest is kept")
+    args = parser.parse_args()
+
+    print(f"{'leptons':>8} {'selected':>9} {'method':>17} {'time / ms':>10} {'events / s':>12}")
+    for extra_leptons in args.extra_leptons:
+        electrons = generate_events(args.events, extra_leptons_mean=extra_leptons, extra_muon_fraction=0.0).Electron
+        mask = electron_mask(electrons)
+        n_leptons = ak.mean(ak.num(electrons.pt, axis=1))
+        n_selected = ak.mean(ak.sum(mask, axis=1))
+
+        results = {}
+        for name, func in METHODS.items():
+            best = float("inf")
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                results[name] = func(mask, electrons.pt)
+                best = min(best, time.perf_counter() - t0)
+            print(f"{n_leptons:>8.2f} {n_selected:>9.2f} {name:>17} {best * 1000:>10.1f} {args.events / best:>12.0f}")
+
+        if results["sort_then_mask"].tolist() != results["select_then_sort"].tolist():
+            raise RuntimeError("select-then-sort indices differ from sort-then-mask indices")
+        if results["sort_then_mask"][:, :4].tolist() != results["top_4"].tolist():
+            raise RuntimeError("top-k indices differ from the leading sort-then-mask indices")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# coding: utf-8
+
+"""
+Benchmark of the interval-indexed golden JSON lookup in :py:mod:`h4l.selection.lumi` against the
+sparse run/luminosity block matrix of columnflow's ``json_filter``, reporting the time to build
+each lookup and to evaluate it on events. Run with
+
+.. code-block:: bash
+
+    python -m tests.benchmarks.lumi_mask --events 1000000
+
+or on a golden JSON file with ``--golden /path/to/Cert_..._GoldenJSON.txt``.
+"""
+
+from __future__ import annotations
+
+import json
+import time
+import argparse
+
+import numpy as np
+import scipy.sparse
+
+import tests  # noqa
+from h4l.selection.lumi import compile_lumi_mask, lumi_mask_lookup
+
+
+def synthetic_golden(n_runs: int, seed: int = 0) -> dict[str, list[list[int]]]:
+    """
+    Returns a golden JSON with *n_runs* runs, each with a few certified ranges of up to about
+    2000 luminosity blocks.
+    """
+    rng = np.random.default_rng(seed)
+    golden = {}
+    for run in np.sort(rng.choice(np.arange(297000, 307000), n_runs, replace=False)):
+        edges = np.sort(rng.choice(np.arange(1, rng.integers(50, 2000)), 2 * rng.integers(1, 6), replace=False))
+        golden[str(run)] = edges.reshape(-1, 2).tolist()
+    return golden
+
+
+def build_sparse(golden: dict) -> scipy.sparse.lil_matrix:
+    """
+    Previous lookup of ``json_filter``, as a sparse boolean matrix indexed by run and block.
+    """
+    max_ls = max(ls for ls_ranges in golden.values() for ls_range in ls_ranges for ls in ls_range)
+    max_run = max(map(int, golden.keys()))
+    lookup = scipy.sparse.lil_matrix((max_run + 1, max_ls + 1), dtype=bool)
+    for run, ls_ranges in golden.items():
+        for first, last in ls_ranges:
+            for ls in range(first, last + 1):
+                lookup[int(run), ls] = True
+    return lookup
+
+
+def lookup_sparse(lookup: scipy.sparse.lil_matrix, run: np.ndarray, ls: np.ndarray) -> np.ndarray:
+    out_of_bounds = (run >= lookup.shape[0]) | (ls >= lookup.shape[1])
+    result = np.squeeze(np.array(lookup[np.where(out_of_bounds, 0, run), np.where(out_of_bounds, 0, ls)].todense()))
+    return np.where(out_of_bounds, False, result)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--golden", help="golden JSON file, a synthetic one is used when not given")
+    parser.add_argument("--runs", type=int, default=500, help="number of runs of the synthetic golden JSON")
+    parser.add_argument("--events", type=int, default=1000000, help="number of events")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed calls, the fastest is kept")
+    args = parser.parse_args()
+
+    if args.golden:
+        with open(args.golden) as f:
+            golden = json.load(f)
+    else:
+        golden = synthetic_golden(args.runs)
+
+    # events in the runs of the JSON (and a few others), with blocks partly outside certified ranges
+    rng = np.random.default_rng(1)
+    runs = np.array(sorted(map(int, golden)))
+    run = np.where(rng.random(args.events) < 0.98, rng.choice(runs, args.events), rng.integers(1, 400000, args.events))
+    ls = rng.integers(1, 2500, args.events)
+
+    timings = {}
+    for name, build, lookup in [
+        ("sparse", build_sparse, lambda table: lookup_sparse(table, run, ls)),
+        ("intervals", compile_lumi_mask, lambda table: lumi_mask_lookup(*table, run, ls)),
+    ]:
+        t0 = time.perf_counter()
+        table = build(golden)
+        build_time = time.perf_counter() - t0
+        best = float("inf")
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            timings[name] = lookup(table)
+            best = min(best, time.perf_counter() - t0)
+        print(f"{name:>10}: build {build_time * 1000:>9.1f} ms, lookup {best * 1000:>8.1f} ms "
+            f"({args.events / best:.0f} events/s)")
+
+    if not np.array_equal(timings["sparse"], timings["intervals"]):
+        raise RuntimeError("interval lookup differs from the sparse lookup")
+    print(f"identical decisions for {args.events} events, {timings['intervals'].mean():.1%} certified")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,499 @@
+# coding: utf-8
+
+"""
+Seeded generator of synthetic, NanoAOD-like events as a local stand-in for CMS datasets. Events
+contain Electron, Muon, Jet, HLT, MET and PV fields with the names and types read by the h4l
+calibrators, selectors and producers. Leptons stem from H -> ZZ -> 4l, continuum ZZ -> 4l and
+Z -> 2l decays, complemented by soft non-prompt leptons, with configurable fractions, resonance
+masses and multiplicities.
+
+Events are generated and written in independent chunks (one file each) whose seeds derive from a
+single seed, so large samples of tens of millions of events can be produced with bounded memory and
+in parallel. Example:
+
+.. code-block:: bash
+
+    python -m tests.synthetic /tmp/h4l_synthetic --events 10000000 --chunk-size 500000 --workers 8
+"""
+
+from __future__ import annotations
+
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import awkward as ak
+
+
+# default generator settings, all of which can be overwritten through keyword arguments
+DEFAULT_CONFIG = {
+    # fractions of event types, the remainder has no prompt leptons at all
+    "h_fraction": 0.2,
+    "zz_fraction": 0.3,
+    "z_fraction": 0.3,
+    # resonance masses and widths in GeV
+    "m_h": 125.0,
+    "width_h": 0.1,
+    "m_z": 91.1876,
+    "width_z": 2.4952,
+    # mean number of additional soft, non-prompt leptons per event
+    "extra_leptons_mean": 0.5,
+    # fraction of non-prompt leptons that are muons
+    "extra_muon_fraction": 0.5,
+    # probability of a non-prompt lepton to carry a positive charge
+    "extra_positive_fraction": 0.5,
+    # mean number of jets per event
+    "jets_mean": 3.0,
+    # whether to generate recorded data (no generator weights)
+    "is_data": False,
+    # run number assigned to all events
+    "run": 297050,
+}
+
+# triggers that are emulated in the HLT record, mapped to the number of electrons and muons above
+# a pt threshold they require, mirroring the trigger matrix in h4l.config.config_das
+DEFAULT_TRIGGERS = {
+    "Ele23_Ele12_CaloIdL_TrackIdL_IsoVL": (2, 0, 12.0),
+    "DoubleEle25_CaloIdL_MW": (2, 0, 25.0),
+    "Mu17_TrkIsoVVL_Mu8_TrkIsoVVL_DZ_Mass3p8": (0, 2, 8.0),
+    "Mu23_TrkIsoVVL_Ele12_CaloIdL_TrackIdL_IsoVL": (1, 1, 12.0),
+    "Mu8_TrkIsoVVL_Ele23_CaloIdL_TrackIdL_IsoVL_DZ": (1, 1, 8.0),
+    "Mu12_TrkIsoVVL_Ele23_CaloIdL_TrackIdL_IsoVL_DZ": (1, 1, 12.0),
+    "DiMu9_Ele9_CaloIdL_TrackIdL_DZ": (1, 2, 9.0),
+    "Ele32_WPTight_Gsf": (1, 0, 32.0),
+    "IsoMu24": (0, 1, 24.0),
+}
+
+ELECTRON_MASS = 0.000511
+MUON_MASS = 0.10566
+
+
+def breit_wigner(rng: np.random.Generator, mass: float, width: float, low, high) -> np.ndarray:
+    """
+    Samples from a Breit-Wigner (Cauchy) distribution truncated to [*low*, *high*], where the
+    bounds can be arrays.
+    """
+    low, high = np.broadcast_arrays(np.asarray(low, dtype=float), np.asarray(high, dtype=float))
+    a = np.arctan(2 * (low - mass) / width)
+    b = np.arctan(2 * (high - mass) / width)
+    return mass + 0.5 * width * np.tan(rng.uniform(a, b))
+
+
+def boost(p4: np.ndarray, beta: np.ndarray) -> np.ndarray:
+    """
+    Boosts four-vectors *p4* of shape (n, 4) in (E, px, py, pz) order by velocities *beta* of
+    shape (n, 3).
+    """
+    b2 = np.sum(beta**2, axis=1)
+    gamma = 1 / np.sqrt(1 - b2)
+    bp = np.sum(beta * p4[:, 1:], axis=1)
+    gamma2 = np.where(b2 > 0, (gamma - 1) / np.where(b2 > 0, b2, 1), 0)
+    energy = gamma * (p4[:, 0] + bp)
+    p = p4[:, 1:] + (gamma2 * bp + gamma * p4[:, 0])[:, None] * beta
+    return np.concatenate([energy[:, None], p], axis=1)
+
+
+def two_body_decay(
+    rng: np.random.Generator,
+    parent: np.ndarray,
+    m_parent: np.ndarray,
+    m1: np.ndarray,
+    m2: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Isotropic two-body decays of *parent* four-vectors of shape (n, 4) with masses *m_parent* into
+    daughters with masses *m1* and *m2*, returned in the lab frame.
+    """
+    n = len(parent)
+    p_star = np.sqrt(np.maximum((m_parent**2 - (m1 + m2)**2) * (m_parent**2 - (m1 - m2)**2), 0)) / (2 * m_parent)
+    cos_theta = rng.uniform(-1, 1, n)
+    sin_theta = np.sqrt(1 - cos_theta**2)
+    phi = rng.uniform(-np.pi, np.pi, n)
+    direction = np.stack([sin_theta * np.cos(phi), sin_theta * np.sin(phi), cos_theta], axis=1)
+    p = p_star[:, None] * direction
+    d1 = np.concatenate([np.sqrt(p_star**2 + m1**2)[:, None], p], axis=1)
+    d2 = np.concatenate([np.sqrt(p_star**2 + m2**2)[:, None], -p], axis=1)
+    beta = parent[:, 1:] / parent[:, :1]
+    return boost(d1, beta), boost(d2, beta)
+
+
+def produce(rng: np.random.Generator, mass: np.ndarray, mean_pt: float = 20.0) -> np.ndarray:
+    """
+    Creates four-vectors of resonances with masses *mass*, an exponential pt spectrum and a flat
+    rapidity distribution.
+    """
+    n = len(mass)
+    pt = rng.exponential(mean_pt, n)
+    y = rng.uniform(-2.0, 2.0, n)
+    phi = rng.uniform(-np.pi, np.pi, n)
+    mt = np.sqrt(mass**2 + pt**2)
+    return np.stack([mt * np.cosh(y), pt * np.cos(phi), pt * np.sin(phi), mt * np.sinh(y)], axis=1)
+
+
+def to_ptetaphi(p4: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Converts four-vectors of shape (n, 4) in (E, px, py, pz) order to pt, eta and phi.
+    """
+    pt = np.hypot(p4[:, 1], p4[:, 2])
+    eta = np.arcsinh(p4[:, 3] / np.maximum(pt, 1e-9))
+    phi = np.arctan2(p4[:, 2], p4[:, 1])
+    return pt, eta, phi
+
+
+def decay_z(
+    rng: np.random.Generator,
+    event_idx: np.ndarray,
+    z: np.ndarray,
+    m_z: np.ndarray,
+) -> dict[str, np.ndarray]:
+    """
+    Decays Z bosons into electron or muon pairs and returns flat lepton properties.
+    """
+    is_muon = rng.uniform(size=len(z)) < 0.5
+    m_lep = np.where(is_muon, MUON_MASS, ELECTRON_MASS)
+    l1, l2 = two_body_decay(rng, z, m_z, m_lep, m_lep)
+    charge = np.where(rng.uniform(size=len(z)) < 0.5, 1, -1)
+    return {
+        "event_idx": np.concatenate([event_idx, event_idx]),
+        "p4": np.concatenate([l1, l2]),
+        "is_muon": np.concatenate([is_muon, is_muon]),
+        "charge": np.concatenate([charge, -charge]),
+        "prompt": np.ones(2 * len(z), dtype=bool),
+    }
+
+
+def non_prompt_leptons(rng: np.random.Generator, n_events: int, cfg: dict) -> dict[str, np.ndarray]:
+    """
+    Soft, non-prompt leptons with a Poisson-distributed multiplicity per event.
+    """
+    counts = rng.poisson(cfg["extra_leptons_mean"], n_events)
+    n = int(counts.sum())
+    pt = 5.0 + rng.exponential(8.0, n)
+    eta = rng.uniform(-2.6, 2.6, n)
+    phi = rng.uniform(-np.pi, np.pi, n)
+    is_muon = rng.uniform(size=n) < cfg["extra_muon_fraction"]
+    mass = np.where(is_muon, MUON_MASS, ELECTRON_MASS)
+    mt = np.sqrt(mass**2 + pt**2)
+    return {
+        "event_idx": np.repeat(np.arange(n_events), counts),
+        "p4": np.stack([mt * np.cosh(eta), pt * np.cos(phi), pt * np.sin(phi), pt * np.sinh(eta)], axis=1),
+        "is_muon": is_muon,
+        "charge": np.where(rng.uniform(size=n) < cfg["extra_positive_fraction"], 1, -1),
+        "prompt": np.zeros(n, dtype=bool),
+    }
+
+
+def sorted_by_pt(leptons: dict[str, np.ndarray], n_events: int) -> tuple[dict[str, np.ndarray], np.ndarray]:
+    """
+    Orders flat lepton properties by event and decreasing pt, as in NanoAOD, and returns them
+    together with the number of leptons per event.
+    """
+    pt, eta, phi = to_ptetaphi(leptons["p4"])
+    order = np.lexsort((-pt, leptons["event_idx"]))
+    flat = {"pt": pt, "eta": eta, "phi": phi, "charge": leptons["charge"], "prompt": leptons["prompt"]}
+    flat = {name: values[order] for name, values in flat.items()}
+    return flat, np.bincount(leptons["event_idx"], minlength=n_events)
+
+
+def quality(rng: np.random.Generator, prompt: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Impact parameters and isolation, which are wider for non-prompt leptons.
+    """
+    n = len(prompt)
+    scale = np.where(prompt, 1.0, 5.0)
+    return {
+        "dxy": (rng.normal(0, 0.005, n) * scale).astype(np.float32),
+        "dz": (rng.normal(0, 0.01, n) * scale).astype(np.float32),
+        "sip3d": np.abs(rng.normal(0, 1.5, n) * scale).astype(np.float32),
+        "pfRelIso03_all": rng.exponential(np.where(prompt, 0.05, 0.4)).astype(np.float32),
+    }
+
+
+def electrons(rng: np.random.Generator, flat: dict[str, np.ndarray], counts: np.ndarray) -> ak.Array:
+    n = len(flat["pt"])
+    prompt = flat["prompt"]
+    # BDT scores in [-1, 1] peaking at 1 for prompt and at -1 for non-prompt electrons
+    bdt = np.where(prompt, 1 - 2 * rng.beta(1, 8, n), 2 * rng.beta(1, 3, n) - 1)
+    fields = {
+        "pt": flat["pt"].astype(np.float32),
+        "eta": flat["eta"].astype(np.float32),
+        "phi": flat["phi"].astype(np.float32),
+        "mass": np.full(n, ELECTRON_MASS, dtype=np.float32),
+        "charge": flat["charge"].astype(np.int32),
+        "deltaEtaSC": rng.normal(0, 0.01, n).astype(np.float32),
+        **quality(rng, prompt),
+        "mvaFall17V2Iso": bdt.astype(np.float32),
+        "mvaHZZIso": np.clip(bdt + rng.normal(0, 0.05, n), -1, 1).astype(np.float32),
+    }
+    return ak.unflatten(ak.zip(fields), counts)
+
+
+def muons(rng: np.random.Generator, flat: dict[str, np.ndarray], counts: np.ndarray) -> ak.Array:
+    n = len(flat["pt"])
+    prompt = flat["prompt"]
+    good = np.where(prompt, 0.98, 0.7)
+    is_global = rng.uniform(size=n) < good
+    fields = {
+        "pt": flat["pt"].astype(np.float32),
+        "eta": flat["eta"].astype(np.float32),
+        "phi": flat["phi"].astype(np.float32),
+        "mass": np.full(n, MUON_MASS, dtype=np.float32),
+        "charge": flat["charge"].astype(np.int32),
+        "isGlobal": is_global,
+        "isStandalone": rng.uniform(size=n) < 0.05,
+        "isTracker": is_global | (rng.uniform(size=n) < good),
+        "nStations": rng.integers(0, 5, n).astype(np.int32),
+        "nTrackerLayers": rng.integers(5, 19, n).astype(np.int32),
+        **quality(rng, prompt),
+        "tightId": rng.uniform(size=n) < good,
+        "mvaId": rng.integers(0, 4, n).astype(np.uint8),
+        "highPtId": np.where(flat["pt"] > 200, 2, 0).astype(np.uint8),
+        "isPFcand": rng.uniform(size=n) < good,
+    }
+    fields["pfRelIso04_all"] = (fields["pfRelIso03_all"] * 1.3).astype(np.float32)
+    return ak.unflatten(ak.zip(fields), counts)
+
+
+def jets(rng: np.random.Generator, n_events: int, n_electrons: np.ndarray, n_muons: np.ndarray, cfg: dict) -> ak.Array:
+    """
+    Jets with a falling pt spectrum, of which some overlap with leptons through the
+    ``electronIdx{1,2}`` and ``muonIdx{1,2}`` references.
+    """
+    counts = rng.poisson(cfg["jets_mean"], n_events)
+    n = int(counts.sum())
+    event_idx = np.repeat(np.arange(n_events), counts)
+    pt = 15.0 + rng.exponential(30.0, n)
+    pt = pt[np.lexsort((-pt, event_idx))]
+
+    def lepton_ref(n_leptons: np.ndarray, probability: float) -> np.ndarray:
+        n_in_event = n_leptons[event_idx]
+        idx = np.floor(rng.uniform(size=n) * n_in_event).astype(np.int32)
+        return np.where((n_in_event > 0) & (rng.uniform(size=n) < probability), idx, -1).astype(np.int32)
+
+    fields = {
+        "pt": pt.astype(np.float32),
+        "eta": rng.uniform(-4.7, 4.7, n).astype(np.float32),
+        "phi": rng.uniform(-np.pi, np.pi, n).astype(np.float32),
+        "mass": (pt * rng.uniform(0.05, 0.2, n)).astype(np.float32),
+        "rawFactor": rng.uniform(0.0, 0.2, n).astype(np.float32),
+        "area": rng.normal(0.5, 0.03, n).astype(np.float32),
+        "jetId": np.full(n, 6, dtype=np.int32),
+        "btagDeepFlavB": rng.uniform(size=n).astype(np.float32),
+        "hadronFlavour": rng.choice([0, 4, 5], n, p=[0.8, 0.1, 0.1]).astype(np.int32),
+        "chEmEF": rng.uniform(0.0, 0.2, n).astype(np.float32),
+        "muEF": rng.uniform(0.0, 0.1, n).astype(np.float32),
+        "electronIdx1": lepton_ref(n_electrons, 0.1),
+        "electronIdx2": lepton_ref(n_electrons, 0.01),
+        "muonIdx1": lepton_ref(n_muons, 0.1),
+        "muonIdx2": lepton_ref(n_muons, 0.01),
+    }
+    return ak.unflatten(ak.zip(fields), counts)
+
+
+def hlt(
+    rng: np.random.Generator,
+    electron: ak.Array,
+    muon: ak.Array,
+    triggers: dict[str, tuple[int, int, float]],
+) -> ak.Array:
+    """
+    Emulates trigger decisions from the number of electrons and muons above the trigger
+    thresholds, with an efficiency of 95%.
+    """
+    n_events = len(electron)
+    bits = {}
+    for name, (n_e, n_mu, threshold) in triggers.items():
+        passed = (
+            (ak.to_numpy(ak.sum((electron.pt > threshold) & (abs(electron.eta) < 2.5), axis=1)) >= n_e) &
+            (ak.to_numpy(ak.sum((muon.pt > threshold) & (abs(muon.eta) < 2.4), axis=1)) >= n_mu)
+        )
+        bits[name] = passed & (rng.uniform(size=n_events) < 0.95)
+    return ak.zip(bits)
+
+
+def generate_events(n_events: int, seed: int = 0, first_event: int = 1, **kwargs) -> ak.Array:
+    """
+    Generates *n_events* NanoAOD-like events with a *seed*, numbering events from *first_event*
+    on. Settings in :py:data:`DEFAULT_CONFIG` can be changed through *kwargs*, and a dictionary
+    ``triggers`` can replace :py:data:`DEFAULT_TRIGGERS`.
+    """
+    triggers = kwargs.pop("triggers", DEFAULT_TRIGGERS)
+    unknown = set(kwargs) - set(DEFAULT_CONFIG)
+    if unknown:
+        raise ValueError(f"unknown generator settings: {', '.join(sorted(unknown))}")
+    cfg = {**DEFAULT_CONFIG, **kwargs}
+    rng = np.random.default_rng(seed)
+    m_z, width_z = cfg["m_z"], cfg["width_z"]
+
+    # assign event types
+    u = rng.uniform(size=n_events)
+    edges = np.cumsum([cfg["h_fraction"], cfg["zz_fraction"], cfg["z_fraction"]])
+    event_type = np.searchsorted(edges, u, side="right")
+    h_idx, zz_idx, z_idx = (np.flatnonzero(event_type == i) for i in range(3))
+    leptons = []
+
+    # H -> Z Z* -> 4l
+    m_h = breit_wigner(rng, cfg["m_h"], cfg["width_h"], cfg["m_h"] - 5.0, np.full(len(h_idx), cfg["m_h"] + 5.0))
+    m_z1 = breit_wigner(rng, m_z, width_z, 40.0, m_h - 12.0)
+    m_z2 = breit_wigner(rng, m_z, width_z, 4.0, m_h - m_z1)
+    z1, z2 = two_body_decay(rng, produce(rng, m_h), m_h, m_z1, m_z2)
+    leptons += [decay_z(rng, h_idx, z1, m_z1), decay_z(rng, h_idx, z2, m_z2)]
+
+    # continuum ZZ -> 4l above the on-shell threshold
+    m_z1 = breit_wigner(rng, m_z, width_z, 12.0, np.full(len(zz_idx), 120.0))
+    m_z2 = breit_wigner(rng, m_z, width_z, 12.0, np.full(len(zz_idx), 120.0))
+    m_zz = m_z1 + m_z2 + rng.exponential(60.0, len(zz_idx))
+    z1, z2 = two_body_decay(rng, produce(rng, m_zz, mean_pt=30.0), m_zz, m_z1, m_z2)
+    leptons += [decay_z(rng, zz_idx, z1, m_z1), decay_z(rng, zz_idx, z2, m_z2)]
+
+    # Z -> 2l
+    m_z1 = breit_wigner(rng, m_z, width_z, 12.0, np.full(len(z_idx), 200.0))
+    leptons.append(decay_z(rng, z_idx, produce(rng, m_z1, mean_pt=10.0), m_z1))
+
+    # soft non-prompt leptons in all events
+    leptons.append(non_prompt_leptons(rng, n_events, cfg))
+
+    # split into electrons and muons
+    merged = {key: np.concatenate([part[key] for part in leptons]) for key in leptons[0]}
+    is_muon = merged.pop("is_muon")
+    electron = electrons(rng, *sorted_by_pt({k: v[~is_muon] for k, v in merged.items()}, n_events))
+    muon = muons(rng, *sorted_by_pt({k: v[is_muon] for k, v in merged.items()}, n_events))
+
+    events = {
+        "run": np.full(n_events, cfg["run"], dtype=np.uint32),
+        "luminosityBlock": (1 + (first_event + np.arange(n_events)) // 1000).astype(np.uint32),
+        "event": (first_event + np.arange(n_events)).astype(np.uint64),
+        "Electron": electron,
+        "Muon": muon,
+        "Jet": jets(rng, n_events, ak.to_numpy(ak.num(electron)), ak.to_numpy(ak.num(muon)), cfg),
+        "HLT": hlt(rng, electron, muon, triggers),
+        "MET": ak.zip({
+            "pt": rng.exponential(30.0, n_events).astype(np.float32),
+            "phi": rng.uniform(-np.pi, np.pi, n_events).astype(np.float32),
+            "significance": rng.exponential(2.0, n_events).astype(np.float32),
+            "covXX": rng.exponential(200.0, n_events).astype(np.float32),
+            "covXY": rng.normal(0.0, 20.0, n_events).astype(np.float32),
+            "covYY": rng.exponential(200.0, n_events).astype(np.float32),
+        }),
+        "PV": ak.zip({
+            "npvs": rng.poisson(30, n_events).astype(np.int32),
+            "npvsGood": rng.poisson(28, n_events).astype(np.int32),
+            "x": rng.normal(0.01, 0.002, n_events).astype(np.float32),
+            "y": rng.normal(0.04, 0.002, n_events).astype(np.float32),
+            "z": rng.normal(0.0, 3.5, n_events).astype(np.float32),
+        }),
+        "fixedGridRhoFastjetAll": rng.gamma(9.0, 2.0, n_events).astype(np.float32),
+    }
+    if not cfg["is_data"]:
+        events["genWeight"] = np.ones(n_events, dtype=np.float32)
+        events["Pileup"] = ak.zip({"nTrueInt": rng.uniform(0, 80, n_events).astype(np.float32)})
+
+    return ak.zip(events, depth_limit=1)
+
+
+def write_events(events: ak.Array, path: str, cluster_size: int = 10000) -> None:
+    """
+    Writes *events* to a parquet file or, if *path* ends with ``.root``, to an ``Events`` tree with
+    NanoAOD branch names such as ``nElectron`` and ``Electron_pt``, and baskets of *cluster_size*
+    events.
+    """
+    if path.endswith(".root"):
+        import uproot
+        branches = {}
+        for name in events.fields:
+            column = events[name]
+            if column.ndim > 1:
+                # jagged collections, written with an n<name> counter branch
+                branches[name] = ak.zip({field: column[field] for field in column.fields})
+            elif column.fields:
+                branches.update({f"{name}_{field}": column[field] for field in column.fields})
+            else:
+                branches[name] = column
+        types = {
+            name: values.type.content if isinstance(values, ak.Array) else values.dtype
+            for name, values in branches.items()
+        }
+        with uproot.recreate(path) as f:
+            tree = f.mktree("Events", types)
+            for start in range(0, len(events), cluster_size):
+                tree.extend({name: values[start:start + cluster_size] for name, values in branches.items()})
+    else:
+        ak.to_parquet(events, path)
+
+
+def _write_chunk(args: tuple) -> str:
+    path, n_events, seed, first_event, kwargs = args
+    write_events(generate_events(n_events, seed=seed, first_event=first_event, **kwargs), path)
+    return path
+
+
+def write_chunks(
+    output_dir: str,
+    n_events: int,
+    chunk_size: int = 500000,
+    seed: int = 0,
+    fmt: str = "parquet",
+    workers: int = 1,
+    **kwargs,
+) -> list[str]:
+    """
+    Generates *n_events* in chunks of *chunk_size* events, each written to its own file in
+    *output_dir* with format *fmt* (``"parquet"`` or ``"root"``), and returns the file paths.
+    Seeds of all chunks are derived from *seed* so that the output does not depend on the number
+    of *workers*. Remaining *kwargs* are forwarded to :py:func:`generate_events`.
+    """
+    if fmt not in ("parquet", "root"):
+        raise ValueError(f"unknown output format '{fmt}'")
+    os.makedirs(output_dir, exist_ok=True)
+
+    n_chunks = (n_events + chunk_size - 1) // chunk_size
+    seeds = np.random.SeedSequence(seed).generate_state(n_chunks)
+    tasks = [
+        (
+            os.path.join(output_dir, f"events_{i:05d}.{fmt}"),
+            min(chunk_size, n_events - i * chunk_size),
+            int(seeds[i]),
+            1 + i * chunk_size,
+            kwargs,
+        )
+        for i in range(n_chunks)
+    ]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(_write_chunk, tasks))
+    return [_write_chunk(task) for task in tasks]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("output_dir", help="directory to write chunks to")
+    parser.add_argument("--events", type=int, default=100000, help="number of events")
+    parser.add_argument("--chunk-size", type=int, default=500000, help="events per chunk")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--format", choices=["parquet", "root"], default="parquet", help="output format")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes")
+    for name, default in DEFAULT_CONFIG.items():
+        if isinstance(default, bool):
+            parser.add_argument(f"--{name.replace('_', '-')}", action="store_true", help="flag")
+        else:
+            parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default,
+                help=f"default: {default}")
+    args = parser.parse_args()
+
+    kwargs = {name: getattr(args, name) for name in DEFAULT_CONFIG}
+    paths = write_chunks(
+        args.output_dir,
+        args.events,
+        chunk_size=args.chunk_size,
+        seed=args.seed,
+        fmt=args.format,
+        workers=args.workers,
+        **kwargs,
+    )
+    print(f"wrote {args.events} events to {len(paths)} chunk(s) in {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# coding: utf-8
+
+"""
+Tests of the correction registry in :py:mod:`h4l.corrections`.
+"""
+
+from __future__ import annotations
+
+__all__ = ["CorrectionRegistryTest"]
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import correctionlib
+
+from h4l.corrections import CorrectionRegistry
+
+
+def _payload(name: str, factor: float) -> str:
+    # correction set with a single correction, linear in its only input
+    return json.dumps({
+        "schema_version": 2,
+        "corrections": [{
+            "name": name,
+            "version": 1,
+            "inputs": [{"name": "pt", "type": "real"}],
+            "output": {"name": "weight", "type": "real"},
+            "data": {"nodetype": "formula", "expression": f"{factor}*x", "parser": "TFormula", "variables": ["pt"]},
+        }],
+    })
+
+
+class CorrectionRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = CorrectionRegistry()
+
+    def test_from_string(self):
+        data = _payload("sf", 2.0)
+        cset = self.registry.from_string(data)
+        self.assertIsInstance(cset, correctionlib.highlevel.CorrectionSet)
+        self.assertEqual(list(cset), ["sf"])
+        self.assertEqual(cset["sf"].evaluate(3.0), 6.0)
+
+        # identical payloads, also as different string objects, return the same object
+        self.assertIs(self.registry.from_string(data), cset)
+        self.assertIs(self.registry.from_string("".join(list(data))), cset)
+
+        # different payloads do not
+        other = self.registry.from_string(_payload("sf", 3.0))
+        self.assertIsNot(other, cset)
+        self.assertEqual(other["sf"].evaluate(3.0), 9.0)
+        self.assertIsNot(self.registry.from_string(_payload("sf2", 2.0)), cset)
+
+        self.assertEqual(self.registry.stats["file_hits"], 2)
+        self.assertEqual(self.registry.stats["file_misses"], 3)
+        self.assertEqual(len(self.registry.load_times), 3)
+
+    def test_parse_string(self):
+        # when patched, the original parser of correctionlib is used exactly once per payload
+        calls = []
+
+        def parse_string(data):
+            calls.append(data)
+            return correctionlib.CorrectionSet.from_string(data)
+
+        self.registry.parse_string = parse_string
+        data = _payload("sf", 2.0)
+        cset = self.registry.from_string(data)
+        self.assertIs(self.registry.from_string(data), cset)
+        self.assertEqual(calls, [data])
+
+    def test_get(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, "sf.json")
+            with open(path, "w") as f:
+                f.write(_payload("sf", 2.0))
+
+            corrector = self.registry.get(path, "sf", version="v1")
+            self.assertEqual(corrector.evaluate(3.0), 6.0)
+            self.assertIs(self.registry.get(path, "sf", version="v1"), corrector)
+            self.assertIs(self.registry.correction_set(path, "v1"), self.registry.correction_set(path, "v1"))
+            # other versions of the same file are loaded separately
+            self.assertIsNot(self.registry.get(path, "sf", version="v2"), corrector)
+            self.assertEqual(self.registry.stats["evaluator_misses"], 2)
+            self.assertEqual(self.registry.stats["evaluator_hits"], 1)
+
+            self.registry.clear()
+            self.assertEqual(self.registry.stats["file_misses"], 0)
+            self.assertIsNot(self.registry.get(path, "sf", version="v1"), corrector)
+        finally:
+            shutil.rmtree(tmp_dir)
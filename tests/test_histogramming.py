@@ -0,0 +1,97 @@
+# coding: utf-8
+
+"""
+Tests of the histogram producers in :py:mod:`h4l.histogramming`.
+"""
+
+from __future__ import annotations
+
+__all__ = ["WeightMatrixHistsTest"]
+
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+import order as od
+
+from columnflow.config_util import add_shift_aliases, get_shifts_from_sources
+from columnflow.util import DotDict, maybe_import
+
+hist = maybe_import("hist")
+
+# hist producers require a columnflow version with histogramming support
+try:
+    from h4l.histogramming.weights import weight_matrix_hists
+except ImportError:
+    weight_matrix_hists = None
+
+
+@unittest.skipIf(weight_matrix_hists is None, "columnflow.histogramming not available")
+class WeightMatrixHistsTest(unittest.TestCase):
+
+    edges = [100.0, 120.0, 130.0, 150.0]
+
+    @classmethod
+    def setUpClass(cls):
+        analysis = od.Analysis("h4l_test_hists", 1)
+        cls.config_inst = config = analysis.add_config(od.Campaign("h4l_test_hists_campaign", 1))
+        config.add_shift(name="nominal", id=0)
+        config.add_shift(name="jec_up", id=20, type="shape")
+        config.add_shift(name="mu_up", id=10, type="shape")
+        config.add_shift(name="mu_down", id=11, type="shape")
+        add_shift_aliases(config, "mu", {"muon_weight": "muon_weight_{direction}"})
+        config.x.event_weights = DotDict({
+            "normalization_weight": [],
+            "muon_weight": get_shifts_from_sources(config, "mu"),
+        })
+        cls.dataset_inst = od.Dataset("h4l_test_hists_dataset", 1, campaign=config.campaign, is_data=False)
+
+        # three events in different bins, with weight columns of nominal, mu_up and mu_down
+        cls.values = np.array([110.0, 125.0, 125.0, 140.0])
+        cls.weights = np.array([
+            [1.0, 1.5, 0.5],
+            [2.0, 2.5, 1.5],
+            [3.0, 3.5, 2.5],
+            [4.0, 4.5, 3.5],
+        ], dtype=np.float32)
+
+    def fill(self, shift_name: str) -> hist.Hist:
+        inst = weight_matrix_hists(inst_dict={
+            "analysis_inst": self.config_inst.analysis,
+            "config_inst": self.config_inst,
+            "dataset_inst": self.dataset_inst,
+        })
+        self.assertEqual(inst.shift_names, ["nominal", "mu_up", "mu_down"])
+
+        h = hist.Hist.new.IntCat([], name="shift", growth=True).Var(self.edges, name="m4l").Weight()
+        shift_inst = self.config_inst.get_shift(shift_name)
+        task = SimpleNamespace(global_shift_inst=shift_inst, last_edge_inclusive=False)
+        data = {
+            "shift": np.full(len(self.values), shift_inst.id, dtype=np.int32),
+            "m4l": self.values,
+            "weight": self.weights,
+        }
+        inst.run_fill_hist(h, data, task)
+        return h
+
+    def contents(self, h: hist.Hist) -> dict[int, list[float]]:
+        return {
+            int(shift_id): h[{"shift": hist.loc(int(shift_id))}].values().tolist()
+            for shift_id in h.axes["shift"]
+        }
+
+    def test_nominal(self):
+        # all weight variations, each in the bin of its shift
+        self.assertEqual(self.contents(self.fill("nominal")), {
+            0: [1.0, 5.0, 4.0],
+            10: [1.5, 6.0, 4.5],
+            11: [0.5, 4.0, 3.5],
+        })
+
+    def test_shape_shift(self):
+        # only the nominal weights in the bin of the shape shift
+        self.assertEqual(self.contents(self.fill("jec_up")), {20: [1.0, 5.0, 4.0]})
+
+    def test_weight_shift(self):
+        # only the weights of the shift in its bin
+        self.assertEqual(self.contents(self.fill("mu_down")), {11: [0.5, 4.0, 3.5]})
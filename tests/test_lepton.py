@@ -0,0 +1,148 @@
+# coding: utf-8
+
+"""
+Tests of the lepton selection in :py:mod:`h4l.selection.lepton`.
+"""
+
+from __future__ import annotations
+
+__all__ = ["LeptonCacheTest"]
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import awkward as ak
+import order as od
+
+from columnflow.util import DotDict
+
+from h4l.selection.lepton import lepton_selection
+
+
+def _lepton_config() -> tuple[od.Config, od.Dataset]:
+    analysis = od.Analysis("h4l_test_lepton", 1)
+    campaign = od.Campaign("h4l_test_lepton_campaign", 1, aux={"version": 9})
+    config = analysis.add_config(campaign)
+    config.x.electron_mva_wp = None
+    config.x.lepton_cuts = DotDict.wrap({
+        "Electron": {"pt": "pt > 7", "sip3d": "abs(sip3d) < 4"},
+        "Muon": {"pt": "pt > 5", "iso": "pfRelIso03_all < 0.35"},
+    })
+    dataset = od.Dataset("h4l_test_lepton_dataset", 1, campaign=campaign)
+    return config, dataset
+
+
+def _lepton_events(n: int) -> ak.Array:
+    rng = np.random.default_rng(31)
+
+    def collection(fields):
+        counts = rng.poisson(3.0, n)
+        values = {name: gen(int(counts.sum())) for name, gen in fields.items()}
+        return ak.unflatten(ak.zip(values), counts)
+
+    common = {
+        "pt": lambda k: rng.exponential(20.0, k).astype(np.float32),
+        "eta": lambda k: rng.uniform(-2.5, 2.5, k).astype(np.float32),
+        "phi": lambda k: rng.uniform(-np.pi, np.pi, k).astype(np.float32),
+        "mass": lambda k: np.zeros(k, dtype=np.float32),
+        "charge": lambda k: rng.choice([-1, 1], k).astype(np.int32),
+    }
+    return ak.Array({
+        "run": np.full(n, 1, dtype=np.uint32),
+        "luminosityBlock": np.full(n, 1, dtype=np.uint32),
+        "event": np.arange(n, dtype=np.uint64),
+        "Electron": collection({
+            **common,
+            "deltaEtaSC": lambda k: np.zeros(k, dtype=np.float32),
+            "mvaFall17V2Iso": lambda k: rng.uniform(-1.0, 1.0, k).astype(np.float32),
+            "sip3d": lambda k: rng.exponential(3.0, k).astype(np.float32),
+        }),
+        "Muon": collection({
+            **common,
+            "pfRelIso03_all": lambda k: rng.exponential(0.3, k).astype(np.float32),
+        }),
+    })
+
+
+class LeptonCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.config_inst, self.dataset_inst = _lepton_config()
+        self.events = _lepton_events(200)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def selector(self, cache_dir: str | None) -> lepton_selection:
+        env = {"H4L_LEPTON_CACHE_DIR": cache_dir} if cache_dir else {}
+        with mock.patch.dict(os.environ, env):
+            if not cache_dir:
+                os.environ.pop("H4L_LEPTON_CACHE_DIR", None)
+            return lepton_selection(inst_dict={
+                "analysis_inst": self.config_inst.analysis,
+                "config_inst": self.config_inst,
+                "dataset_inst": self.dataset_inst,
+            })
+
+    def cache_files(self) -> list[str]:
+        return sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(self.cache_dir)
+            for name in names
+        )
+
+    def select(self, selector: lepton_selection, events: ak.Array) -> tuple[list, list]:
+        _, results = selector(events)
+        return ak.to_list(results.objects.Electron.Electron), ak.to_list(results.objects.Muon.Muon)
+
+    def test_disabled_by_default(self):
+        selector = self.selector(None)
+        self.assertEqual(selector.lepton_cache_dir, "")
+        self.select(selector, self.events)
+        self.assertEqual(self.cache_files(), [])
+
+    def test_hit_and_miss(self):
+        selector = self.selector(self.cache_dir)
+        expected = self.select(self.selector(None), self.events)
+
+        # miss, writing one entry with the computed selection
+        self.assertEqual(self.select(selector, self.events), expected)
+        [cache_file] = self.cache_files()
+
+        # hit, returning the entry, which is replaced to distinguish it from a recomputation
+        np.savez(
+            cache_file,
+            electron_idx=np.zeros(0, dtype=np.int64),
+            electron_num=np.zeros(len(self.events), dtype=np.int64),
+            muon_idx=np.zeros(0, dtype=np.int64),
+            muon_num=np.zeros(len(self.events), dtype=np.int64),
+        )
+        empty = [[]] * len(self.events)
+        self.assertEqual(self.select(selector, self.events), (empty, empty))
+        self.assertEqual(self.cache_files(), [cache_file])
+
+    def test_invalidation(self):
+        selector = self.selector(self.cache_dir)
+        self.select(selector, self.events)
+        [cache_file] = self.cache_files()
+
+        # change an input other than pt, which changes the selection
+        sip3d = ak.to_numpy(ak.flatten(self.events.Electron.sip3d))
+        sip3d = np.where(sip3d < 4, sip3d + 4, sip3d - 4).astype(np.float32)
+        electrons = ak.with_field(
+            self.events.Electron,
+            ak.unflatten(sip3d, ak.num(self.events.Electron)),
+            "sip3d",
+        )
+        events = ak.with_field(self.events, electrons, "Electron")
+
+        expected = self.select(self.selector(None), events)
+        self.assertNotEqual(expected, self.select(self.selector(None), self.events))
+        self.assertEqual(self.select(selector, events), expected)
+        self.assertEqual(len(self.cache_files()), 2)
+        self.assertIn(cache_file, self.cache_files())
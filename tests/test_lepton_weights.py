@@ -0,0 +1,175 @@
+# coding: utf-8
+
+"""
+Tests of the lepton scale factor weights in :py:mod:`h4l.production.lepton_weights`.
+"""
+
+from __future__ import annotations
+
+__all__ = ["LeptonWeightsTest"]
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import awkward as ak
+import order as od
+
+from columnflow.util import DotDict
+
+from h4l.corrections import correction_registry
+from h4l.production.lepton_weights import lepton_weights
+
+
+def _correction(name: str, version: int, inputs: list[tuple[str, str]], edges: dict, rng) -> dict:
+    # correction with categories for all string inputs and a binning in all real inputs, with
+    # random contents per category, in the format of correctionlib's schema v2
+    def content(string_inputs):
+        if string_inputs:
+            (inp, keys), rest = string_inputs[0], string_inputs[1:]
+            return {
+                "nodetype": "category",
+                "input": inp,
+                "content": [{"key": key, "value": content(rest)} for key in keys],
+            }
+        n = int(np.prod([len(e) - 1 for e in edges.values()]))
+        return {
+            "nodetype": "multibinning",
+            "inputs": list(edges),
+            "edges": list(edges.values()),
+            "content": rng.uniform(0.8, 1.2, n).round(6).tolist(),
+            "flow": "clamp",
+        }
+
+    string_inputs = [(inp, keys) for inp, keys in inputs if keys]
+    return {
+        "name": name,
+        "version": version,
+        "inputs": [{"name": inp, "type": "string" if keys else "real"} for inp, keys in inputs],
+        "output": {"name": "weight", "type": "real"},
+        "data": content(string_inputs),
+    }
+
+
+class LeptonWeightsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(37)
+        cls.tmp_dir = tempfile.mkdtemp()
+
+        # input orders as expected by columnflow's electron_weights and muon_weights
+        corrections = [
+            _correction(
+                "UL-Electron-ID-SF", 2,
+                [("year", ["2017"]), ("ValType", ["sf", "sfup", "sfdown"]), ("WorkingPoint", ["wp80iso"]),
+                 ("eta", None), ("pt", None)],
+                {"eta": [-2.5, -1.5, 0.0, 1.5, 2.5], "pt": [10.0, 20.0, 50.0, 500.0]},
+                rng,
+            ),
+            _correction(
+                "NUM_TightID_DEN_TrackerMuons", 1,
+                [("year", ["2017_UL"]), ("abseta", None), ("pt", None), ("ValType", ["sf", "systup", "systdown"])],
+                {"abseta": [0.0, 0.9, 1.2, 2.4], "pt": [15.0, 30.0, 60.0, 200.0]},
+                rng,
+            ),
+        ]
+        cls.corrections = dict(zip(["electron_sf", "muon_sf"], corrections))
+        cls.paths = {key: cls.write_correction(key, correction) for key, correction in cls.corrections.items()}
+
+        analysis = od.Analysis("h4l_test_lepton_weights", 1)
+        cls.config_inst = analysis.add_config(od.Campaign("h4l_test_lepton_weights_campaign", 1))
+        cls.config_inst.x.external_files = DotDict.wrap(cls.paths)
+        cls.config_inst.x.electron_sf_names = ("UL-Electron-ID-SF", "2017", "wp80iso")
+        cls.config_inst.x.muon_sf_names = ("NUM_TightID_DEN_TrackerMuons", "2017_UL")
+        cls.dataset_inst = od.Dataset("h4l_test_lepton_weights_dataset", 1, campaign=cls.config_inst.campaign)
+
+        def leptons(n_events: int, fields: list[str]) -> ak.Array:
+            counts = rng.poisson(2.0, n_events)
+            n = int(counts.sum())
+            values = {
+                "pt": rng.exponential(25.0, n).astype(np.float32) + 5.0,
+                "eta": rng.uniform(-2.5, 2.5, n).astype(np.float32),
+                "deltaEtaSC": rng.normal(0.0, 0.02, n).astype(np.float32),
+            }
+            return ak.unflatten(ak.zip({field: values[field] for field in fields}), counts)
+
+        cls.events = ak.Array({
+            "Electron": leptons(2000, ["pt", "eta", "deltaEtaSC"]),
+            "Muon": leptons(2000, ["pt", "eta"]),
+        })
+
+    @classmethod
+    def write_correction(cls, key: str, correction: dict) -> str:
+        path = os.path.join(cls.tmp_dir, f"{key}_v{correction['version']}.json")
+        with open(path, "w") as f:
+            json.dump({"schema_version": 2, "corrections": [correction]}, f)
+        return path
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+        correction_registry.clear()
+
+    def producer(self) -> lepton_weights:
+        inst = lepton_weights(inst_dict={
+            "analysis_inst": self.config_inst.analysis,
+            "config_inst": self.config_inst,
+            "dataset_inst": self.dataset_inst,
+        })
+        bundle = DotDict.wrap({"files": self.paths})
+        inst.run_setup({"external_files": bundle}, {})
+        return inst
+
+    def expected(self, flavour: str, postfix: str) -> np.ndarray:
+        # per-lepton evaluation as in columnflow's electron_weights and muon_weights, with a mask
+        # of leptons above min_pt
+        import correctionlib
+        cset = correctionlib.CorrectionSet.from_file(self.paths["electron_sf" if flavour == "Electron" else "muon_sf"])
+        leptons = self.events[flavour]
+        leptons = leptons[leptons.pt > lepton_weights.min_pt]
+        pt = ak.to_numpy(ak.flatten(leptons.pt))
+        if flavour == "Electron":
+            name, year, wp = self.config_inst.x.electron_sf_names
+            syst = {"": "sf", "_up": "sfup", "_down": "sfdown"}[postfix]
+            sc_eta = ak.to_numpy(ak.flatten(leptons.eta + leptons.deltaEtaSC))
+            sf = [cset[name].evaluate(year, syst, wp, float(e), float(p)) for e, p in zip(sc_eta, pt)]
+        else:
+            name, year = self.config_inst.x.muon_sf_names
+            syst = {"": "sf", "_up": "systup", "_down": "systdown"}[postfix]
+            abs_eta = ak.to_numpy(ak.flatten(abs(leptons.eta)))
+            sf = [cset[name].evaluate(year, float(e), float(p), syst) for e, p in zip(abs_eta, pt)]
+        sf = ak.unflatten(np.asarray(sf, dtype=np.float64), ak.num(leptons))
+        return ak.to_numpy(ak.prod(sf, axis=1, mask_identity=False)).astype(np.float32)
+
+    def test_weights(self):
+        events = self.producer()(self.events)
+        for flavour, weight_name in [("Electron", "electron_weight"), ("Muon", "muon_weight")]:
+            for postfix in ["", "_up", "_down"]:
+                with self.subTest(column=f"{weight_name}{postfix}"):
+                    weights = ak.to_numpy(events[f"{weight_name}{postfix}"])
+                    self.assertEqual(weights.dtype, np.float32)
+                    np.testing.assert_allclose(weights, self.expected(flavour, postfix), rtol=1e-6)
+
+        # variations differ from the nominal weights
+        self.assertFalse(np.allclose(events.electron_weight_up, events.electron_weight))
+        self.assertFalse(np.allclose(events.muon_weight_down, events.muon_weight))
+        # events without leptons above min_pt have a weight of one
+        no_muons = ak.to_numpy(ak.sum(self.events.Muon.pt > lepton_weights.min_pt, axis=1) == 0)
+        self.assertTrue(no_muons.any())
+        np.testing.assert_array_equal(ak.to_numpy(events.muon_weight)[no_muons], 1.0)
+
+    def test_versions(self):
+        path = self.write_correction("electron_sf", {**self.corrections["electron_sf"], "version": 3})
+
+        inst = lepton_weights(inst_dict={
+            "analysis_inst": self.config_inst.analysis,
+            "config_inst": self.config_inst,
+            "dataset_inst": self.dataset_inst,
+        })
+        bundle = DotDict.wrap({"files": {**self.paths, "electron_sf": path}})
+        with self.assertRaises(AssertionError):
+            inst.run_setup({"external_files": bundle}, {})
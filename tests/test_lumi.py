@@ -0,0 +1,65 @@
+# coding: utf-8
+
+"""
+Tests of the lumi mask in :py:mod:`h4l.selection.lumi`.
+"""
+
+__all__ = ["LumiMaskTest"]
+
+import unittest
+
+import numpy as np
+
+from h4l.selection.lumi import compile_lumi_mask, lumi_mask_lookup
+
+
+class LumiMaskTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(17)
+        # random, partly overlapping and adjacent ranges, in random order
+        cls.golden = {}
+        for run in rng.choice(np.arange(297000, 297100), 30, replace=False):
+            firsts = rng.integers(1, 400, rng.integers(1, 8))
+            cls.golden[str(run)] = [[int(first), int(first + rng.integers(0, 40))] for first in firsts]
+        cls.golden["297200"] = [[10, 20], [21, 30], [5, 12], [40, 40]]
+
+        cls.runs = rng.integers(296990, 297210, 20000)
+        cls.lumis = rng.integers(0, 460, 20000)
+
+    def expected(self, golden: dict, run: np.ndarray, lumi: np.ndarray) -> np.ndarray:
+        return np.array([
+            any(first <= ls <= last for first, last in golden.get(str(r), []))
+            for r, ls in zip(run, lumi)
+        ])
+
+    def test_lookup(self):
+        starts, stops = compile_lumi_mask(self.golden)
+        mask = lumi_mask_lookup(starts, stops, self.runs, self.lumis)
+        np.testing.assert_array_equal(mask, self.expected(self.golden, self.runs, self.lumis))
+        self.assertTrue(mask.any())
+
+    def test_merged_ranges(self):
+        starts, stops = compile_lumi_mask(self.golden)
+        # merged ranges are sorted, disjoint and not adjacent
+        self.assertTrue(np.all(starts <= stops))
+        self.assertTrue(np.all(starts[1:] > stops[:-1] + np.uint64(1)))
+
+        run = np.full(45, 297200)
+        lumi = np.arange(45)
+        np.testing.assert_array_equal(
+            lumi_mask_lookup(starts, stops, run, lumi),
+            ((lumi >= 5) & (lumi <= 30)) | (lumi == 40),
+        )
+
+    def test_edges(self):
+        starts, stops = compile_lumi_mask({"1": [[1, 1]], "2": [[0, 2**32 - 1]]})
+        np.testing.assert_array_equal(
+            lumi_mask_lookup(starts, stops, [0, 1, 1, 1, 2, 2, 3], [1, 0, 1, 2, 0, 2**32 - 1, 0]),
+            [False, False, True, False, True, True, False],
+        )
+
+    def test_empty(self):
+        starts, stops = compile_lumi_mask({})
+        np.testing.assert_array_equal(lumi_mask_lookup(starts, stops, [1, 2], [3, 4]), [False, False])
@@ -0,0 +1,205 @@
+# coding: utf-8
+
+"""
+Tests of the observable registry in :py:mod:`h4l.observables`.
+"""
+
+from __future__ import annotations
+
+__all__ = ["ObservableRegistryTest", "RequestedObservablesTest", "ObservablesTest"]
+
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+import awkward as ak
+import order as od
+from coffea.nanoevents.methods import candidate
+
+from columnflow.columnar_util import EMPTY_FLOAT
+
+from h4l.observables import (
+    ObservableRegistry, extra_observable_variables, observables, requested_observables,
+)
+from h4l.production.invariant_mass import four_lep_invariant_mass
+from h4l.util import build_zz_candidates
+from tests.synthetic import generate_events
+
+
+class ObservableRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.registry = registry = ObservableRegistry()
+
+        def register(name, value, **kwargs):
+            @registry.register(name, **kwargs)
+            def func(events, get):
+                self.calls.append(name)
+                return value(events, get)
+
+        register("a", lambda events, get: events["x"] * 2, inputs={"x"}, column=False)
+        register("b", lambda events, get: get("a") + 1, inputs={"y"}, requires={"a"})
+        register("c", lambda events, get: get("a") + get("b"), requires={"b", "a"})
+        register("d", lambda events, get: events["z"], inputs={"z"})
+
+    def test_register(self):
+        self.assertIn("a", self.registry)
+        self.assertNotIn("e", self.registry)
+        with self.assertRaises(ValueError):
+            self.registry.register("a")(lambda events, get: None)
+
+    def test_resolve(self):
+        # dependencies before their dependents, each entry once
+        self.assertEqual(self.registry.resolve(["c"]), ["a", "b", "c"])
+        self.assertEqual(self.registry.resolve(["d", "c", "b"]), ["d", "a", "b", "c"])
+        with self.assertRaises(ValueError):
+            self.registry.resolve(["e"])
+
+        self.registry.register("e", requires={"f"})(lambda events, get: None)
+        self.registry.register("f", requires={"e"})(lambda events, get: None)
+        with self.assertRaises(ValueError):
+            self.registry.resolve(["e"])
+
+    def test_inputs_and_columns(self):
+        self.assertEqual(self.registry.inputs(["c"]), {"x", "y"})
+        self.assertEqual(self.registry.inputs(["a", "d"]), {"x", "z"})
+        self.assertEqual(self.registry.columns(self.registry.resolve(["c", "d"])), ["b", "c", "d"])
+
+    def test_evaluate(self):
+        values = self.registry.evaluate({"x": 1, "z": 5}, ["c", "b", "d"])
+        self.assertEqual(values, {"c": 5, "b": 3, "d": 5})
+        # each entry, including the intermediate one, is computed once
+        self.assertEqual(sorted(self.calls), ["a", "b", "c", "d"])
+
+
+def _observables_config() -> tuple[od.Config, od.Dataset]:
+    analysis = od.Analysis("h4l_test_observables", 1)
+    config = analysis.add_config(od.Campaign("h4l_test_observables_campaign", 1))
+    for name in ["m4l", "pt4l", "y4l", "z1_delta_r"]:
+        config.add_variable(name=name, expression=name, aux={"observables": {name}})
+    config.add_variable(name="jet1_pt", expression="Jet.pt[:,0]")
+    config.add_category(name="cat_zz", id=1, aux={"observables": {"mzz"}})
+    config.x.default_observable_variables = ("m4l",)
+    dataset = od.Dataset("h4l_test_observables_dataset", 1, campaign=config.campaign, is_data=False)
+    return config, dataset
+
+
+class RequestedObservablesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config_inst, self.dataset_inst = _observables_config()
+
+    def test_defaults(self):
+        # observables of the default variables and of categories
+        self.assertEqual(requested_observables(self.config_inst), ["m4l", "mzz"])
+        self.assertEqual(requested_observables(self.config_inst, ["jet1_pt", "m4l"]), ["m4l", "mzz"])
+
+        # all variables without default variables
+        self.config_inst.x.default_observable_variables = None
+        self.assertEqual(
+            requested_observables(self.config_inst),
+            ["m4l", "mzz", "pt4l", "y4l", "z1_delta_r"],
+        )
+
+    def test_requested_variables(self):
+        self.assertEqual(requested_observables(self.config_inst, ["pt4l"]), ["m4l", "mzz", "pt4l"])
+        # multi-dimensional variables
+        self.assertEqual(
+            requested_observables(self.config_inst, ["y4l-z1_delta_r"]),
+            ["m4l", "mzz", "y4l", "z1_delta_r"],
+        )
+        with self.assertRaises(ValueError):
+            requested_observables(self.config_inst, ["unknown"])
+
+    def test_extra_observable_variables(self):
+        self.assertEqual(extra_observable_variables(self.config_inst, ["jet1_pt", "m4l"]), ())
+        self.assertEqual(
+            extra_observable_variables(self.config_inst, ["z1_delta_r", "m4l", "pt4l", "m4l-y4l"]),
+            ("m4l-y4l", "pt4l", "z1_delta_r"),
+        )
+
+    def test_producer(self):
+        def produces(task=None):
+            inst = four_lep_invariant_mass(inst_dict={
+                "analysis_inst": self.config_inst.analysis,
+                "config_inst": self.config_inst,
+                "dataset_inst": self.dataset_inst,
+                "task": task,
+            })
+            return {str(route) for route in inst.produced_columns}
+
+        self.assertEqual(produces(), {"m4l", "mzz"})
+        self.assertEqual(produces(SimpleNamespace(variables=("jet1_pt",))), {"m4l", "mzz"})
+        self.assertEqual(produces(SimpleNamespace(variables=("pt4l", "y4l"))), {"m4l", "mzz", "pt4l", "y4l"})
+
+
+class ObservablesTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        events = generate_events(2000, seed=11)
+        cands = ak.firsts(build_zz_candidates(events.Electron, events.Muon))
+        has_cand = ak.to_numpy(~ak.is_none(cands))
+        lepton_idx = np.full((len(events), 4), -1, dtype=np.int8)
+        lepton_idx[has_cand] = ak.to_numpy(cands.lepton_idx[has_cand])
+        channel = np.full(len(events), -1, dtype=np.int8)
+        channel[has_cand] = ak.to_numpy(cands.channel[has_cand])
+        zz_candidate = ak.zip({"channel": channel, "lepton_idx": lepton_idx}, depth_limit=1)
+        cls.events = ak.with_field(events, zz_candidate, "zz_candidate")
+        cls.cands = cands
+        cls.has_cand = has_cand
+
+        # four-vectors of the candidate leptons in the stored order
+        leptons = ak.concatenate([
+            ak.with_field(events.Muon, events.Muon.pfRelIso04_all, "iso"),
+            ak.with_field(events.Electron, events.Electron.pfRelIso03_all, "iso"),
+        ], axis=1)
+        leptons = ak.zip(
+            {field: leptons[field] for field in ["pt", "eta", "phi", "mass", "charge", "iso"]},
+            with_name="PtEtaPhiMCandidate",
+            behavior=candidate.behavior,
+        )[has_cand]
+        idx = lepton_idx[has_cand].astype(np.int64)
+        cls.leptons = [leptons[np.arange(len(idx)), idx[:, i]] for i in range(4)]
+
+    def evaluate(self, name: str) -> np.ndarray:
+        values = ak.to_numpy(observables.evaluate(self.events, [name])[name])
+        self.assertTrue(np.all(values[~self.has_cand] == EMPTY_FLOAT))
+        return values[self.has_cand]
+
+    def test_candidates(self):
+        # events with candidates of all channels, including 2e2mu ones with electrons as Z1
+        channel = ak.to_numpy(self.cands.channel[self.has_cand])
+        self.assertEqual(set(channel), {0, 1, 2})
+        events = self.events[self.has_cand]
+        z1_is_muon = ak.to_numpy(events.zz_candidate.lepton_idx[:, 0] < ak.num(events.Muon))
+        self.assertTrue(np.any(z1_is_muon[channel == 0]) and np.any(~z1_is_muon[channel == 0]))
+
+    def test_z_pairs(self):
+        # pairs in the stored order are those of Z1 and Z2
+        (l1, l2), (l3, l4) = observables.evaluate(self.events, ["z_pairs"])["z_pairs"]
+        for z, la, lb in [("z1", l1, l2), ("z2", l3, l4)]:
+            np.testing.assert_allclose(
+                (la + lb).mass[self.has_cand],
+                ak.to_numpy(self.cands[z].mass[self.has_cand]),
+                rtol=1e-4,
+            )
+
+    def test_observables(self):
+        l1, l2, l3, l4 = self.leptons
+        zz = l1 + l2 + l3 + l4
+        np.testing.assert_allclose(self.evaluate("pt4l"), ak.to_numpy(zz.pt), rtol=1e-4)
+        np.testing.assert_allclose(
+            self.evaluate("y4l"),
+            ak.to_numpy(0.5 * np.log((zz.t + zz.z) / (zz.t - zz.z))),
+            rtol=1e-3,
+            atol=1e-4,
+        )
+        np.testing.assert_allclose(self.evaluate("z1_delta_r"), ak.to_numpy(l1.delta_r(l2)), rtol=1e-4)
+        np.testing.assert_allclose(self.evaluate("z2_delta_r"), ak.to_numpy(l3.delta_r(l4)), rtol=1e-4)
+        np.testing.assert_allclose(
+            self.evaluate("iso4l"),
+            ak.to_numpy(l1.iso + l2.iso + l3.iso + l4.iso),
+            rtol=1e-5,
+        )
@@ -0,0 +1,107 @@
+# coding: utf-8
+
+"""
+Tests of the parallel selection in :py:mod:`h4l.parallel`.
+"""
+
+__all__ = ["ParallelCallFuncTest"]
+
+import inspect
+import json
+import unittest
+from collections import defaultdict
+
+import numpy as np
+import awkward as ak
+
+from columnflow.selection import Selector, SelectionResult, selector
+
+from h4l.parallel import parallel_call_func, slice_bounds
+from h4l.selection.stats import increment_stats_grouped
+
+
+@selector(
+    uses={"mc_weight", "process_id", "Muon.pt", increment_stats_grouped},
+    produces={"n_muons", "muon_ht", increment_stats_grouped},
+)
+def _test_selector(self: Selector, events: ak.Array, stats: dict, **kwargs) -> tuple[ak.Array, SelectionResult]:
+    muon_mask = events.Muon.pt > 10
+    events = ak.with_field(events, ak.sum(muon_mask, axis=1), "n_muons")
+    events = ak.with_field(events, ak.sum(events.Muon.pt[muon_mask], axis=1), "muon_ht")
+
+    results = SelectionResult(
+        steps={"muons": events.n_muons >= 2, "ht": ak.to_numpy(events.muon_ht > 40)},
+        objects={"Muon": {"Muon": ak.local_index(events.Muon.pt)[muon_mask]}},
+        aux={"muon_mask": muon_mask, "threshold": 10},
+    )
+    results.event = ak.to_numpy(events.n_muons >= 2)
+    events, results = self[increment_stats_grouped](
+        events,
+        results,
+        stats,
+        weight_map={
+            "num_events": Ellipsis,
+            "num_events_selected": results.event,
+            "sum_mc_weight": events.mc_weight,
+            "sum_mc_weight_selected": (events.mc_weight, results.event),
+        },
+        group_map={"process": {"values": events.process_id}},
+        **kwargs,
+    )
+    return events, results
+
+
+class ParallelCallFuncTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(29)
+        n = 1001
+        counts = rng.poisson(2.5, n)
+        cls.events = ak.Array({
+            "mc_weight": rng.normal(1.0, 0.5, n),
+            "process_id": rng.choice([101, 102], n),
+            "Muon": ak.unflatten(ak.zip({"pt": rng.exponential(20.0, int(counts.sum()))}), counts),
+        })
+
+    def select(self, n_workers: int | None) -> tuple[ak.Array, SelectionResult, dict]:
+        inst = _test_selector()
+        if n_workers:
+            inst.call_func = parallel_call_func(inst.call_func, inst.produced_columns, n_workers)
+        stats = defaultdict(float)
+        events, results = inst(self.events, stats)
+        return events, results, stats
+
+    def test_same_as_serial(self):
+        expected_events, expected_results, expected_stats = self.select(None)
+        for n_workers in [1, 3, 4]:
+            with self.subTest(n_workers=n_workers):
+                events, results, stats = self.select(n_workers)
+                for column in ["n_muons", "muon_ht"]:
+                    self.assertEqual(ak.to_list(events[column]), ak.to_list(expected_events[column]))
+                np.testing.assert_array_equal(results.event, expected_results.event)
+                self.assertEqual(ak.to_list(results.to_ak()), ak.to_list(expected_results.to_ak()))
+                self.assertEqual(ak.to_list(results.aux["muon_mask"]), ak.to_list(expected_results.aux["muon_mask"]))
+                self.assertEqual(results.aux["threshold"], 10)
+
+                # same stats, with the same number types, up to rounding of summed weights
+                stats, expected_stats_ = json.loads(json.dumps(stats)), json.loads(json.dumps(expected_stats))
+                self.assertEqual(set(stats), set(expected_stats_))
+                self.assertEqual(stats["num_events_per_process"], expected_stats_["num_events_per_process"])
+                self.assertEqual(stats["num_events_selected"], expected_stats_["num_events_selected"])
+                self.assertIsInstance(stats["num_events"], float)
+                for process_id, value in expected_stats_["sum_mc_weight_per_process"].items():
+                    self.assertAlmostEqual(stats["sum_mc_weight_per_process"][process_id], value, places=9)
+
+    def test_slice_bounds(self):
+        self.assertEqual(slice_bounds(10, 3), [(0, 3), (3, 6), (6, 10)])
+        self.assertEqual(slice_bounds(2, 4), [(0, 1), (1, 2)])
+        self.assertEqual(slice_bounds(0, 4), [])
+
+    def test_select_events_hook(self):
+        # the parallel selection replaces the call_func of the selector instance of cf.SelectEvents,
+        # which requires the task to call it once per chunk as the top-level selector
+        from columnflow.tasks.selection import SelectEvents
+        source = inspect.getsource(SelectEvents.run)
+        self.assertIn("self.selector_inst(", source)
+        self.assertIn("for ", source[:source.index("self.selector_inst(")])
@@ -0,0 +1,165 @@
+# coding: utf-8
+
+"""
+Tests of the four-lepton skims in :py:mod:`h4l.skim`.
+"""
+
+__all__ = ["SkimTreeTest"]
+
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+from collections import defaultdict
+
+import numpy as np
+import awkward as ak
+import order as od
+import uproot
+
+from columnflow.production.cms.mc_weight import mc_weight
+
+from h4l.skim import add_skimmed_stats, skim_tree
+from tests.synthetic import generate_events, write_events
+
+
+LEPTON_CUTS = {
+    "Electron": {"pt": "pt > 7", "eta": "abs(eta) < 2.5"},
+    "Muon": {"pt": "pt > 5", "eta": "abs(eta) < 2.4"},
+}
+
+PATTERNS = ["run", "luminosityBlock", "event", "Electron.*", "Muon.*", "PV.*", "genWeight", "LHEWeight.*"]
+
+
+def _nano_events(path: str, entry_start: int | None = None, entry_stop: int | None = None) -> ak.Array:
+    # read with coffea and the NanoAOD schema, as done by columnflow for nano files
+    from coffea.nanoevents import NanoEventsFactory, NanoAODSchema
+    with warnings.catch_warnings():
+        # cross-references to collections that are not part of the synthetic events
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return NanoEventsFactory.from_root(
+            {path: "Events"},
+            schemaclass=NanoAODSchema,
+            mode="eager",
+            entry_start=entry_start,
+            entry_stop=entry_stop,
+        ).events()
+
+
+class SkimTreeTest(unittest.TestCase):
+
+    n_events = 3000
+    pt_scale = 1.1
+    chunk_size = 500
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+
+        events = generate_events(cls.n_events, seed=5)
+        rng = np.random.default_rng(5)
+        # generator weights that are always one in the second chunk only, where mc_weight falls
+        # back to the LHE weights
+        gen_weight = rng.normal(1.0, 0.5, cls.n_events).astype(np.float32)
+        gen_weight[cls.chunk_size:2 * cls.chunk_size] = 1.0
+        events = ak.with_field(events, gen_weight, "genWeight")
+        events = ak.with_field(
+            events,
+            ak.zip({"originalXWGTUP": rng.normal(2.0, 0.5, cls.n_events).astype(np.float32)}),
+            "LHEWeight",
+        )
+        cls.events = events
+
+        cls.nano_path = os.path.join(cls.tmp_dir, "nano.root")
+        cls.skim_path = os.path.join(cls.tmp_dir, "skim.root")
+        write_events(events, cls.nano_path, cluster_size=250)
+        with uproot.open(cls.nano_path) as f:
+            cls.skim_stats = skim_tree(
+                f["Events"],
+                cls.skim_path,
+                PATTERNS,
+                is_mc=True,
+                lepton_cuts=LEPTON_CUTS,
+                pt_scale=cls.pt_scale,
+                chunk_size=700,
+                mc_weight_chunk_size=cls.chunk_size,
+            )
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def expected_mask(self) -> np.ndarray:
+        n_loose = 0
+        has_pair = False
+        for collection, min_pt, max_eta in [("Electron", 7.0, 2.5), ("Muon", 5.0, 2.4)]:
+            leptons = self.events[collection]
+            loose = (leptons.pt * self.pt_scale > min_pt) & (abs(leptons.eta) < max_eta)
+            charge = leptons.charge[loose]
+            n_loose = n_loose + ak.sum(loose, axis=1)
+            has_pair = has_pair | (ak.any(charge > 0, axis=1) & ak.any(charge < 0, axis=1))
+        return ak.to_numpy((n_loose >= 4) & has_pair)
+
+    def selection_stats(self, path: str, process_id: int) -> dict:
+        # number of events and sum of mc weights as obtained by SelectEvents, i.e., with mc_weight
+        # evaluated per chunk
+        analysis = od.Analysis("h4l_test_skim", 1)
+        config = analysis.add_config(od.Campaign("h4l_test_skim_campaign", 1))
+        dataset = od.Dataset("h4l_test_skim_dataset", 1, campaign=config.campaign, is_data=False)
+        producer = mc_weight(inst_dict={"config_inst": config, "dataset_inst": dataset})
+
+        stats = defaultdict(float)
+        stats["num_events_per_process"] = defaultdict(float)
+        stats["sum_mc_weight_per_process"] = defaultdict(float)
+        with uproot.open(path) as f:
+            n_entries = f["Events"].num_entries
+        for start in range(0, n_entries, self.chunk_size):
+            events = producer(_nano_events(path, start, min(start + self.chunk_size, n_entries)))
+            stats["num_events"] += len(events)
+            stats["sum_mc_weight"] += float(ak.sum(ak.values_astype(events.mc_weight, np.float64)))
+            stats["num_events_per_process"][str(process_id)] += len(events)
+            stats["sum_mc_weight_per_process"][str(process_id)] += float(
+                ak.sum(ak.values_astype(events.mc_weight, np.float64)),
+            )
+        return stats
+
+    def test_events(self):
+        mask = self.expected_mask()
+        self.assertGreater(mask.sum(), 0)
+        self.assertLess(mask.sum(), self.n_events)
+        self.assertEqual(self.skim_stats["num_events"], self.n_events)
+        self.assertEqual(self.skim_stats["num_events_skimmed"], int(mask.sum()))
+
+        # the margin keeps leptons below the pt threshold before calibration
+        loose_pt = ak.flatten(self.events.Electron.pt[mask])
+        self.assertTrue(ak.any((loose_pt > 7.0 / self.pt_scale) & (loose_pt <= 7.0)))
+
+    def test_nano_events(self):
+        # the skim must be readable with the NanoAOD schema and contain the selected events
+        skimmed = _nano_events(self.skim_path)
+        expected = self.events[self.expected_mask()]
+        self.assertEqual(len(skimmed), len(expected))
+        np.testing.assert_array_equal(ak.to_numpy(skimmed.event), ak.to_numpy(expected.event))
+        for collection in ["Electron", "Muon"]:
+            for field in ["pt", "eta", "phi", "charge"]:
+                self.assertEqual(
+                    ak.to_list(skimmed[collection][field]),
+                    ak.to_list(expected[collection][field]),
+                )
+        self.assertEqual(ak.to_list(skimmed.LHEWeight.originalXWGTUP), ak.to_list(expected.LHEWeight.originalXWGTUP))
+        self.assertEqual(ak.to_list(skimmed.PV.npvs), ak.to_list(expected.PV.npvs))
+
+    def test_stats(self):
+        # selection stats on the skim, corrected for removed events, equal those without the skim
+        process_id = 42
+        expected = self.selection_stats(self.nano_path, process_id)
+        stats = add_skimmed_stats(self.selection_stats(self.skim_path, process_id), self.skim_stats, process_id)
+        self.assertEqual(stats["num_events"], expected["num_events"])
+        self.assertEqual(stats["num_events_per_process"], expected["num_events_per_process"])
+        self.assertAlmostEqual(stats["sum_mc_weight"], expected["sum_mc_weight"], places=6)
+        self.assertAlmostEqual(
+            stats["sum_mc_weight_per_process"][str(process_id)],
+            expected["sum_mc_weight_per_process"][str(process_id)],
+            places=6,
+        )
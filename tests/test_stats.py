@@ -0,0 +1,174 @@
+# coding: utf-8
+
+"""
+Tests of the selection statistics in :py:mod:`h4l.selection.stats`.
+"""
+
+__all__ = ["IncrementStatsGroupedTest", "IncrementCutflowStatsTest"]
+
+import json
+import unittest
+from collections import defaultdict
+
+import numpy as np
+import awkward as ak
+import order as od
+
+from columnflow.selection import SelectionResult
+from columnflow.selection.stats import increment_stats
+
+from h4l.selection.stats import increment_cutflow_stats, increment_stats_grouped
+from h4l.util import pack_bits
+
+
+class IncrementStatsGroupedTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(11)
+        n = 2000
+        cls.events = ak.Array({
+            "mc_weight": rng.normal(1.0, 0.5, n),
+            "process_id": rng.choice([101, 102, 205], n),
+            "n_jets": rng.integers(0, 4, n),
+        })
+        cls.selected = rng.random(n) < 0.4
+
+    def fill(self, inst, group_fn: bool) -> dict:
+        # fill two chunks to check the accumulation
+        stats = defaultdict(float)
+        for sl in [slice(None, 700), slice(700, None)]:
+            events = self.events[sl]
+            selected = self.selected[sl]
+            weight_map = {
+                "num_events": Ellipsis,
+                "num_events_selected": selected,
+                "sum_mc_weight": events.mc_weight,
+                "sum_mc_weight_selected": (events.mc_weight, selected),
+            }
+            group_map = {
+                "process": {"values": events.process_id},
+                "njet": {"values": events.n_jets, "combinations_only": True},
+            }
+            if group_fn:
+                group_map["process"]["mask_fn"] = (lambda v, events=events: events.process_id == v)
+                group_map["njet"]["mask_fn"] = (lambda v, events=events: events.n_jets == v)
+            inst(
+                events,
+                SelectionResult(),
+                stats,
+                weight_map=weight_map,
+                group_map=group_map,
+                group_combinations=[("process", "njet")],
+            )
+        # compare plain, json-serialized structures as stored by SelectEvents
+        return json.loads(json.dumps(stats))
+
+    def assert_stats_equal(self, stats: dict, expected: dict) -> None:
+        self.assertEqual(set(stats), set(expected))
+        for key, value in expected.items():
+            if isinstance(value, dict):
+                self.assert_stats_equal(stats[key], value)
+            else:
+                self.assertEqual(type(stats[key]), type(value))
+                self.assertAlmostEqual(stats[key], value, places=8)
+
+    def test_same_stats_as_increment_stats(self):
+        upstream = increment_stats()
+        upstream.run_setup({}, {})
+        expected = self.fill(upstream, group_fn=True)
+        stats = self.fill(increment_stats_grouped(), group_fn=False)
+
+        self.assertIn("sum_mc_weight_selected_per_process_and_njet", stats)
+        self.assertNotIn("num_events_per_njet", stats)
+        self.assert_stats_equal(stats, expected)
+
+
+class IncrementCutflowStatsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(23)
+        n = 1500
+        cls.steps = ["json", "trigger", "four_leptons", "m_z"]
+        cls.masks = {step: rng.random(n) < 0.8 for step in cls.steps}
+        cls.weights = rng.normal(1.0, 0.5, n)
+        cls.process_id = rng.choice([101, 102], n)
+
+        analysis = od.Analysis("h4l_test_cutflow", 1)
+        cls.config_inst = analysis.add_config(od.Campaign("h4l_test_cutflow_campaign", 1))
+        cls.config_inst.x.selector_step_bits = {step: bit for bit, step in enumerate(cls.steps)}
+        cls.config_inst.x.selector_step_groups = {
+            "default": ["trigger", "four_leptons", "m_z"],
+            "json": ["json"],
+        }
+
+    def expected_yields(self, steps: list[str], weights: np.ndarray, sel: np.ndarray) -> dict:
+        masks = [self.masks[step] for step in steps]
+        return {
+            "cumulative": {
+                "all": np.sum(weights[sel]),
+                **{step: np.sum(weights[sel & np.all(masks[:i + 1], axis=0)]) for i, step in enumerate(steps)},
+            },
+            "n_minus_1": {
+                step: np.sum(weights[sel & np.all(masks[:i] + masks[i + 1:], axis=0)])
+                for i, step in enumerate(steps)
+            },
+        }
+
+    def test_stats(self):
+        inst = increment_cutflow_stats(inst_dict={"config_inst": self.config_inst})
+        packed = pack_bits(self.masks, self.config_inst.x.selector_step_bits)
+
+        # fill two chunks to check the accumulation
+        stats = defaultdict(float)
+        for sl in [slice(None, 600), slice(600, None)]:
+            inst(
+                ak.Array({"process_id": self.process_id[sl]}),
+                SelectionResult(),
+                stats,
+                step_bits=packed[sl],
+                weights=self.weights[sl],
+                groups=self.process_id[sl],
+            )
+        # stored as plain, json-serialized structures that are summed when merging
+        stats = json.loads(json.dumps(stats))
+
+        ones = np.ones(len(packed))
+        for group_name, steps in self.config_inst.x.selector_step_groups.items():
+            entry = stats[f"cutflow_{group_name}"]
+            self.assertEqual(
+                set(entry),
+                {"num_events", "sum_mc_weight", "num_events_per_process", "sum_mc_weight_per_process"},
+            )
+            expected = self.expected_yields(steps, ones, ones.astype(bool))
+            self.assertEqual(entry["num_events"], expected)
+            self.assertIsInstance(entry["num_events"]["cumulative"]["all"], int)
+            self.assert_yields(entry["sum_mc_weight"], self.expected_yields(steps, self.weights, ones.astype(bool)))
+            self.assertEqual(set(entry["sum_mc_weight_per_process"]), {"101", "102"})
+            for process_id in [101, 102]:
+                sel = self.process_id == process_id
+                self.assertEqual(
+                    entry["num_events_per_process"][str(process_id)],
+                    self.expected_yields(steps, ones, sel),
+                )
+                self.assert_yields(
+                    entry["sum_mc_weight_per_process"][str(process_id)],
+                    self.expected_yields(steps, self.weights, sel),
+                )
+
+    def test_unweighted(self):
+        inst = increment_cutflow_stats(inst_dict={"config_inst": self.config_inst})
+        stats = defaultdict(float)
+        inst(
+            ak.Array({"process_id": self.process_id}),
+            SelectionResult(),
+            stats,
+            step_bits=pack_bits(self.masks, self.config_inst.x.selector_step_bits),
+        )
+        self.assertEqual(set(stats["cutflow_default"]), {"num_events"})
+
+    def assert_yields(self, yields: dict, expected: dict) -> None:
+        for key in ["cumulative", "n_minus_1"]:
+            self.assertEqual(list(yields[key]), list(expected[key]))
+            np.testing.assert_allclose(list(yields[key].values()), list(expected[key].values()))
@@ -0,0 +1,534 @@
+# coding: utf-8
+
+"""
+Tests of the array helpers in :py:mod:`h4l.util`.
+"""
+
+from __future__ import annotations
+
+__all__ = [
+    "PackBitsTest", "CutflowTest", "MaskedSortedIndicesTest",
+    "SetAkColumnsTest", "ZZCandidatesTest", "BinnedThresholdMaskTest", "CutTableTest",
+    "SegmentProdTest",
+]
+
+import unittest
+from unittest import mock
+
+import numpy as np
+import awkward as ak
+from coffea.nanoevents.methods import candidate
+
+from columnflow.columnar_util import set_ak_column
+
+from h4l.util import (
+    Z_MASS, ZZ_CHANNEL_2E2MU, ZZ_CHANNEL_4E, ZZ_CHANNEL_4MU, CutTable, Cutflow, binned_threshold_mask, build_2e2mu,
+    build_4sf,
+    build_zz_candidates, build_zz_candidates_bucketed, mass_window_mask, masked_sorted_indices, pack_bits,
+    segment_prod, set_ak_columns,
+)
+
+
+def _random_leptons(
+    rng: np.random.Generator,
+    n_events: int,
+    mean: float,
+    dtype: type = np.float64,
+) -> ak.Array:
+    counts = rng.poisson(mean, n_events)
+    n = int(counts.sum())
+    leptons = ak.zip(
+        {
+            "pt": (rng.exponential(30.0, n) + 5.0).astype(dtype),
+            "eta": rng.uniform(-2.5, 2.5, n).astype(dtype),
+            "phi": rng.uniform(-np.pi, np.pi, n).astype(dtype),
+            "mass": np.full(n, 0.10566, dtype=dtype),
+            "charge": rng.choice([-1, 1], n).astype(np.int32),
+        },
+        with_name="PtEtaPhiMCandidate",
+        behavior=candidate.behavior,
+    )
+    return ak.unflatten(leptons, counts)
+
+
+class PackBitsTest(unittest.TestCase):
+
+    def test_pack_bits(self):
+        rng = np.random.default_rng(5)
+        masks = {name: rng.random(100) < 0.5 for name in ["a", "b", "c"]}
+        bits = {"a": 0, "b": 3, "c": 7}
+        packed = pack_bits(masks, bits)
+
+        self.assertEqual(packed.dtype, np.uint8)
+        for name, mask in masks.items():
+            np.testing.assert_array_equal((packed >> bits[name]) & 1, mask)
+        self.assertFalse(np.any(packed & ~np.uint8(0b10001001)))
+
+    def test_dtype(self):
+        masks = {"a": np.ones(3, dtype=bool)}
+        self.assertEqual(pack_bits(masks, {"a": 8}).dtype, np.uint16)
+        self.assertEqual(pack_bits(masks, {"a": 31}).dtype, np.uint32)
+        self.assertEqual(pack_bits(masks, {"a": 32}).dtype, np.uint64)
+        np.testing.assert_array_equal(pack_bits(masks, {"a": 63}), np.full(3, 1 << 63, dtype=np.uint64))
+
+    def test_missing_values(self):
+        packed = pack_bits({"a": ak.Array([True, None, False])}, {"a": 1})
+        np.testing.assert_array_equal(packed, [2, 0, 0])
+
+    def test_unknown_mask(self):
+        with self.assertRaises(ValueError):
+            pack_bits({"a": np.ones(3, dtype=bool)}, {"b": 0})
+
+
+class CutflowTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(7)
+        n = 1000
+        cls.steps = ["trigger", "four_leptons", "m_z", "h_window"]
+        cls.bits = {"trigger": 5, "four_leptons": 0, "m_z": 2, "h_window": 9, "unused": 1}
+        cls.masks = {step: rng.random(n) < 0.7 for step in cls.steps}
+        cls.packed = pack_bits(cls.masks, cls.bits)
+        cls.weights = rng.normal(1.0, 0.5, n)
+        cls.groups = rng.integers(0, 3, n)
+
+    def expected(self, weights: np.ndarray, sel: np.ndarray) -> dict[str, dict[str, float]]:
+        masks = np.array([self.masks[step] for step in self.steps])
+        cumulative = {"all": np.sum(weights[sel])}
+        n_minus_1 = {}
+        for i, step in enumerate(self.steps):
+            cumulative[step] = np.sum(weights[sel & np.all(masks[:i + 1], axis=0)])
+            n_minus_1[step] = np.sum(weights[sel & np.all(np.delete(masks, i, axis=0), axis=0)])
+        return {"cumulative": cumulative, "n_minus_1": n_minus_1}
+
+    def assert_table(self, table: dict, expected: dict) -> None:
+        for key in ["cumulative", "n_minus_1"]:
+            self.assertEqual(list(table[key]), list(expected[key]))
+            np.testing.assert_allclose(list(table[key].values()), list(expected[key].values()))
+
+    def test_yields(self):
+        cutflow = Cutflow(self.steps, self.bits)
+        cutflow.fill(self.packed, weights=self.weights)
+
+        all_events = np.ones(len(self.packed), dtype=bool)
+        self.assert_table(cutflow.table(), self.expected(np.ones(len(self.packed)), all_events))
+        self.assert_table(cutflow.table(weighted=True), self.expected(self.weights, all_events))
+
+    def test_groups(self):
+        cutflow = Cutflow(self.steps, self.bits)
+        # fill in two calls to check the accumulation
+        half = len(self.packed) // 2
+        for sl in [slice(None, half), slice(half, None)]:
+            cutflow.fill(self.packed[sl], weights=self.weights[sl], groups=self.groups[sl])
+
+        for group in np.unique(self.groups):
+            sel = self.groups == group
+            self.assert_table(cutflow.table(group, weighted=True), self.expected(self.weights, sel))
+        self.assert_table(
+            cutflow.table(),
+            self.expected(np.ones(len(self.packed)), np.ones(len(self.packed), dtype=bool)),
+        )
+
+    def test_too_many_steps(self):
+        with self.assertRaises(ValueError):
+            Cutflow([str(i) for i in range(17)], {str(i): i for i in range(17)})
+
+
+class MaskedSortedIndicesTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(13)
+        counts = rng.poisson(3.0, 500)
+        n = int(counts.sum())
+        # rounded values to provoke ties
+        cls.values = ak.unflatten(np.round(rng.exponential(20.0, n)).astype(np.float32), counts)
+        cls.mask = ak.unflatten(rng.random(n) < 0.6, counts)
+
+    def expected(self, ascending: bool, top_k: int | None) -> list[list[int]]:
+        idx = ak.argsort(self.values, ascending=ascending, stable=True)
+        idx = idx[self.mask[idx]]
+        return ak.to_list(idx if top_k is None else idx[:, :top_k])
+
+    def test_indices(self):
+        for ascending in [False, True]:
+            for top_k in [None, 1, 2, 4]:
+                with self.subTest(ascending=ascending, top_k=top_k):
+                    idx = masked_sorted_indices(self.mask, self.values, ascending=ascending, top_k=top_k)
+                    self.assertEqual(ak.to_list(idx), self.expected(ascending, top_k))
+
+    def test_missing_mask_values(self):
+        values = ak.Array([[3.0, 1.0, 2.0], [], [5.0]])
+        mask = ak.Array([[True, None, True], [], [None]])
+        self.assertEqual(ak.to_list(masked_sorted_indices(mask, values)), [[0, 2], [], []])
+
+    def test_invalid_top_k(self):
+        with self.assertRaises(ValueError):
+            masked_sorted_indices(self.mask, self.values, top_k=0)
+
+
+def _leaf_columns(array: ak.Array, route: tuple[str, ...] = ()) -> dict[tuple[str, ...], ak.Array]:
+    # leaf columns by route, independent of the order of fields
+    fields = ak.fields(array)
+    if not fields:
+        return {route: array}
+    return {
+        leaf_route: leaf
+        for field in fields
+        for leaf_route, leaf in _leaf_columns(array[field], route + (field,)).items()
+    }
+
+
+class SetAkColumnsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(19)
+        counts = rng.poisson(2.0, 100)
+        n = int(counts.sum())
+        cls.events = ak.Array({
+            "event": np.arange(100, dtype=np.uint64),
+            "Muon": ak.unflatten(ak.zip({"pt": rng.exponential(20.0, n), "eta": rng.normal(0.0, 1.0, n)}), counts),
+            "zz_candidate": ak.zip({"mzz": rng.normal(125.0, 5.0, 100)}),
+        })
+        cls.columns = {
+            # new flat, jagged and nested columns
+            "m4l": (rng.normal(125.0, 5.0, 100), np.float32),
+            "Muon.is_tight": ak.unflatten(rng.random(n) < 0.5, counts),
+            "zz_candidate.channel": rng.integers(0, 3, 100).astype(np.int8),
+            "zz_candidate.lepton_idx": np.full((100, 4), -1, dtype=np.int8),
+            "weights.nominal.value": np.ones(100),
+            # replaced columns, also with a type cast
+            "event": np.arange(100, 200, dtype=np.uint64),
+            "zz_candidate.mzz": (rng.normal(125.0, 5.0, 100), np.float32),
+        }
+
+    def test_same_as_set_ak_column(self):
+        expected = self.events
+        for route, value in self.columns.items():
+            value, value_type = value if isinstance(value, tuple) else (value, None)
+            expected = set_ak_column(expected, route, value, value_type=value_type)
+
+        # replaced columns keep their position, unlike with set_ak_column, so compare leaf columns
+        columns = _leaf_columns(set_ak_columns(self.events, self.columns))
+        expected = _leaf_columns(expected)
+        self.assertEqual(set(columns), set(expected))
+        for route, column in columns.items():
+            self.assertEqual(str(ak.type(column)), str(ak.type(expected[route])))
+            self.assertEqual(ak.to_list(column), ak.to_list(expected[route]))
+        # inputs are not modified
+        self.assertNotIn("m4l", self.events.fields)
+
+    def test_empty(self):
+        self.assertIs(set_ak_columns(self.events, {}), self.events)
+
+    def test_invalid_columns(self):
+        with self.assertRaises(ValueError):
+            set_ak_columns(self.events, {"m4l": np.zeros(99)})
+        with self.assertRaises(ValueError):
+            set_ak_columns(self.events, {"a": np.zeros(100), "a.b": np.zeros(100)})
+        with self.assertRaises(ValueError):
+            set_ak_columns(self.events, {"a.b": np.zeros(100), "a": np.zeros(100)})
+
+
+class ZZCandidatesTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(23)
+        # float32 as in NanoAOD, including events without leptons and with more than four leptons
+        cls.electrons = _random_leptons(rng, 3000, 2.5, np.float32)
+        cls.muons = _random_leptons(rng, 3000, 2.5, np.float32)
+        cls.windows = {
+            "m_z": (("mz1", 12.0, 120.0), ("mz2", 12.0, 120.0)),
+            "m_z1": ("mz1", 40.0, None),
+            "m_zz": ("mzz", 70.0, None),
+            "h_window": ("mzz", 105.0, 140.0),
+        }
+
+        # all candidates of the coffea builders per channel
+        e_plus, e_minus = cls.electrons[cls.electrons.charge > 0], cls.electrons[cls.electrons.charge < 0]
+        mu_plus, mu_minus = cls.muons[cls.muons.charge > 0], cls.muons[cls.muons.charge < 0]
+        cls.reference = {
+            ZZ_CHANNEL_2E2MU: build_2e2mu(mu_plus, mu_minus, e_plus, e_minus),
+            ZZ_CHANNEL_4E: build_4sf(e_plus, e_minus),
+            ZZ_CHANNEL_4MU: build_4sf(mu_plus, mu_minus),
+        }
+
+        n_leptons = ak.to_numpy(ak.num(cls.electrons) + ak.num(cls.muons))
+        n_max = ak.to_numpy(np.maximum(ak.num(cls.electrons), ak.num(cls.muons)))
+        assert np.any(n_leptons == 0) and np.any(n_leptons == 4) and np.any(n_max > 4)
+
+    def builders(self):
+        yield "kernel", lambda *args, **kwargs: build_zz_candidates(*args, **kwargs)
+        # small batches to process the events with more than four leptons in several sub-batches
+        yield "bucketed", lambda *args, **kwargs: build_zz_candidates_bucketed(*args, batch_size=100, **kwargs)
+
+    def test_best_candidates(self):
+        for name, builder in self.builders():
+            cands = builder(self.electrons, self.muons)
+            for channel, ref in self.reference.items():
+                with self.subTest(builder=name, channel=channel):
+                    # best candidate, i.e., the first one with the Z1 mass closest to the Z mass
+                    best = ak.firsts(ref[ak.argmin(abs(ref.z1.mass - Z_MASS), axis=1, keepdims=True)])
+                    chosen = ak.firsts(cands[cands.channel == channel])
+                    has_cand = ak.to_numpy(~ak.is_none(chosen.channel))
+                    np.testing.assert_array_equal(has_cand, ak.to_numpy(~ak.is_none(best.z1.mass)))
+                    for z in ["z1", "z2", "zz"]:
+                        for field in ["x", "y", "z", "t", "mass"]:
+                            np.testing.assert_array_equal(
+                                ak.to_numpy(chosen[z][field][has_cand]),
+                                ak.to_numpy(getattr(best[z], field)[has_cand]),
+                            )
+
+    def test_lepton_indices(self):
+        for name, builder in self.builders():
+            cands = builder(self.electrons, self.muons)
+            # indices refer to the muons followed by the electrons of each event
+            leptons = ak.concatenate([self.muons, self.electrons], axis=1)
+            for channel, n_muons in [(ZZ_CHANNEL_2E2MU, 2), (ZZ_CHANNEL_4E, 0), (ZZ_CHANNEL_4MU, 4)]:
+                with self.subTest(builder=name, channel=channel):
+                    chosen = cands[cands.channel == channel]
+                    idx = chosen.lepton_idx
+                    l1, l2, l3, l4 = (leptons[idx[:, :, i]] for i in range(4))
+                    for z, la, lb in [("z1", l1, l2), ("z2", l3, l4)]:
+                        np.testing.assert_allclose(
+                            ak.to_numpy(ak.flatten((la + lb).mass)),
+                            ak.to_numpy(ak.flatten(chosen[z].mass)),
+                            rtol=1e-4,
+                        )
+                        self.assertTrue(ak.all(la.charge > 0) and ak.all(lb.charge < 0))
+
+                    # Z1 and Z2 are pairs of the same flavour
+                    is_muon = ak.to_numpy(ak.flatten(idx < ak.num(self.muons), axis=1))
+                    np.testing.assert_array_equal(is_muon[:, 0], is_muon[:, 1])
+                    np.testing.assert_array_equal(is_muon[:, 2], is_muon[:, 3])
+                    np.testing.assert_array_equal(is_muon.sum(axis=1), n_muons)
+
+    def test_mass_window_bits(self):
+        # windows are evaluated on all pairings of all channels
+        z1, z2, zz = (
+            ak.concatenate([ref[z].mass for ref in self.reference.values()], axis=1)
+            for z in ["z1", "z2", "zz"]
+        )
+        expected = {
+            "m_z": ak.any((12 < z1) & (z1 < 120) & (12 < z2) & (z2 < 120), axis=1),
+            "m_z1": ak.any(z1 > 40, axis=1),
+            "m_zz": ak.any(zz > 70, axis=1),
+            "h_window": ak.any((zz > 105) & (zz < 140), axis=1),
+        }
+        for name, builder in self.builders():
+            cands, bits = builder(self.electrons, self.muons, windows=self.windows)
+            self.assertEqual(bits.dtype, np.uint8)
+            self.assertEqual(ak.to_list(cands), ak.to_list(builder(self.electrons, self.muons)))
+            for window, mask in expected.items():
+                with self.subTest(builder=name, window=window):
+                    np.testing.assert_array_equal(
+                        mass_window_mask(bits, self.windows, window),
+                        ak.to_numpy(mask),
+                    )
+
+    def test_empty_events(self):
+        for name, builder in self.builders():
+            with self.subTest(builder=name):
+                cands, bits = builder(self.electrons[:0], self.muons[:0], windows=self.windows)
+                self.assertEqual(len(cands), 0)
+                self.assertEqual(len(bits), 0)
+
+                no_leptons = ak.num(self.electrons) + ak.num(self.muons) == 0
+                cands, bits = builder(self.electrons[no_leptons], self.muons[no_leptons], windows=self.windows)
+                self.assertEqual(ak.to_list(ak.num(cands)), [0] * int(ak.sum(no_leptons)))
+                self.assertFalse(np.any(bits))
+
+
+class BinnedThresholdMaskTest(unittest.TestCase):
+
+    # UL working point of the electron MVA as in the config
+    wp = {
+        "pt_edges": [10.0],
+        "abs_eta_sc_edges": [0.8, 1.479],
+        "thresholds": [
+            [0.9128577458, 0.9056792368, 0.9439440575],
+            [0.1559788054, 0.0273863727, -0.5532483665],
+        ],
+    }
+
+    def expected(self, pt: np.ndarray, abs_eta: np.ndarray, score: np.ndarray) -> np.ndarray:
+        # explicit per-bin comparisons with python floats, i.e., in the type of the inputs
+        (t00, t01, t02), (t10, t11, t12) = self.wp["thresholds"]
+        low_pt, high_pt = pt <= 10.0, pt > 10.0
+        eta0, eta1, eta2 = abs_eta < 0.8, (abs_eta >= 0.8) & (abs_eta < 1.479), abs_eta >= 1.479
+        return (
+            (low_pt & eta0 & (score > t00)) |
+            (low_pt & eta1 & (score > t01)) |
+            (low_pt & eta2 & (score > t02)) |
+            (high_pt & eta0 & (score > t10)) |
+            (high_pt & eta1 & (score > t11)) |
+            (high_pt & eta2 & (score > t12))
+        )
+
+    def test_bin_edges(self):
+        # pt bins include their upper edge, eta bins their lower edge
+        pt = np.array([10.0, 10.0, 10.0, np.nextafter(10.0, 11.0)])
+        abs_eta = np.array([0.0, 0.8, 1.479, 0.0])
+        score = np.full(4, 0.92)
+        np.testing.assert_array_equal(binned_threshold_mask(pt, abs_eta, score, self.wp), [True, True, False, True])
+        np.testing.assert_array_equal(
+            binned_threshold_mask(pt, np.nextafter(abs_eta, -1.0), score, self.wp),
+            [True, True, True, True],
+        )
+
+    def test_outside_binning(self):
+        pt = np.array([0.0, -1.0, 1e6, 1e6, 5.0])
+        abs_eta = np.array([0.0, 3.0, 0.0, 10.0, 1e6])
+        score = np.array([0.95, 0.95, 0.2, -0.5, 0.94])
+        np.testing.assert_array_equal(
+            binned_threshold_mask(pt, abs_eta, score, self.wp),
+            [True, True, True, True, False],
+        )
+
+    def test_threshold_is_exclusive(self):
+        thresholds = np.array(self.wp["thresholds"])
+        pt = np.repeat([5.0, 20.0], 3)
+        abs_eta = np.tile([0.4, 1.0, 2.0], 2)
+        mask = binned_threshold_mask(pt, abs_eta, thresholds.ravel(), self.wp)
+        self.assertFalse(np.any(mask))
+        mask = binned_threshold_mask(pt, abs_eta, np.nextafter(thresholds.ravel(), 1.0), self.wp)
+        self.assertTrue(np.all(mask))
+
+    def test_float32(self):
+        rng = np.random.default_rng(29)
+        n = 100000
+        thresholds = np.array(self.wp["thresholds"], dtype=np.float32).ravel()
+        # values at and around the edges and thresholds in float32
+        pt = rng.choice(np.array([9.9999995, 10.0, 10.000001, 5.0, 50.0], dtype=np.float32), n)
+        abs_eta = rng.choice(np.array([0.79999995, 0.8, 0.8000001, 1.4789999, 1.479, 1.4790001], dtype=np.float32), n)
+        score = rng.choice(np.concatenate([thresholds, np.nextafter(thresholds, np.float32(2.0))]), n)
+        self.assertEqual(score.dtype, np.float32)
+
+        mask = binned_threshold_mask(pt, abs_eta, score, self.wp)
+        np.testing.assert_array_equal(mask, self.expected(pt, abs_eta, score))
+        self.assertTrue(mask.any() and not mask.all())
+
+
+class CutTableTest(unittest.TestCase):
+
+    cuts = {
+        "pt": "pt > 5",
+        "eta": "abs(eta) < 2.4",
+        "global_or_tracker": "isGlobal | (isTracker & nStations > 0)",
+        "not_standalone_only": "~isStandalone | (nTrackerLayers > 0)",
+        "id": "((pt > 200) & highPtId > 0) | isPFcand",
+        "dxy": "-dxy <= 0.5",
+        "iso": "(pfRelIso03_all < 0.35) ^ (nStations == 2)",
+        "arithmetic": "pfRelIso03_all * pt / 2 >= 0.5 * nStations - 1",
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(19)
+        counts = rng.poisson(3.0, 1000)
+        n = int(counts.sum())
+        cls.columns = {
+            "pt": rng.exponential(40.0, n).astype(np.float32),
+            "eta": rng.uniform(-3.0, 3.0, n).astype(np.float32),
+            "dxy": rng.normal(0.0, 0.5, n).astype(np.float32),
+            "pfRelIso03_all": rng.exponential(0.3, n).astype(np.float32),
+            "isGlobal": rng.random(n) < 0.5,
+            "isTracker": rng.random(n) < 0.5,
+            "isStandalone": rng.random(n) < 0.5,
+            "isPFcand": rng.random(n) < 0.5,
+            "nStations": rng.integers(0, 4, n).astype(np.int32),
+            "nTrackerLayers": rng.integers(0, 3, n).astype(np.int32),
+            "highPtId": rng.integers(0, 3, n).astype(np.uint8),
+        }
+        cls.collection = ak.unflatten(ak.zip(cls.columns), counts)
+
+    def expected(self) -> np.ndarray:
+        # with python operator precedence as on numpy arrays, i.e., "a & b > 0" is "(a & b) > 0"
+        c = self.columns
+        return (
+            (c["pt"] > 5) &
+            (np.abs(c["eta"]) < 2.4) &
+            (c["isGlobal"] | ((c["isTracker"] & c["nStations"]) > 0)) &
+            (~c["isStandalone"] | (c["nTrackerLayers"] > 0)) &
+            ((((c["pt"] > 200) & c["highPtId"]) > 0) | c["isPFcand"]) &
+            (-c["dxy"] <= 0.5) &
+            ((c["pfRelIso03_all"] < 0.35) ^ (c["nStations"] == 2)) &
+            (c["pfRelIso03_all"] * c["pt"] / 2 >= 0.5 * c["nStations"] - 1)
+        )
+
+    def test_columns(self):
+        self.assertEqual(CutTable(self.cuts).columns, sorted(self.columns))
+
+    def test_kernel(self):
+        table = CutTable(self.cuts)
+        self.assertIsNotNone(table._kernel)
+        mask = table(self.collection)
+        self.assertEqual(ak.to_list(ak.num(mask)), ak.to_list(ak.num(self.collection)))
+        expected = self.expected()
+        self.assertTrue(expected.any() and not expected.all())
+        np.testing.assert_array_equal(ak.to_numpy(ak.flatten(mask)), expected)
+
+    def test_single_cuts(self):
+        # each cut on its own, to compare operators on booleans separately
+        for name, expr in self.cuts.items():
+            with self.subTest(cut=name):
+                mask = ak.to_numpy(ak.flatten(CutTable({name: expr})(self.collection)))
+                with mock.patch("h4l.util.nb", None):
+                    fallback = ak.to_numpy(ak.flatten(CutTable({name: expr})(self.collection)))
+                np.testing.assert_array_equal(mask, fallback)
+
+    def test_without_numba(self):
+        with mock.patch("h4l.util.nb", None):
+            table = CutTable(self.cuts)
+        self.assertIsNone(table._kernel)
+        np.testing.assert_array_equal(ak.to_numpy(ak.flatten(table(self.collection))), self.expected())
+
+    def test_empty(self):
+        mask = CutTable({})(self.collection)
+        self.assertTrue(ak.all(mask))
+        self.assertEqual(ak.to_list(ak.num(mask)), ak.to_list(ak.num(self.collection)))
+
+        empty = ak.unflatten(ak.zip({"pt": np.zeros(0, dtype=np.float32)}), np.zeros(3, dtype=np.int64))
+        self.assertEqual(ak.to_list(CutTable({"pt": "pt > 5"})(empty)), [[], [], []])
+
+    def test_missing_columns(self):
+        table = CutTable(self.cuts)
+        with self.assertRaisesRegex(ValueError, "nStations, nTrackerLayers"):
+            table(self.collection[[c for c in self.columns if c not in ("nStations", "nTrackerLayers")]])
+
+    def test_unsupported_syntax(self):
+        for expr, msg in [
+            ("(pt > 5) and (eta < 2)", "unsupported syntax 'BoolOp'"),
+            ("not isGlobal", "unsupported syntax 'Not'"),
+            ("5 < pt < 10", "chained comparison"),
+            ("pt if isGlobal else eta", "unsupported syntax 'IfExp'"),
+            ("pt.max() > 5", "unsupported call"),
+            ("sqrt(pt) > 5", "unsupported call 'sqrt\\(pt\\)'"),
+            ("pt[0] > 5", "unsupported syntax 'Subscript'"),
+            ("pt > '5'", "unsupported constant"),
+        ]:
+            with self.subTest(expr=expr):
+                with self.assertRaisesRegex(ValueError, f"{msg}.* in cut 'test': "):
+                    CutTable({"test": expr})
+
+
+class SegmentProdTest(unittest.TestCase):
+
+    def test_prod(self):
+        rng = np.random.default_rng(41)
+        counts = rng.poisson(1.5, 500)
+        counts[:3] = 0
+        values = rng.uniform(0.5, 1.5, (int(counts.sum()), 3))
+
+        prods = segment_prod(values, counts)
+        self.assertEqual(prods.shape, (len(counts), 3))
+        expected = ak.prod(ak.unflatten(values, counts), axis=1, mask_identity=False)
+        np.testing.assert_allclose(prods, ak.to_numpy(expected), rtol=1e-12)
+        np.testing.assert_array_equal(prods[:3], 1.0)
+
+    def test_empty(self):
+        np.testing.assert_array_equal(segment_prod(np.zeros(0), np.zeros(4, dtype=int)), np.ones(4))
+        self.assertEqual(segment_prod(np.zeros((0, 2)), np.zeros(0, dtype=int)).shape, (0, 2))